@@ -2,21 +2,91 @@ from fastapi import FastAPI, Request, HTTPException
 from starlette.exceptions import HTTPException as StarletteHTTPException
 from fastapi.responses import HTMLResponse, JSONResponse
 from routes.models import router as models_router   
-from routes.chatcompletions import router as chatcompletions_router
+from routes.chatcompletions import CHAT_COMPLETIONS_PATH, parse_request, router as chatcompletions_router
+from routes.status import router as status_router
+from routes.metrics import ADMIN_PATHS, router as metrics_router
+from routes.jobs import router as jobs_router
 from fastapi.middleware.cors import CORSMiddleware
-from utils.mongo import get_user_by_api_key
+from utils.mongo import get_user_by_api_key, close_redis_client, AUTH_FIELDS
+from utils import mongo
+from utils.auth_cache import AUTH_CACHE_ENABLED, listen_for_invalidations
+from utils.discord_webhook import webhook_pipeline
+from utils.provider_selector import reload_providers
+from utils.ratelimit import RATE_LIMITS, RATE_LIMIT_WINDOW, rate_limiter
+from utils.capture import TRAFFIC_CAPTURE, request_shape, traffic_capture
+from utils.response_cache import CachedResponse, file_stamp, response_cache
+from utils.model_config import model_config
+from utils.proxy_pool import proxy_pool
+from utils.baseprovider import close_http_sessions
+from utils.jobs import JOBS_WORKER, job_worker
+from utils.schemas import MAX_BODY_BYTES
+from utils.timing import SERVER_TIMING, span, start_timer, timing_exposed, timing_profiler
+from utils import metrics
+from contextlib import asynccontextmanager
+import asyncio
+import logging
+import signal
 import time
-from collections import defaultdict
 
-RATE_LIMITS = {
-    "free": 8,
-    "premium": 30,
-    "enterprise": 60
-}
+logger = logging.getLogger(__name__)
 
-request_history = defaultdict(list)
+def reload_providers_in_background() -> None:
+    # Reimporting every provider module is slow, so a SIGUSR1 reload runs on
+    # a thread; the registry lock serialises it and swaps the new index in whole.
+    future = asyncio.get_running_loop().run_in_executor(None, reload_providers, True)
+    future.add_done_callback(_log_reload_failure)
 
-app = FastAPI(docs_url=None)
+def _log_reload_failure(future) -> None:
+    if not future.cancelled() and future.exception() is not None:
+        logger.error(f"Provider reload failed: {future.exception()}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    reload_providers()
+    webhook_pipeline.start()
+    metrics.registry.start()
+    model_config.start()
+    proxy_pool.start()
+    timing_profiler.start()
+    if JOBS_WORKER:
+        job_worker.start()
+    if TRAFFIC_CAPTURE:
+        traffic_capture.start()
+    if mongo.usage_write_behind is not None:
+        mongo.usage_write_behind.start()
+    if mongo.USAGE_RESET_SCHEDULER:
+        mongo.usage_reset_scheduler.start()
+    invalidation_listener = None
+    if AUTH_CACHE_ENABLED:
+        invalidation_listener = asyncio.create_task(listen_for_invalidations(mongo.get_redis_client()))
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGUSR1, reload_providers_in_background)
+        loop.add_signal_handler(signal.SIGUSR2, model_config.reload)
+    except (NotImplementedError, AttributeError, RuntimeError):
+        pass
+    yield
+    if invalidation_listener is not None:
+        invalidation_listener.cancel()
+    if mongo.usage_write_behind is not None:
+        await mongo.usage_write_behind.stop()
+    if mongo.USAGE_RESET_SCHEDULER:
+        await mongo.usage_reset_scheduler.stop()
+    await webhook_pipeline.stop()
+    await metrics.registry.stop()
+    await model_config.stop()
+    await proxy_pool.stop()
+    await timing_profiler.stop()
+    if JOBS_WORKER:
+        await job_worker.stop()
+    await close_http_sessions()
+    if TRAFFIC_CAPTURE:
+        await traffic_capture.stop()
+    await close_redis_client()
+
+TEMPLATE_CACHE_CONTROL = "public, max-age=300"
+
+app = FastAPI(docs_url=None, lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -28,6 +98,9 @@ app.add_middleware(
 
 app.include_router(models_router)
 app.include_router(chatcompletions_router)
+app.include_router(status_router)
+app.include_router(metrics_router)
+app.include_router(jobs_router)
 @app.exception_handler(HTTPException)
 async def custom_404_handler(request: Request, exc: HTTPException):
     if exc.status_code == 404:
@@ -46,6 +119,16 @@ async def custom_404_handler(request: Request, exc: HTTPException):
             status_code=exc.status_code,
             content={"error": True, "message": exc.detail}
         )
+    if exc.status_code == 503:
+        return JSONResponse(
+            status_code=exc.status_code,
+            content={"error": True, "message": exc.detail},
+            headers=exc.headers
+        )
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"error": True, "message": exc.detail}
+    )
 
 @app.middleware("http")
 async def rate_limit_middleware(request: Request, call_next):
@@ -55,48 +138,177 @@ async def rate_limit_middleware(request: Request, call_next):
     if request.url.path in ["/v1/models", "/v1/models/", "v1/models", "v1/models/"] and request.method == "GET":
         return await call_next(request)
 
+    if request.url.path in ADMIN_PATHS:
+        return await call_next(request)
+
     if request.headers.get("Authorization"):
         api_key = request.headers.get("Authorization").split(" ")[1]
     else:
         return await call_next(request)
 
-    user = await get_user_by_api_key(api_key)
+    with span("auth"):
+        user = await get_user_by_api_key(api_key, AUTH_FIELDS)
     if not user:
         return JSONResponse(
             status_code=401,
             content={"error": True, "message": "Invalid API key"}
         )
+    request.state.user = user
 
     rate_limit = RATE_LIMITS.get(user["plan"], RATE_LIMITS["free"])
-    
-    current_time = time.time()
-    request_history[api_key] = [
-        timestamp for timestamp in request_history[api_key]
-        if current_time - timestamp < 60
-    ]
-    
-    if len(request_history[api_key]) >= rate_limit:
+    with span("rate_limit"):
+        result = await rate_limiter.hit(api_key, rate_limit, RATE_LIMIT_WINDOW)
+
+    if not result.allowed:
+        metrics.RATE_LIMITED.inc(user["plan"])
         return JSONResponse(
             status_code=429,
             content={
                 "error": True,
                 "message": f"Rate limit exceeded. Maximum {rate_limit} requests per minute allowed for {user['plan']} plan."
-            }
+            },
+            headers=result.headers()
         )
-    
-    request_history[api_key].append(current_time)
-    
+
+    response = await call_next(request)
+    response.headers.update(result.headers())
+    return response
+
+# Registered after the rate limiter so it runs first: a malformed or oversized
+# chat request is refused before the user lookup and rate limit hit Redis.
+@app.middleware("http")
+async def chat_request_middleware(request: Request, call_next):
+    if request.method == "POST" and request.url.path == CHAT_COMPLETIONS_PATH:
+        try:
+            request.state.chat_request = await parse_request(request)
+        except HTTPException as e:
+            return JSONResponse(status_code=e.status_code, content={"error": True, "message": e.detail})
+    return await call_next(request)
+
+# Registered after chat_request_middleware so the Content-Length check comes
+# before the body is read at all.
+@app.middleware("http")
+async def body_limit_middleware(request: Request, call_next):
+    content_length = request.headers.get("content-length")
+    if content_length is not None:
+        try:
+            too_large = int(content_length) > MAX_BODY_BYTES
+        except ValueError:
+            return JSONResponse(status_code=400, content={"error": True, "message": "Invalid Content-Length header"})
+        if too_large:
+            return JSONResponse(
+                status_code=413,
+                content={"error": True, "message": f"Request body is larger than {MAX_BODY_BYTES} bytes"}
+            )
     return await call_next(request)
 
+async def capture_middleware(request: Request, call_next):
+    if request.method == "OPTIONS" or not traffic_capture.sampled():
+        return await call_next(request)
+    start = time.time()
+    started = time.perf_counter()
+    response = await call_next(request)
+
+    def record() -> None:
+        traffic_capture.record(request_shape(request, response.status_code, start, time.perf_counter() - started))
+
+    chat_request = getattr(request.state, "chat_request", None)
+    if not (isinstance(chat_request, dict) and chat_request.get("stream")):
+        record()
+        return response
+
+    # Streams are recorded once the body has been sent, so the duration covers it.
+    body = response.body_iterator
+
+    async def recorded_body():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            record()
+
+    response.body_iterator = recorded_body()
+    return response
+
+# Off by default: skips the extra middleware entirely unless capturing.
+if TRAFFIC_CAPTURE:
+    app.middleware("http")(capture_middleware)
+
+async def timing_middleware(request: Request, call_next):
+    # The timer lives in a contextvar, so spans anywhere below this
+    # middleware (rate limiter, route, user store) land on this request.
+    timer = start_timer()
+    profiled = timing_profiler.enabled and timing_profiler.sampled(request.headers)
+    mark = timing_profiler.mark() if profiled else 0
+    response = await call_next(request)
+
+    def record() -> None:
+        if not profiled:
+            return
+        route = request.scope.get("route")
+        chat_request = getattr(request.state, "chat_request", None)
+        timing_profiler.record(
+            timer, mark,
+            route=getattr(route, "path", "unmatched"),
+            status=response.status_code,
+            model=chat_request.get("model") if isinstance(chat_request, dict) else None,
+            provider=getattr(request.state, "provider", None),
+        )
+
+    if not response.headers.get("content-type", "").startswith("text/event-stream"):
+        if timing_exposed(request.headers):
+            response.headers["Server-Timing"] = timer.header()
+        record()
+        return response
+
+    # Stream headers are already decided; the route appends a timing event
+    # instead, and the profile is written once the body is done.
+    body = response.body_iterator
+
+    async def timed_body():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            record()
+
+    response.body_iterator = timed_body()
+    return response
+
+if SERVER_TIMING or timing_profiler.enabled:
+    app.middleware("http")(timing_middleware)
+
+# Registered last so it wraps the rate limiter and sees its 401/429 responses too.
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    metrics.HTTP_IN_FLIGHT.inc()
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        metrics.HTTP_IN_FLIGHT.dec()
+        # Label by route template rather than raw path to keep cardinality bounded.
+        route = request.scope.get("route")
+        label = getattr(route, "path", "unmatched")
+        metrics.HTTP_REQUESTS.inc(label, request.method, status)
+        metrics.HTTP_DURATION.observe(time.perf_counter() - start, label)
+
+def serve_template(request: Request, path: str):
+    def build() -> CachedResponse:
+        with open(path, "rb") as file:
+            return CachedResponse(file.read(), "text/html; charset=utf-8", TEMPLATE_CACHE_CONTROL)
+    return response_cache.get(path, file_stamp(path), build).respond(request)
+
 @app.get("/", response_class=HTMLResponse)
-async def read_index():
-    with open("templates/index.html", "r") as file:
-        return HTMLResponse(content=file.read(), status_code=200)
+async def read_index(request: Request):
+    return serve_template(request, "templates/index.html")
 
 @app.get("/docs", response_class=HTMLResponse)
-async def read_docs():
-    with open("templates/docs.html", "r") as file:
-        return HTMLResponse(content=file.read(), status_code=200)
+async def read_docs(request: Request):
+    return serve_template(request, "templates/docs.html")
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,57 @@
+import argparse
+import json
+from typing import Optional
+
+# (label, path into a workload result, higher is better)
+FIELDS = [
+    ("rps", ("rps",), True),
+    ("latency p50", ("latency", "p50"), False),
+    ("latency p95", ("latency", "p95"), False),
+    ("latency p99", ("latency", "p99"), False),
+    ("ttfb p50", ("ttfb", "p50"), False),
+    ("ttfb p99", ("ttfb", "p99"), False),
+    ("loop lag p99", ("loop_lag", "p99"), False),
+    ("loop lag max", ("loop_lag", "max"), False),
+]
+
+def _get(result: dict, path: tuple) -> Optional[float]:
+    for part in path:
+        if not isinstance(result, dict):
+            return None
+        result = result.get(part)
+    return result
+
+def compare(base: dict, head: dict, threshold: float) -> list:
+    rows = []
+    for name in sorted(set(base["workloads"]) & set(head["workloads"])):
+        for label, path, higher_is_better in FIELDS:
+            before = _get(base["workloads"][name], path)
+            after = _get(head["workloads"][name], path)
+            if before is None or after is None:
+                continue
+            change = (after - before) / before if before else 0.0
+            worse = change < -threshold if higher_is_better else change > threshold
+            rows.append((name, label, before, after, change, worse))
+    return rows
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare two bench.run result files.")
+    parser.add_argument("base")
+    parser.add_argument("head")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative change flagged as a regression")
+    args = parser.parse_args()
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.head) as f:
+        head = json.load(f)
+
+    print(f"{base['commit']} -> {head['commit']}")
+    regressions = 0
+    for name, label, before, after, change, worse in compare(base, head, args.threshold):
+        regressions += worse
+        print(f"{name:10} {label:14} {before:12.4f} {after:12.4f} {change:+8.1%}{'  REGRESSION' if worse else ''}")
+    raise SystemExit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import asyncio
+import random
+from typing import List, Optional
+from utils.baseprovider import BaseProvider
+from utils.common import generate_response
+
+WORDS = ("lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit")
+
+class BenchProvider(BaseProvider):
+    # Stands in for an upstream: waits `latency` seconds (+/- jitter) before the
+    # first token, then emits `tokens` tokens at `token_rate` tokens/second.
+    # `failure_rate` of calls fail before producing anything.
+    def __init__(
+        self,
+        models: List[str],
+        latency: float = 0.2,
+        jitter: float = 0.1,
+        token_rate: float = 50.0,
+        tokens: int = 64,
+        failure_rate: float = 0.0,
+        slots: Optional[int] = None,
+        seed: Optional[int] = None,
+    ):
+        self.models = list(models)
+        self.supports_streaming = True
+        self.priority = True
+        self.max_concurrency = slots
+        self.latency = latency
+        self.jitter = jitter
+        self.token_rate = token_rate
+        self.tokens = tokens
+        self.failure_rate = failure_rate
+        self.calls = 0
+        self.failures = 0
+        self._random = random.Random(seed)
+
+    def _token(self, index: int) -> str:
+        return f"{WORDS[index % len(WORDS)]} "
+
+    async def create_chat_completion(self, args):
+        self.calls += 1
+        model = args.get("model", self.models[0])
+        delay = self.latency * (1 + self._random.uniform(-self.jitter, self.jitter))
+        await asyncio.sleep(max(0.0, delay))
+        if self._random.random() < self.failure_rate:
+            self.failures += 1
+            raise RuntimeError("Synthetic upstream failure")
+
+        interval = 1.0 / self.token_rate if self.token_rate > 0 else 0.0
+        if args.get("stream", False):
+            for index in range(self.tokens):
+                if index and interval:
+                    await asyncio.sleep(interval)
+                yield self._token(index)
+        else:
+            await asyncio.sleep(interval * self.tokens)
+            yield generate_response("".join(self._token(i) for i in range(self.tokens)), model)
@@ -0,0 +1,132 @@
+import asyncio
+import itertools
+import json
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+import aiohttp
+
+@dataclass
+class Sample:
+    status: int
+    latency: float
+    ttfb: Optional[float]
+    chunks: int = 0
+    size: int = 0
+    error: str = ""
+
+    @property
+    def ok(self) -> bool:
+        return self.status == 200 and not self.error
+
+def percentile(values: Sequence[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+def build_request(model: str, stream: bool, index: int, unique: bool) -> bytes:
+    # Unique prompts by default so the completion cache and request coalescing
+    # do not turn the benchmark into a cache benchmark.
+    content = f"Benchmark request {index}" if unique else "Benchmark request"
+    return json.dumps({
+        "model": model,
+        "messages": [{"role": "user", "content": content}],
+        "stream": stream,
+    }).encode()
+
+async def send_request(
+    session: aiohttp.ClientSession,
+    url: str,
+    api_key: str,
+    body: Optional[bytes],
+    stream: bool,
+    method: str = "POST",
+    path: str = "/v1/chat/completions",
+) -> Sample:
+    headers = {"Authorization": f"Bearer {api_key}"}
+    if body is not None:
+        headers["Content-Type"] = "application/json"
+    start = time.perf_counter()
+    ttfb = None
+    chunks = 0
+    size = 0
+    try:
+        async with session.request(method, f"{url}{path}", data=body, headers=headers) as response:
+            async for data in response.content.iter_any():
+                if ttfb is None:
+                    ttfb = time.perf_counter() - start
+                size += len(data)
+                if stream:
+                    chunks += data.count(b"data: ")
+            return Sample(response.status, time.perf_counter() - start, ttfb, chunks, size)
+    except Exception as e:
+        return Sample(0, time.perf_counter() - start, ttfb, chunks, size, error=f"{type(e).__name__}: {e}")
+
+async def run_load(
+    url: str,
+    api_keys: Sequence[str],
+    model: str,
+    stream: bool,
+    concurrency: int,
+    requests: Optional[int] = None,
+    duration: Optional[float] = None,
+    unique_prompts: bool = True,
+    timeout: float = 120.0,
+) -> dict:
+    # Closed loop: `concurrency` workers each send their next request as soon
+    # as the previous one finishes, until `requests` are sent or `duration` ends.
+    if requests is None and duration is None:
+        raise ValueError("Either requests or duration is required")
+    counter = itertools.count()
+    keys = itertools.cycle(api_keys)
+    samples: List[Sample] = []
+    start = time.perf_counter()
+    deadline = start + duration if duration is not None else None
+
+    connector = aiohttp.TCPConnector(limit=concurrency, force_close=False)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    async with aiohttp.ClientSession(connector=connector, timeout=client_timeout) as session:
+        async def worker() -> None:
+            while True:
+                index = next(counter)
+                if requests is not None and index >= requests:
+                    return
+                if deadline is not None and time.perf_counter() >= deadline:
+                    return
+                body = build_request(model, stream, index, unique_prompts)
+                samples.append(await send_request(session, url, next(keys), body, stream))
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    return summarize(samples, time.perf_counter() - start)
+
+def seconds_summary(values: Sequence[float]) -> Dict[str, Optional[float]]:
+    return {
+        "mean": sum(values) / len(values) if values else None,
+        "p50": percentile(values, 0.50),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+        "max": max(values) if values else None,
+    }
+
+def summarize(samples: Sequence[Sample], elapsed: float) -> dict:
+    ok = [s for s in samples if s.ok]
+    statuses: Dict[str, int] = {}
+    for sample in samples:
+        label = str(sample.status) if not sample.error else "error"
+        statuses[label] = statuses.get(label, 0) + 1
+    errors = sorted({s.error for s in samples if s.error})[:5]
+    return {
+        "requests": len(samples),
+        "ok": len(ok),
+        "elapsed": elapsed,
+        "rps": len(samples) / elapsed if elapsed else 0.0,
+        "ok_rps": len(ok) / elapsed if elapsed else 0.0,
+        "statuses": statuses,
+        "latency": seconds_summary([s.latency for s in ok]),
+        "ttfb": seconds_summary([s.ttfb for s in ok if s.ttfb is not None]),
+        "chunks_per_response": sum(s.chunks for s in ok) / len(ok) if ok else 0,
+        "bytes_per_response": sum(s.size for s in ok) / len(ok) if ok else 0,
+        "sample_errors": errors,
+    }
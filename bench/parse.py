@@ -0,0 +1,70 @@
+import argparse
+import json
+import time
+from typing import Callable, List
+from utils import schemas
+from utils.streaming import loads
+
+FILLER = "the quick brown fox jumps over the lazy dog "
+
+def conversation(turns: int, chars: int) -> bytes:
+    messages = [{"role": "system", "content": "You are a helpful assistant."}]
+    for index in range(turns):
+        role = "user" if index % 2 == 0 else "assistant"
+        content = (f"[{index}] " + FILLER * (chars // len(FILLER) + 1))[:chars]
+        messages.append({"role": role, "content": content})
+    body = {"model": "gpt-4o", "messages": messages, "stream": True, "temperature": 0.7, "max_tokens": 1024}
+    return json.dumps(body).encode()
+
+def json_dict_path(body: bytes) -> dict:
+    # What the route did before: decode and patch the raw dict, no validation.
+    chat_request = json.loads(body)
+    if "stream" not in chat_request:
+        chat_request["stream"] = False
+    chat_request.get("model", "gpt-3.5-turbo")
+    return chat_request
+
+def measure(parse: Callable[[bytes], dict], body: bytes, seconds: float) -> dict:
+    runs: List[float] = []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline or len(runs) < 5:
+        start = time.perf_counter()
+        parse(body)
+        runs.append(time.perf_counter() - start)
+    runs.sort()
+    return {
+        "runs": len(runs),
+        "p50_us": runs[len(runs) // 2] * 1e6,
+        "p99_us": runs[int(0.99 * (len(runs) - 1))] * 1e6,
+        "mb_per_s": len(body) / runs[len(runs) // 2] / 1e6,
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark chat completion request parsing on large conversations.")
+    parser.add_argument("--turns", default="10,100,500", help="comma separated message counts")
+    parser.add_argument("--chars", type=int, default=2000, help="characters per message")
+    parser.add_argument("--seconds", type=float, default=1.0, help="time spent on each parser and size")
+    args = parser.parse_args()
+
+    parsers = {"json+dict": json_dict_path, "json+validate": schemas._parse_python}
+    if schemas.msgspec is not None:
+        parsers["msgspec"] = schemas._parse_msgspec
+    else:
+        print("msgspec is not installed; only the fallback validator is measured")
+    if loads is not json.loads:
+        parsers["orjson only"] = loads
+
+    for turns in (int(t) for t in args.turns.split(",")):
+        body = conversation(turns, args.chars)
+        print(f"{turns} messages, {len(body) / 1024:.0f} KiB")
+        baseline = None
+        for name, parse in parsers.items():
+            result = measure(parse, body, args.seconds)
+            baseline = baseline or result["p50_us"]
+            print(
+                f"  {name:14} p50 {result['p50_us']:10.1f}us  p99 {result['p99_us']:10.1f}us"
+                f"  {result['mb_per_s']:8.1f} MB/s  x{baseline / result['p50_us']:.2f}"
+            )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import asyncio
+import random
+from aiohttp import web
+
+class ProxyStub:
+    # A minimal plain-HTTP forward proxy that answers every request itself
+    # instead of forwarding it. Latency and failures are configurable so the
+    # proxy pool's scoring and quarantine can be exercised locally.
+    def __init__(self, latency: float = 0.0, failure_rate: float = 0.0, failure_status: int = 502):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.requests = 0
+        self.peers: set = set()
+        self.url = ""
+        self._runner = None
+
+    @property
+    def connections(self) -> int:
+        # Distinct client sockets seen; stays low when keep-alive works.
+        return len(self.peers)
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        self.peers.add(request.transport.get_extra_info("peername"))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            return web.Response(status=self.failure_status, text="stub proxy failure")
+        return web.Response(status=200, text=f"proxied {request.method} {request.url}")
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        app = web.Application()
+        app.router.add_route("*", "/{tail:.*}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,145 @@
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+import aiohttp
+from bench.loadgen import Sample, send_request, seconds_summary, summarize
+from bench.server import bench_api_keys
+from utils.capture import read_capture
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+FILLER = "lorem ipsum dolor sit amet "
+
+def _content(chars: int, index: int) -> str:
+    # Same size as the original message; the index keeps prompts distinct so
+    # replays do not collapse into cache hits that never happened.
+    prefix = f"[{index}] "
+    if chars <= len(prefix):
+        return prefix[:chars]
+    body = FILLER * (chars // len(FILLER) + 1)
+    return prefix + body[:chars - len(prefix)]
+
+def build_body(record: dict, index: int) -> bytes:
+    roles = record.get("roles") or ["user"]
+    sizes = record.get("message_chars") or [0] * len(roles)
+    body = {
+        "model": record.get("model"),
+        "messages": [{"role": role, "content": _content(size, index)} for role, size in zip(roles, sizes)],
+        "stream": bool(record.get("stream")),
+    }
+    for option in ("temperature", "max_tokens", "n"):
+        if option in record:
+            body[option] = record[option]
+    return json.dumps(body).encode()
+
+class KeyMap:
+    # Each recorded client gets its own key, so per-key rate limits and
+    # credits see the same grouping as in production.
+    def __init__(self, api_keys: List[str]):
+        self.api_keys = api_keys
+        self._anonymous = itertools.cycle(api_keys)
+
+    def key(self, record: dict) -> str:
+        client = record.get("client")
+        if not client:
+            return next(self._anonymous)
+        index = int(hashlib.sha256(client.encode()).hexdigest()[:8], 16)
+        return self.api_keys[index % len(self.api_keys)]
+
+def load_records(paths: List[str], limit: Optional[int]) -> List[dict]:
+    records = sorted(read_capture(paths), key=lambda r: r["ts"])
+    return records[:limit] if limit else records
+
+async def replay(url: str, records: List[dict], keys: KeyMap, speed: float, max_in_flight: int, timeout: float) -> dict:
+    samples: List[Sample] = []
+    dispatch_lag: List[float] = []
+    skipped: Dict[str, int] = {}
+    tasks = set()
+    in_flight = asyncio.Semaphore(max_in_flight) if max_in_flight else None
+
+    async def issue(session, record, body, method, path):
+        try:
+            samples.append(await send_request(session, url, keys.key(record), body, bool(record.get("stream")), method, path))
+        finally:
+            if in_flight is not None:
+                in_flight.release()
+
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        first = records[0]["ts"] if records else 0.0
+        start = time.perf_counter()
+        for index, record in enumerate(records):
+            if record.get("model"):
+                body, method, path = build_body(record, index), "POST", "/v1/chat/completions"
+            elif record.get("method") == "GET":
+                body, method, path = None, "GET", record["path"]
+            else:
+                skipped[record.get("path", "?")] = skipped.get(record.get("path", "?"), 0) + 1
+                continue
+
+            # Open loop: requests go out on the recorded schedule whether or
+            # not earlier ones have finished.
+            target = start + (record["ts"] - first) / speed
+            delay = target - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if in_flight is not None:
+                await in_flight.acquire()
+            dispatch_lag.append(max(0.0, time.perf_counter() - target))
+            task = asyncio.create_task(issue(session, record, body, method, path))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+
+    result = summarize(samples, elapsed)
+    result["recorded_span"] = (records[-1]["ts"] - first) if records else 0.0
+    result["speed"] = speed
+    result["dispatch_lag"] = seconds_summary(dispatch_lag)
+    result["skipped"] = skipped
+    return result
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay captured traffic against a running instance with its original timing.")
+    parser.add_argument("paths", nargs="+", help="capture files or directories (see TRAFFIC_CAPTURE_DIR)")
+    parser.add_argument("--url", default="http://127.0.0.1:8765")
+    parser.add_argument("--speed", type=float, default=1.0, help="time compression factor, e.g. 4 replays an hour in 15 minutes")
+    parser.add_argument("--limit", type=int, default=None, help="replay only the first N requests")
+    parser.add_argument("--api-key", action="append", default=[], help="key to send with (repeatable); defaults to bench.server's seeded keys")
+    parser.add_argument("--users", type=int, default=100, help="number of bench.server keys to spread clients over")
+    parser.add_argument("--max-in-flight", type=int, default=0, help="cap on concurrent requests (0: no cap)")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--out", default="", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    if args.speed <= 0:
+        parser.error("--speed must be positive")
+    records = load_records(args.paths, args.limit)
+    if not records:
+        raise SystemExit("No captured requests found")
+
+    keys = KeyMap(args.api_key or bench_api_keys(args.users))
+    logger.info(f"Replaying {len(records)} requests at {args.speed}x against {args.url}")
+    result = await replay(args.url.rstrip("/"), records, keys, args.speed, args.max_in_flight, args.timeout)
+
+    logger.info(
+        f"{result['requests']} requests in {result['elapsed']:.1f}s (recorded {result['recorded_span'] / args.speed:.1f}s at {args.speed}x), "
+        f"statuses {result['statuses']}, latency p50 {result['latency']['p50']} p99 {result['latency']['p99']}, "
+        f"dispatch lag p99 {result['dispatch_lag']['p99']}"
+    )
+    if args.out:
+        os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+        logger.info(f"Results written to {args.out}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,174 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Optional
+import aiohttp
+from bench.loadgen import run_load
+from bench.server import add_server_arguments, bench_api_keys, server_argv
+from bench.webhook_stub import WebhookStub
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+WORKLOADS = {"stream": True, "complete": False}
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def _git_commit() -> str:
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+        dirty = subprocess.call(["git", "diff", "--quiet", "HEAD"], stderr=subprocess.DEVNULL) != 0
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{commit}-dirty" if dirty else commit
+
+def start_server(args, webhook_url: str) -> subprocess.Popen:
+    env = dict(os.environ)
+    env["DISCORD_WEBHOOK_URL"] = webhook_url
+    command = [sys.executable, "-m", "bench.server", "--port", str(args.port)] + server_argv(args)
+    # The server prints a line per request; keep it off the terminal unless asked.
+    stdout = None if args.verbose else subprocess.DEVNULL
+    return subprocess.Popen(command, env=env, stdout=stdout)
+
+async def wait_ready(url: str, server: Optional[subprocess.Popen], timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            if server is not None and server.poll() is not None:
+                raise SystemExit(f"Benchmark server exited with code {server.returncode}")
+            try:
+                async with session.get(f"{url}/v1/models") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise SystemExit(f"Benchmark server at {url} did not become ready within {timeout}s")
+
+async def _bench_call(session: aiohttp.ClientSession, method: str, url: str) -> dict:
+    try:
+        async with session.request(method, url) as response:
+            if response.status == 200:
+                return await response.json()
+    except aiohttp.ClientError:
+        pass
+    # Attached to a server that is not bench.server; no server-side stats.
+    return {}
+
+async def run_workload(args, url: str, name: str, webhook: WebhookStub) -> dict:
+    stream = WORKLOADS[name]
+    keys = bench_api_keys(args.users)
+    if args.warmup:
+        await run_load(url, keys, args.model, stream, args.concurrency, requests=args.warmup)
+
+    async with aiohttp.ClientSession() as session:
+        await _bench_call(session, "POST", f"{url}/bench/reset")
+        webhook_before = webhook.stats()
+        result = await run_load(
+            url,
+            keys,
+            args.model,
+            stream,
+            args.concurrency,
+            requests=None if args.duration else args.requests,
+            duration=args.duration,
+            unique_prompts=not args.repeat_prompts,
+        )
+        server_stats = await _bench_call(session, "GET", f"{url}/bench/stats")
+
+    result["loop_lag"] = server_stats.get("loop_lag")
+    result["provider"] = server_stats.get("provider")
+    result["webhook"] = {k: v - webhook_before[k] for k, v in webhook.stats().items()}
+    return result
+
+def _ms(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value * 1000:.1f}"
+
+def print_summary(results: dict) -> None:
+    for name, result in results["workloads"].items():
+        lag = result.get("loop_lag") or {}
+        logger.info(
+            f"{name}: {result['rps']:.1f} rps ({result['ok']}/{result['requests']} ok, {result['statuses']}) | "
+            f"latency ms p50 {_ms(result['latency']['p50'])} p95 {_ms(result['latency']['p95'])} p99 {_ms(result['latency']['p99'])} | "
+            f"ttfb ms p50 {_ms(result['ttfb']['p50'])} p99 {_ms(result['ttfb']['p99'])} | "
+            f"loop lag ms p99 {_ms(lag.get('p99'))} max {_ms(lag.get('max'))}"
+        )
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Load-test api.app against a fake provider, in-process Redis and a stub webhook; results are written as JSON."
+    )
+    parser.add_argument("--url", default="", help="benchmark an already running server instead of spawning bench.server")
+    parser.add_argument("--port", type=int, default=0, help="port for the spawned server (default: any free port)")
+    parser.add_argument("--workloads", default="stream,complete", help=f"comma separated, from {sorted(WORKLOADS)}")
+    parser.add_argument("--model", default="gpt-4o")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=None, help="run each workload for this many seconds instead of --requests")
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--repeat-prompts", action="store_true", help="send identical prompts, exercising the cache and coalescing")
+    parser.add_argument("--out", default=os.path.join("bench", "results"))
+    parser.add_argument("--label", default="", help="free text stored with the results")
+    parser.add_argument("--verbose", action="store_true", help="show the spawned server's output")
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    workloads = [w.strip() for w in args.workloads.split(",") if w.strip()]
+    unknown = [w for w in workloads if w not in WORKLOADS]
+    if unknown:
+        parser.error(f"Unknown workloads: {unknown}")
+
+    webhook = WebhookStub()
+    webhook_url = await webhook.start()
+    server = None
+    try:
+        if args.url:
+            url = args.url.rstrip("/")
+        else:
+            args.port = args.port or _free_port()
+            url = f"http://127.0.0.1:{args.port}"
+            server = start_server(args, webhook_url)
+        await wait_ready(url, server)
+
+        results = {
+            "commit": _git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "label": args.label,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": vars(args),
+            "workloads": {},
+        }
+        for name in workloads:
+            logger.info(f"Running {name} workload")
+            results["workloads"][name] = await run_workload(args, url, name, webhook)
+    finally:
+        if server is not None:
+            server.terminate()
+            try:
+                server.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+        await webhook.stop()
+
+    os.makedirs(args.out, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    path = os.path.join(args.out, f"{stamp}-{results['commit']}.json")
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+    print_summary(results)
+    logger.info(f"Results written to {path}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
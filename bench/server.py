@@ -0,0 +1,127 @@
+import argparse
+import os
+from contextlib import asynccontextmanager
+from fastapi import APIRouter
+from bench.fake_provider import BenchProvider
+from utils import mongo
+from utils.looplag import LoopLagMonitor
+from utils.provider_selector import registry
+from utils.ratelimit import RATE_LIMITS
+
+BENCH_KEY_PREFIX = "bench-key-"
+BENCH_UNLIMITED_USAGE = 1e12
+
+def bench_api_keys(count: int) -> list:
+    return [f"{BENCH_KEY_PREFIX}{i}" for i in range(count)]
+
+async def seed_users(count: int, plan: str) -> None:
+    for i, api_key in enumerate(bench_api_keys(count)):
+        await mongo.add_user(f"bench-{i}", api_key, plan=plan, burner_limit=BENCH_UNLIMITED_USAGE)
+
+def use_local_redis(redis_url: str) -> None:
+    if redis_url:
+        mongo.set_redis_client(mongo.create_redis_client(redis_url))
+        return
+    try:
+        import fakeredis
+    except ImportError:
+        raise SystemExit("Install fakeredis[lua] or pass --redis-url to benchmark against a real Redis")
+    mongo.set_redis_client(fakeredis.aioredis.FakeRedis(decode_responses=True))
+
+def build_app(args):
+    use_local_redis(args.redis_url)
+    # Limits are scaled so the benchmark measures the limiter's cost rather
+    # than a wall of 429s.
+    for plan in RATE_LIMITS:
+        RATE_LIMITS[plan] = int(RATE_LIMITS[plan] * args.rate_limit_scale)
+
+    provider = BenchProvider(
+        models=args.models.split(","),
+        latency=args.latency,
+        jitter=args.jitter,
+        token_rate=args.token_rate,
+        tokens=args.tokens,
+        failure_rate=args.failure_rate,
+        slots=args.provider_slots,
+        seed=args.seed,
+    )
+    registry.register(provider)
+
+    from api import app
+
+    monitor = LoopLagMonitor()
+    bench_router = APIRouter()
+
+    @bench_router.get("/bench/stats")
+    async def bench_stats():
+        return {
+            "loop_lag": monitor.stats(),
+            "provider": {"calls": provider.calls, "failures": provider.failures},
+        }
+
+    @bench_router.post("/bench/reset")
+    async def bench_reset():
+        monitor.reset()
+        provider.calls = provider.failures = 0
+        return {"ok": True}
+
+    app.include_router(bench_router)
+
+    original_lifespan = app.router.lifespan_context
+
+    @asynccontextmanager
+    async def bench_lifespan(app):
+        async with original_lifespan(app) as state:
+            await seed_users(args.users, args.plan)
+            monitor.start()
+            try:
+                yield state
+            finally:
+                await monitor.stop()
+
+    app.router.lifespan_context = bench_lifespan
+    return app
+
+# Options forwarded from bench.run to the server process it spawns.
+SERVER_OPTIONS = [
+    ("--redis-url", dict(default=os.getenv("BENCH_REDIS_URL", ""), help="real Redis to use instead of in-process fakeredis")),
+    ("--models", dict(default="gpt-4o,gpt-3.5-turbo", help="models served by the fake provider")),
+    ("--latency", dict(type=float, default=0.2, help="provider time to first token, seconds")),
+    ("--jitter", dict(type=float, default=0.1, help="relative latency jitter")),
+    ("--token-rate", dict(type=float, default=50.0, help="provider tokens per second")),
+    ("--tokens", dict(type=int, default=64, help="tokens per completion")),
+    ("--failure-rate", dict(type=float, default=0.0)),
+    ("--provider-slots", dict(type=int, default=256, help="admission slots for the fake provider")),
+    ("--users", dict(type=int, default=100, help="API keys to seed; the load generator rotates through them")),
+    ("--plan", dict(default="enterprise")),
+    ("--rate-limit-scale", dict(type=float, default=1000.0)),
+    ("--seed", dict(type=int, default=None)),
+]
+
+def add_server_arguments(parser: argparse.ArgumentParser) -> None:
+    group = parser.add_argument_group("server")
+    for flag, options in SERVER_OPTIONS:
+        group.add_argument(flag, **options)
+
+def server_argv(args) -> list:
+    argv = []
+    for flag, _ in SERVER_OPTIONS:
+        value = getattr(args, flag[2:].replace("-", "_"))
+        if value is not None and value != "":
+            argv += [flag, str(value)]
+    return argv
+
+def main() -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Run api.app against a fake provider for benchmarking.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    app = build_app(args)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning", access_log=False)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+from aiohttp import web
+
+class WebhookStub:
+    # Accepts Discord webhook posts and counts them, so benchmarks exercise the
+    # logging pipeline without talking to Discord.
+    def __init__(self):
+        self.posts = 0
+        self.embeds = 0
+        self.url = ""
+        self._runner = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        self.posts += 1
+        try:
+            payload = await request.json()
+            self.embeds += len(payload.get("embeds", []))
+        except Exception:
+            pass
+        return web.Response(status=204)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        app = web.Application()
+        app.router.add_post("/{tail:.*}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.url = f"http://{host}:{port}/webhook"
+        return self.url
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def stats(self) -> dict:
+        return {"posts": self.posts, "embeds": self.embeds}
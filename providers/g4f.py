@@ -1,6 +1,6 @@
 from utils.baseprovider import BaseProvider
 import g4f
-from utils.common import generate_chunk, generate_response
+from utils.common import generate_response
 
 class G4FProvider(BaseProvider):
     def __init__(self):
@@ -16,15 +16,16 @@ class G4FProvider(BaseProvider):
         }
         self.supports_streaming = True
         self.priority = True
+        self.max_concurrency = 16
 
     async def create_chat_completion(self, args): 
         model = args.get("model", "llama-3.1-8b-instruct")
         messages = args.get("messages", [])
         stream = args.get("stream", False)
         if stream:
-            response = g4f.ChatCompletion.create(model=self.aliases.get(model, model), messages=messages, stream=True)
-            for chunk in response:
-                yield generate_chunk(chunk, model)
+            async for chunk in self.iterate_sync(g4f.ChatCompletion.create, model=self.aliases.get(model, model), messages=messages, stream=True):
+                # Bare content; the route's ChunkEncoder frames it from its template.
+                yield chunk
         else:
-            response = g4f.ChatCompletion.create(model=self.aliases.get(model, model), messages=messages)
+            response = await self.run_sync(g4f.ChatCompletion.create, model=self.aliases.get(model, model), messages=messages)
             yield generate_response(response, model)
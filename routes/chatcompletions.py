@@ -1,23 +1,68 @@
 from fastapi import APIRouter, Request, HTTPException
-from fastapi.responses import StreamingResponse
-from utils.schemas import ChatCompletionsRequestSchema
-from utils.provider_selector import select_provider
-from utils.mongo import get_user_by_api_key, add_usage
+from fastapi.responses import Response, StreamingResponse
+from utils.schemas import MAX_BODY_BYTES, RequestValidationError, parse_chat_request
+from utils.provider_selector import rank_providers
+from utils.routing import router as provider_router
+from utils.streaming import ChunkEncoder, DONE_FRAME, RawChunk, dumps, encode_stream
+from utils.completion_cache import cache_bypassed, cache_key, completion_cache, hit_multiplier, is_cacheable
+from utils.singleflight import can_coalesce, flight_key, singleflight
+from utils.scheduler import AdmissionRejected, admission_deadline
+from utils.mongo import get_user_by_api_key, add_usage, AUTH_FIELDS
 from utils.discord_webhook import send_discord_webhook
-import json
+from utils.model_config import model_config
+from utils.timing import current_timer, span, timing_exposed
+from utils import metrics
 import os
 import logging
 import time
 
-with open('model_multipliers.json', 'r') as f:
-    MODEL_CONFIG = json.load(f)
-
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-@router.post("/v1/chat/completions")
+CHAT_COMPLETIONS_PATH = "/v1/chat/completions"
+
+async def open_stream(chat_request: dict, plan: str, deadline: float, coalesce: bool = False):
+    with span("select"):
+        providers = rank_providers(chat_request)
+    start = lambda: provider_router.stream(chat_request, providers, plan, deadline=deadline)
+    with span("ttft"):
+        if coalesce:
+            # Identical concurrent requests share one upstream stream.
+            return await singleflight.stream(flight_key(chat_request), start)
+        return await start()
+
+async def complete(chat_request: dict, plan: str, deadline: float, coalesce: bool = False):
+    with span("select"):
+        providers = rank_providers(chat_request)
+    call = lambda: provider_router.complete(chat_request, providers, plan, deadline=deadline)
+    with span("upstream"):
+        if coalesce:
+            return await singleflight.call(flight_key(chat_request), call)
+        return await call()
+
+async def read_body(request: Request, limit: int = MAX_BODY_BYTES) -> bytes:
+    # Content-Length is checked in middleware; this catches chunked bodies.
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > limit:
+            raise HTTPException(status_code=413, detail=f"Request body is larger than {limit} bytes")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+async def parse_request(request: Request) -> dict:
+    with span("parse"):
+        try:
+            return parse_chat_request(await read_body(request))
+        except RequestValidationError as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+
+@router.post(CHAT_COMPLETIONS_PATH)
 async def chat_completions(request: Request):
     start_time = time.time()
+    # Provider queueing across every failover attempt shares this budget.
+    deadline = admission_deadline()
     try:
         logger.info("Starting chat completion request")
         auth_header = request.headers.get('Authorization')
@@ -25,8 +70,20 @@ async def chat_completions(request: Request):
             raise HTTPException(status_code=401, detail="Missing or invalid authorization header")
         
         api_key = auth_header.replace('Bearer ', '')
+
+        # Normally parsed by chat_request_middleware, ahead of the rate limiter.
+        chat_request = getattr(request.state, "chat_request", None)
+        if chat_request is None:
+            chat_request = await parse_request(request)
+            # Read back by the traffic capture middleware.
+            request.state.chat_request = chat_request
+        logger.info("Request body received")
         
-        user = await get_user_by_api_key(api_key)
+        # rate_limit_middleware already resolved this key; reuse its lookup.
+        user = getattr(request.state, "user", None)
+        if user is None:
+            with span("auth"):
+                user = await get_user_by_api_key(api_key, AUTH_FIELDS)
         if not user:
             raise HTTPException(status_code=401, detail="Invalid API key")
                 
@@ -36,50 +93,88 @@ async def chat_completions(request: Request):
         if user["usage"] >= user["max_usage_per_day"]:
             raise HTTPException(status_code=429, detail="Not enough credits")
 
-        body = await request.json()
-        logger.info("Request body received")
-        chat_request = body
-        
-        if 'stream' not in chat_request:
-            chat_request['stream'] = False
-        
-        model = chat_request.get('model', 'gpt-3.5-turbo')
-        if model in MODEL_CONFIG:
-            if not MODEL_CONFIG[model]['restrictions'].get(user['plan'], False):
-                raise HTTPException(
-                    status_code=403, 
-                    detail=f"Your plan ({user['plan']}) doesn't have access to {model}"
-                )
-            
-            usage_multiplier = MODEL_CONFIG[model].get('multiplier', 1)
-        else:
-            usage_multiplier = 1
+        model = chat_request['model']
+        model_entry = model_config.current.get(model)
+        if model_entry is not None and not model_entry.allows(user['plan']):
+            raise HTTPException(
+                status_code=403, 
+                detail=f"Your plan ({user['plan']}) doesn't have access to {model}"
+            )
+        usage_multiplier = model_entry.multiplier if model_entry is not None else 1
 
         if chat_request["stream"]:
             logger.info("Starting streaming response")
+            # Fails over between providers until one produces a first chunk,
+            # so nothing has been sent to the client if every provider fails.
+            provider, chunks = await open_stream(chat_request, user["plan"], deadline, can_coalesce(chat_request, request.headers))
+            request.state.provider = provider.__class__.__name__
+            encoder = ChunkEncoder(model)
+            timer = current_timer() if timing_exposed(request.headers) else None
             async def event_generator():
-                async for chunk in select_provider(chat_request).create_chat_completion(chat_request):
-                    yield f"data: {json.dumps(chunk)}\n\n"
-                yield "data: [DONE]\n\n"
-            await add_usage(user["user_id"], float(usage_multiplier))
+                # Counted locally and flushed once so the hot loop stays cheap.
+                frames = 0
+                sent = 0
+                metrics.STREAMS_IN_FLIGHT.inc(model)
+                try:
+                    async for frame in encode_stream(chunks, encoder):
+                        frames += 1
+                        sent += len(frame)
+                        yield frame
+                    yield DONE_FRAME
+                    if timer is not None:
+                        # After [DONE], where OpenAI-style clients have stopped reading.
+                        yield timer.event()
+                finally:
+                    metrics.STREAMS_IN_FLIGHT.dec(model)
+                    name = provider.__class__.__name__
+                    metrics.STREAM_CHUNKS.inc(name, model, amount=frames)
+                    metrics.STREAM_BYTES.inc(name, model, amount=sent)
+            try:
+                with span("usage"):
+                    await add_usage(user["user_id"], float(usage_multiplier))
+            except BaseException:
+                # Nothing has iterated the stream yet; closing it gives the provider slot back.
+                await chunks.aclose()
+                raise
             return StreamingResponse(event_generator(), media_type="text/event-stream")
         else:
-            provider = select_provider(chat_request)
+            entry_options = model_entry.raw if model_entry is not None else None
+            cache_status = None
+            if is_cacheable(chat_request, entry_options):
+                if cache_bypassed(request.headers):
+                    completion_cache.stats["bypassed"] += 1
+                    cache_status = "BYPASS"
+                else:
+                    key = cache_key(chat_request)
+                    with span("cache"):
+                        cached = await completion_cache.get(key)
+                    if cached is not None:
+                        request.state.provider = "cache"
+                        with span("usage"):
+                            await add_usage(user["user_id"], float(usage_multiplier) * hit_multiplier(entry_options))
+                        return Response(content=cached, media_type="application/json", headers={"X-Cache": "HIT"})
+                    cache_status = "MISS"
+
+            provider, response = await complete(chat_request, user["plan"], deadline, can_coalesce(chat_request, request.headers))
+            request.state.provider = provider.__class__.__name__
             provider_name = str(provider.__class__.__name__)[:3]
-            response = None
-            async for resp in provider.create_chat_completion(chat_request):
-                response = resp
+            with span("usage"):
                 await add_usage(user["user_id"], float(usage_multiplier))
-                
+            content = response if isinstance(response, RawChunk) else dumps(response)
+            if cache_status == "MISS":
+                completion_cache.set(key, content)
+
             request_time = round(time.time() - start_time, 2)
-            await send_discord_webhook(
-                "REQUEST LOG!",
-                f"User: <@{user['user_id']}>\n"
-                f"Model: {chat_request.get('model', 'gpt-3.5-turbo')}\n"
-                f"Provider: {provider_name}\n"
-                f"Request Time: {request_time}s"
-            )
-            return response
+            with span("webhook"):
+                await send_discord_webhook(
+                    "REQUEST LOG!",
+                    f"User: <@{user['user_id']}>\n"
+                    f"Model: {chat_request.get('model', 'gpt-3.5-turbo')}\n"
+                    f"Provider: {provider_name}\n"
+                    f"Request Time: {request_time}s"
+                )
+            headers = {"X-Cache": cache_status} if cache_status else None
+            return Response(content=content, media_type="application/json", headers=headers)
 
     except HTTPException as http_exc:
         logger.error(f"HTTP Exception: {http_exc.detail}")
@@ -88,9 +183,12 @@ async def chat_completions(request: Request):
             f"Status: {http_exc.status_code}\n"
             f"Error: {http_exc.detail}"
         )
-        if http_exc.status_code in [401, 403, 429]:
+        if http_exc.status_code in [400, 401, 403, 413, 429, 503]:
             raise http_exc
         raise HTTPException(status_code=469, detail=str(http_exc.detail))
+    except AdmissionRejected as e:
+        logger.error(f"Admission rejected: {e}")
+        raise HTTPException(status_code=503, detail=f"Service overloaded: {e}", headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         logger.error(f"Unexpected error in chat_completions: {str(e)}")
         await send_discord_webhook(
@@ -0,0 +1,96 @@
+from fastapi import APIRouter, Request, HTTPException
+from fastapi.responses import JSONResponse
+from routes.chatcompletions import read_body
+from utils.jobs import JobError, get_blob, get_job, submit_job, validate_job
+from utils.mongo import get_user_by_api_key, AUTH_FIELDS
+from utils.model_config import model_config
+from utils.streaming import loads
+import logging
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+async def authenticate(request: Request) -> dict:
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        raise HTTPException(status_code=401, detail="Missing or invalid authorization header")
+    user = getattr(request.state, "user", None)
+    if user is None:
+        user = await get_user_by_api_key(auth_header.replace('Bearer ', ''), AUTH_FIELDS)
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid API key")
+    if user["banned"]:
+        raise HTTPException(status_code=403, detail="User is banned")
+    return user
+
+def job_view(job: dict) -> dict:
+    view = {
+        "id": job["id"],
+        "object": "job",
+        "type": job["type"],
+        "status": job["status"],
+        "created_at": int(job["created_at"]),
+    }
+    if job.get("progress") is not None:
+        view["progress"] = job["progress"]
+    if job["status"] == "failed":
+        view["error"] = job.get("error")
+    if job.get("finished_at"):
+        view["finished_at"] = int(job["finished_at"])
+    return view
+
+async def owned_job(job_id: str, user: dict) -> dict:
+    job = await get_job(job_id)
+    # Someone else's job is reported as missing rather than forbidden.
+    if job is None or job["user_id"] != user["user_id"]:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.post("/v1/jobs")
+async def create_job(request: Request):
+    user = await authenticate(request)
+    if user["usage"] >= user["max_usage_per_day"]:
+        raise HTTPException(status_code=429, detail="Not enough credits")
+
+    try:
+        body = loads(await read_body(request))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid JSON body: {e}")
+    if not isinstance(body, dict):
+        raise HTTPException(status_code=400, detail="Request body must be an object")
+    try:
+        job_type, params = validate_job(body)
+    except JobError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    model = params.get("model")
+    model_entry = model_config.current.get(model) if model else None
+    if model_entry is not None and not model_entry.allows(user['plan']):
+        raise HTTPException(
+            status_code=403,
+            detail=f"Your plan ({user['plan']}) doesn't have access to {model}"
+        )
+    usage_multiplier = model_entry.multiplier if model_entry is not None else 1
+
+    # Billed by the worker when the job succeeds, not here.
+    job = await submit_job(user["user_id"], job_type, params, float(usage_multiplier))
+    logger.info(f"Queued {job_type} job {job['id']} ({job['status']})")
+    return JSONResponse(status_code=202, content=job_view(job), headers={"Location": f"/v1/jobs/{job['id']}"})
+
+@router.get("/v1/jobs/{job_id}")
+async def job_status(job_id: str, request: Request):
+    user = await authenticate(request)
+    return job_view(await owned_job(job_id, user))
+
+@router.get("/v1/jobs/{job_id}/result")
+async def job_result(job_id: str, request: Request):
+    user = await authenticate(request)
+    job = await owned_job(job_id, user)
+    if job["status"] == "failed":
+        raise HTTPException(status_code=502, detail=job.get("error") or "Job failed")
+    if job["status"] != "succeeded":
+        return JSONResponse(status_code=202, content=job_view(job), headers={"Retry-After": "1"})
+    result = await get_blob(job["result_key"])
+    if result is None:
+        raise HTTPException(status_code=410, detail="Job result has expired")
+    return {"id": job["id"], "object": "job.result", "type": job["type"], "result": result}
@@ -0,0 +1,26 @@
+import hmac
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+from utils.metrics import METRICS_TOKEN, registry
+
+router = APIRouter()
+
+# Paths authenticated here rather than by the per-user rate limiter.
+ADMIN_PATHS = ("/metrics", "/v1/status/admission")
+
+def check_metrics_token(request: Request, required: bool = False) -> None:
+    if not METRICS_TOKEN:
+        if required:
+            raise HTTPException(status_code=404, detail="Not Found")
+        return
+    auth_header = request.headers.get("Authorization") or ""
+    if not hmac.compare_digest(auth_header.encode(), f"Bearer {METRICS_TOKEN}".encode()):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+
+def require_admin(request: Request) -> None:
+    check_metrics_token(request, required=True)
+
+@router.get("/metrics")
+async def get_metrics(request: Request):
+    check_metrics_token(request)
+    return PlainTextResponse(await registry.render_async(), media_type="text/plain; version=0.0.4")
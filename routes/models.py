@@ -1,33 +1,34 @@
-from fastapi import APIRouter
-from utils.provider_selector import get_all_models
-import json
+from fastapi import APIRouter, Request
+from utils.model_config import model_config
+from utils.provider_selector import get_registry
+from utils.response_cache import CachedResponse, response_cache
+from utils.streaming import dumps
 
-with open('model_multipliers.json', 'r') as f:
-    MODEL_CONFIG = json.load(f)
+MODELS_CACHE_CONTROL = "public, max-age=60"
 
 router = APIRouter()
 
-@router.get("/v1/models")
-async def get_models():
-    models = await get_all_models()
-    
-    
-    unique_models = set(model for sublist in models for model in sublist)
-    
-    return {
-        "data": [
-            {
-                "id": model,
-                "object": "model",
-                "created": 0,
-                "owned_by": "G4F.PRO",
-                "multiplier": MODEL_CONFIG.get(model, {}).get('multiplier', 1),
-                "restrictions": MODEL_CONFIG.get(model, {}).get('restrictions', {
-                    "free": True,
-                    "premium": True,
-                    "enterprise": True
-                })
+def build_models_response() -> CachedResponse:
+    config = model_config.current
+    data = []
+    for model in get_registry().models:
+        entry = config.get(model)
+        data.append({
+            "id": model,
+            "object": "model",
+            "created": 0,
+            "owned_by": "G4F.PRO",
+            "multiplier": entry.multiplier if entry else 1,
+            "restrictions": entry.restrictions if entry else {
+                "free": True,
+                "premium": True,
+                "enterprise": True
             }
-            for model in unique_models
-        ]
-    }
+        })
+    return CachedResponse(dumps({"data": data}), "application/json", MODELS_CACHE_CONTROL)
+
+@router.get("/v1/models")
+async def get_models(request: Request):
+    # Rebuilt only when providers are reloaded or the model config changes.
+    stamp = (get_registry().version, model_config.current.version)
+    return response_cache.get("models", stamp, build_models_response).respond(request)
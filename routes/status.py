@@ -0,0 +1,9 @@
+from fastapi import APIRouter, Depends
+from routes.metrics import require_admin
+from utils.scheduler import scheduler
+
+router = APIRouter()
+
+@router.get("/v1/status/admission", dependencies=[Depends(require_admin)])
+async def get_admission_status():
+    return {"providers": scheduler.snapshot()}
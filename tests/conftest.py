@@ -0,0 +1,12 @@
+import fakeredis
+import pytest
+from utils import mongo
+
+@pytest.fixture
+def redis():
+    # Scripts run under fakeredis' Lua support (needs the lupa package).
+    client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    previous = mongo.get_redis_client()
+    mongo.set_redis_client(client)
+    yield client
+    mongo.set_redis_client(previous)
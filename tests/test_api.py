@@ -0,0 +1,41 @@
+import asyncio
+import httpx
+import pytest
+import api
+from utils import mongo
+
+@pytest.fixture
+def lookups(redis, monkeypatch):
+    calls = []
+
+    async def get_user_by_api_key(*args, **kwargs):
+        calls.append("auth")
+        return await mongo.get_user_by_api_key(*args, **kwargs)
+
+    async def hit(*args, **kwargs):
+        calls.append("rate_limit")
+        return await rate_limiter_hit(*args, **kwargs)
+
+    rate_limiter_hit = api.rate_limiter.hit
+    monkeypatch.setattr(api, "get_user_by_api_key", get_user_by_api_key)
+    monkeypatch.setattr(api.rate_limiter, "hit", hit)
+    return calls
+
+def post(content: bytes):
+    async def main():
+        await mongo.add_user("u1", "key1")
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post(
+                "/v1/chat/completions",
+                content=content,
+                headers={"Authorization": "Bearer key1", "Content-Type": "application/json"},
+            )
+    return asyncio.run(main())
+
+@pytest.mark.parametrize("body", [b"{bad", b'{"messages": []}', b'{"messages": [{"role": "robot", "content": "x"}]}'])
+def test_invalid_chat_requests_are_rejected_before_rate_limiting(lookups, body):
+    response = post(body)
+    assert response.status_code == 400
+    assert response.json()["error"] is True
+    assert lookups == []
@@ -0,0 +1,73 @@
+import asyncio
+import threading
+import time
+from utils.baseprovider import BaseProvider
+
+class BlockingProvider(BaseProvider):
+    max_concurrency = 1
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.peak = 0
+
+    def create_chat_completion(self, args):
+        pass
+
+    def work(self, seconds: float = 0.2) -> str:
+        with self.lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        time.sleep(seconds)
+        with self.lock:
+            self.running -= 1
+        return "done"
+
+def test_run_sync_returns_result():
+    provider = BlockingProvider()
+    assert asyncio.run(provider.run_sync(provider.work, 0)) == "done"
+
+def test_cancelled_run_sync_holds_slot_until_thread_finishes():
+    provider = BlockingProvider()
+
+    async def main():
+        first = asyncio.create_task(provider.run_sync(provider.work))
+        await asyncio.sleep(0.05)
+        first.cancel()
+        second = asyncio.create_task(provider.run_sync(provider.work))
+        third = asyncio.create_task(provider.run_sync(provider.work))
+        return await asyncio.gather(second, third)
+
+    assert asyncio.run(main()) == ["done", "done"]
+    assert provider.peak == 1
+
+def test_iterate_sync_yields_items_and_releases_slot():
+    provider = BlockingProvider()
+
+    def numbers():
+        for number in range(3):
+            yield number
+
+    async def main():
+        items = [item async for item in provider.iterate_sync(numbers)]
+        await asyncio.sleep(0.05)
+        return items, provider._get_semaphore().locked()
+
+    assert asyncio.run(main()) == ([0, 1, 2], False)
+
+def test_iterate_sync_reraises_worker_errors():
+    provider = BlockingProvider()
+
+    def broken():
+        yield 1
+        raise ValueError("upstream failed")
+
+    async def main():
+        items = []
+        try:
+            async for item in provider.iterate_sync(broken):
+                items.append(item)
+        except ValueError as e:
+            return items, str(e)
+
+    assert asyncio.run(main()) == ([1], "upstream failed")
@@ -0,0 +1,107 @@
+import asyncio
+import httpx
+import pytest
+import api
+from routes import chatcompletions
+from utils import completion_cache as completion_cache_module
+from utils import mongo
+from utils.completion_cache import CompletionCache, cache_bypassed, cache_key, hit_multiplier, is_cacheable, is_deterministic
+from utils.model_config import model_config, parse_model_config
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+@pytest.mark.parametrize("chat_request, expected", [
+    ({"messages": MESSAGES}, True),
+    ({"messages": MESSAGES, "temperature": 0, "n": 1}, True),
+    ({"messages": MESSAGES, "temperature": 0.7}, False),
+    ({"messages": MESSAGES, "n": 2}, False),
+    ({"messages": MESSAGES, "tools": [{"type": "function", "function": {"name": "lookup"}}]}, False),
+    ({"messages": MESSAGES, "functions": [{"name": "lookup"}]}, False),
+])
+def test_only_deterministic_requests_are_cached(chat_request, expected):
+    assert is_deterministic(chat_request) is expected
+    assert is_cacheable(chat_request, {"cache": True}) is expected
+
+def test_caching_is_opt_in_per_model_and_skips_streams():
+    chat_request = {"model": "m", "messages": MESSAGES}
+    assert not is_cacheable(chat_request, None)
+    assert not is_cacheable(chat_request, {"cache": False})
+    assert not is_cacheable({**chat_request, "stream": True}, {"cache": True})
+
+def test_cache_key_is_stable_and_ignores_transport_fields():
+    key = cache_key({"model": "m", "messages": MESSAGES, "temperature": 0})
+    assert key == cache_key({"temperature": 0, "messages": MESSAGES, "model": "m", "stream": False, "user": "u1"})
+    assert key != cache_key({"model": "m", "messages": [{"role": "user", "content": "hello"}], "temperature": 0})
+    assert key != cache_key({"model": "other", "messages": MESSAGES, "temperature": 0})
+
+def test_cache_bypass_headers():
+    assert cache_bypassed({"cache-control": "No-Cache"})
+    assert cache_bypassed({"cache-control": "no-store"})
+    assert cache_bypassed({"x-cache-bypass": "true"})
+    assert not cache_bypassed({"cache-control": "max-age=60"})
+    assert not cache_bypassed({})
+
+def test_hit_multiplier_defaults_and_per_model_override():
+    assert hit_multiplier(None) == completion_cache_module.COMPLETION_CACHE_HIT_MULTIPLIER
+    assert hit_multiplier({"cache": True, "cache_hit_multiplier": 0.5}) == 0.5
+
+def test_memory_tier_evicts_least_recently_used_within_limits():
+    async def main():
+        cache = CompletionCache(max_entries=2, max_bytes=10)
+        cache._remember("a", b"1111")
+        cache._remember("b", b"2222")
+        await cache.get("a")
+        cache._remember("c", b"3333")
+        # Over max_bytes on its own, so never stored.
+        cache._remember("d", b"x" * 11)
+        return list(cache._entries), cache._bytes
+
+    assert asyncio.run(main()) == (["a", "c"], 8)
+
+def test_redis_tier_is_shared_between_workers(redis):
+    async def main():
+        writer = CompletionCache()
+        writer.set("key", b'{"ok":1}')
+        await asyncio.gather(*writer._writes)
+        reader = CompletionCache()
+        first = await reader.get("key")
+        second = await reader.get("key")
+        missing = await reader.get("other")
+        return first, second, missing, reader.stats, await redis.ttl(f"{completion_cache_module.COMPLETION_CACHE_PREFIX}key")
+
+    first, second, missing, stats, ttl = asyncio.run(main())
+    assert first == second == b'{"ok":1}'
+    assert missing is None
+    assert (stats["redis_hits"], stats["memory_hits"], stats["misses"]) == (1, 1, 1)
+    assert 0 < ttl <= completion_cache_module.COMPLETION_CACHE_TTL
+
+def test_cache_hits_are_billed_at_the_hit_multiplier(redis, monkeypatch):
+    calls = []
+
+    async def complete(chat_request, plan, deadline, coalesce=False):
+        calls.append(chat_request)
+        return object(), {"choices": [{"message": {"role": "assistant", "content": "hello"}}]}
+
+    monkeypatch.setattr(chatcompletions, "complete", complete)
+    monkeypatch.setattr(chatcompletions, "completion_cache", CompletionCache())
+    monkeypatch.setattr(model_config, "current", parse_model_config({"m": {"multiplier": 2, "cache": True, "cache_hit_multiplier": 0.25}}))
+
+    async def main():
+        await mongo.add_user("u1", "key1")
+        transport = httpx.ASGITransport(app=api.app)
+        statuses = []
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            for headers in ({}, {}, {"Cache-Control": "no-cache"}):
+                response = await client.post(
+                    "/v1/chat/completions",
+                    json={"model": "m", "messages": MESSAGES},
+                    headers={"Authorization": "Bearer key1", **headers},
+                )
+                statuses.append((response.status_code, response.headers.get("X-Cache")))
+        return statuses, await mongo.get_usage("u1")
+
+    statuses, usage = asyncio.run(main())
+    assert statuses == [(200, "MISS"), (200, "HIT"), (200, "BYPASS")]
+    assert len(calls) == 2
+    # Two upstream calls at the model multiplier, one hit at a quarter of it.
+    assert usage == pytest.approx(2 + 2 * 0.25 + 2)
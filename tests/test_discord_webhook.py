@@ -0,0 +1,96 @@
+import asyncio
+import time
+from bench.webhook_stub import WebhookStub
+from utils.discord_webhook import MAX_EMBEDS, WebhookPipeline, WebhookTransport
+
+class ScriptedTransport(WebhookTransport):
+    def __init__(self, responses=()):
+        self.responses = list(responses)
+        self.payloads = []
+        self.sent_at = []
+        self.closed = False
+
+    async def send(self, url, payload):
+        self.payloads.append(payload)
+        self.sent_at.append(time.monotonic())
+        if self.responses:
+            return self.responses.pop(0)
+        return 204, {}, None
+
+    async def close(self):
+        self.closed = True
+
+def test_events_are_grouped_into_one_post():
+    async def main():
+        transport = ScriptedTransport()
+        pipeline = WebhookPipeline(url="http://stub", transport=transport)
+        for index in range(3):
+            pipeline.submit("Error", f"boom {index}", 1)
+        pipeline.submit("Info", "hello", 2)
+        await pipeline.flush()
+        return transport.payloads, pipeline.sent
+
+    payloads, sent = asyncio.run(main())
+    assert sent == 1
+    assert payloads == [{"embeds": [
+        {"title": "Error (x3)", "description": "boom 0\n\nboom 1\n\nboom 2", "color": 1},
+        {"title": "Info", "description": "hello", "color": 2},
+    ]}]
+
+def test_payloads_respect_the_embed_limit():
+    events = [(f"title {index}", "x", index) for index in range(MAX_EMBEDS + 3)]
+    payloads = WebhookPipeline.build_payloads(events)
+    assert [len(payload["embeds"]) for payload in payloads] == [MAX_EMBEDS, 3]
+
+def test_full_queue_drops_new_events():
+    async def main():
+        pipeline = WebhookPipeline(url="http://stub", transport=ScriptedTransport(), queue_size=2)
+        return [pipeline.submit("Error", str(index), 1) for index in range(3)], pipeline.dropped
+
+    assert asyncio.run(main()) == ([True, True, False], 1)
+
+def test_rate_limited_post_waits_for_retry_after():
+    async def main():
+        transport = ScriptedTransport([(429, {}, {"retry_after": 0.1})])
+        pipeline = WebhookPipeline(url="http://stub", transport=transport)
+        pipeline.submit("Error", "boom", 1)
+        await pipeline.flush()
+        return transport, pipeline
+
+    transport, pipeline = asyncio.run(main())
+    assert len(transport.payloads) == 2
+    assert transport.payloads[0] == transport.payloads[1]
+    assert transport.sent_at[1] - transport.sent_at[0] >= 0.1
+    assert (pipeline.sent, pipeline.failed) == (1, 0)
+
+def test_stop_flushes_held_and_queued_events():
+    async def main():
+        transport = ScriptedTransport()
+        pipeline = WebhookPipeline(url="http://stub", transport=transport, flush_interval=60)
+        pipeline.start()
+        pipeline.submit("Error", "held", 1)
+        # The background task takes the first event and waits out the interval.
+        await asyncio.sleep(0.01)
+        pipeline.submit("Error", "queued", 1)
+        await pipeline.stop()
+        return transport
+
+    transport = asyncio.run(main())
+    assert transport.payloads == [{"embeds": [{"title": "Error (x2)", "description": "held\n\nqueued", "color": 1}]}]
+    assert transport.closed
+
+def test_pipeline_posts_to_the_stub_server():
+    async def main():
+        stub = WebhookStub()
+        url = await stub.start()
+        try:
+            pipeline = WebhookPipeline(url=url, flush_interval=0.01)
+            pipeline.start()
+            for index in range(5):
+                pipeline.submit("Error", f"boom {index}", 1)
+            await pipeline.stop()
+            return stub.stats(), pipeline.sent
+        finally:
+            await stub.stop()
+
+    assert asyncio.run(main()) == ({"posts": 1, "embeds": 1}, 1)
@@ -0,0 +1,80 @@
+import asyncio
+import pytest
+from utils import jobs, mongo
+from utils.jobs import JobError, charge_job, submit_job, validate_job
+
+def test_tts_jobs_are_validated():
+    assert validate_job({"type": "tts", "input": "hello"}) == ("tts", {"model": "tts-1", "voice": "nova", "input": "hello"})
+    with pytest.raises(JobError):
+        validate_job({"type": "tts"})
+    with pytest.raises(JobError):
+        validate_job({"type": "tts", "input": "x" * (jobs.JOB_MAX_TTS_CHARS + 1)})
+
+def test_upscale_jobs_only_accept_known_parameters():
+    assert validate_job({"type": "upscale", "image": "a.png", "scale": 2}) == ("upscale", {"image": "a.png", "scale": 2})
+    with pytest.raises(JobError, match="Unsupported"):
+        validate_job({"type": "upscale", "image": "a.png", "callback": "http://x"})
+    with pytest.raises(JobError, match="image"):
+        validate_job({"type": "upscale", "scale": 2})
+    with pytest.raises(JobError, match="scale"):
+        validate_job({"type": "upscale", "image": "a.png", "scale": 100})
+
+def test_upscale_parameters_are_size_limited(monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_MAX_UPSCALE_BYTES", 100)
+    with pytest.raises(JobError, match="limited"):
+        validate_job({"type": "upscale", "image": "x" * 200})
+
+def test_jobs_are_charged_once_on_success(redis):
+    async def main():
+        await mongo.add_user("u1", "key1")
+        job = await submit_job("u1", "tts", {"model": "tts-1", "voice": "nova", "input": "hi"}, cost=2.0)
+        charged_at_submit = (await mongo.get_user_fields("u1", ("usage",)))["usage"]
+        await charge_job(job)
+        await charge_job(job)
+        return charged_at_submit, (await mongo.get_user_fields("u1", ("usage",)))["usage"]
+
+    assert asyncio.run(main()) == (0, 2)
+
+def test_cached_results_are_charged_at_submit(redis):
+    async def main():
+        await mongo.add_user("u1", "key1")
+        params = {"model": "tts-1", "voice": "nova", "input": "hi"}
+        await redis.set(f"{jobs.BLOB_PREFIX}{jobs.content_key('tts', params)}", '"audio"')
+        job = await submit_job("u1", "tts", params, cost=3.0)
+        return job["status"], (await mongo.get_user_fields("u1", ("usage",)))["usage"]
+
+    assert asyncio.run(main()) == ("succeeded", 3)
+
+def test_jobs_waiting_for_a_slot_are_heartbeated(redis, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_LEASE_SECONDS", 0.3)
+
+    async def main():
+        worker = jobs.JobWorker(concurrency=2)
+        started = []
+
+        async def execute(job_type, message_id, job_id):
+            started.append(message_id)
+            await asyncio.sleep(60)
+
+        monkeypatch.setattr(worker, "_execute", execute)
+        stream = jobs._stream_key("tts")
+        for index in range(2):
+            await redis.xadd(stream, {"id": f"job{index}"})
+        # Another job type's dispatcher holds a slot through its blocking read,
+        # so this one reads two jobs but can only start the first.
+        await worker._slots.acquire()
+        tasks = [asyncio.create_task(worker._dispatch("tts")), asyncio.create_task(worker._heartbeat())]
+        await asyncio.sleep(0.5)
+        pending = await redis.xpending_range(stream, jobs.JOB_GROUP, "-", "+", 10)
+        waiting = len(worker._waiting)
+        tasks += [task for _, task in worker._running.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return len(started), waiting, [entry["time_since_delivered"] for entry in pending], worker._waiting
+
+    started, waiting, idle, left_waiting = asyncio.run(main())
+    assert (started, waiting) == (1, 1)
+    # Both leases were refreshed well inside JOB_LEASE_SECONDS.
+    assert len(idle) == 2 and all(ms < 300 for ms in idle)
+    assert left_waiting == {}
@@ -0,0 +1,215 @@
+import asyncio
+import json
+import time
+import pytest
+from redis.asyncio.client import Pipeline
+from utils import mongo
+
+DAY = mongo.USAGE_RESET_WINDOW
+
+def usage(user_id: str):
+    return mongo.get_user_fields(user_id, ("usage", "last_reset"))
+
+def test_add_usage_charges_atomically(redis):
+    async def main():
+        await mongo.add_user("u1", "key1")
+        await asyncio.gather(*(mongo.add_usage("u1", 1) for _ in range(20)))
+        return await mongo.get_user("u1")
+
+    user = asyncio.run(main())
+    assert user["usage"] == 20
+    assert user["total_usage_all_time"] == 20
+
+def test_add_usage_resets_an_expired_day(redis):
+    async def main():
+        await mongo.add_user("u1", "key1")
+        await redis.hset("user:u1", mapping={"usage": 50, "last_reset": int(time.time()) - DAY - 1})
+        await mongo.add_usage("u1", 2)
+        return await usage("u1")
+
+    fields = asyncio.run(main())
+    assert fields["usage"] == 2
+    assert fields["last_reset"] >= int(time.time()) - 1
+
+def test_write_behind_retry_does_not_charge_twice(redis):
+    async def main():
+        await mongo.add_user("u1", "key1")
+        await mongo.add_user("u2", "key2")
+        write_behind = mongo.UsageWriteBehind()
+        # The batch reached Redis, but the reply was lost and it is resent.
+        await write_behind._send("batch-1", {"u1": 3.0})
+        await write_behind._send("batch-1", {"u1": 3.0, "u2": 1.0})
+        write_behind.add("u1", 1)
+        write_behind.add("ghost", 5)
+        await write_behind.flush()
+        return (await usage("u1"))["usage"], (await usage("u2"))["usage"], write_behind._pending
+
+    assert asyncio.run(main()) == (4, 1, {})
+
+def test_write_behind_keeps_a_batch_cancelled_mid_flush(redis, monkeypatch):
+    execute = Pipeline.execute
+
+    async def execute_then_hang(self, *args, **kwargs):
+        # The charges land in Redis, then the flush is cancelled before the reply.
+        await execute(self, *args, **kwargs)
+        await asyncio.sleep(60)
+
+    async def main():
+        await mongo.add_user("u1", "key1")
+        write_behind = mongo.UsageWriteBehind()
+        write_behind.add("u1", 3)
+        monkeypatch.setattr(Pipeline, "execute", execute_then_hang)
+        flush = asyncio.create_task(write_behind.flush())
+        await asyncio.sleep(0.05)
+        flush.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await flush
+        monkeypatch.setattr(Pipeline, "execute", execute)
+        pending = write_behind.pending("u1")
+        await write_behind.flush()
+        return pending, (await usage("u1"))["usage"], write_behind._retry
+
+    assert asyncio.run(main()) == (3, 3, None)
+
+def test_reset_due_usage_resets_only_due_users(redis):
+    async def main():
+        now = int(time.time())
+        for user_id in ("due", "fresh", "gone"):
+            await mongo.add_user(user_id, f"key-{user_id}")
+            await mongo.add_usage(user_id, 7)
+        await redis.hset("user:due", "last_reset", now - DAY - 5)
+        await redis.zadd(mongo.USAGE_RESETS, {"due": 0, "gone": 0})
+        await redis.delete("user:gone")
+        reset = await mongo.reset_due_usage(now)
+        return (
+            reset,
+            await usage("due"),
+            await usage("fresh"),
+            await redis.zscore(mongo.USAGE_RESETS, "gone"),
+            await redis.zscore(mongo.USAGE_RESETS, "due"),
+            now,
+        )
+
+    reset, due, fresh, gone_score, due_score, now = asyncio.run(main())
+    assert reset == 1
+    assert due == {"usage": 0, "last_reset": now}
+    assert fresh["usage"] == 7
+    assert gone_score is None
+    # Rescheduled a day out, rounded up to the bucket.
+    assert due_score >= now + DAY and due_score % mongo.USAGE_RESET_BUCKET == 0
+
+def test_reset_due_usage_works_in_batches(redis):
+    async def main():
+        now = int(time.time())
+        for index in range(7):
+            await mongo.add_user(f"u{index}", f"key{index}")
+            await redis.hset(f"user:u{index}", mapping={"usage": 3, "last_reset": now - DAY})
+            await redis.zadd(mongo.USAGE_RESETS, {f"u{index}": 0})
+        reset = await mongo.reset_due_usage(now, batch_size=3)
+        return reset, [(await usage(f"u{index}"))["usage"] for index in range(7)]
+
+    assert asyncio.run(main()) == (7, [0] * 7)
+
+def test_reset_migrates_legacy_json_users(redis):
+    async def main():
+        record = {"user_id": "old", "api_key": "key-old", "plan": "free", "banned": False, "usage": 9, "max_usage_per_day": 400, "last_reset": 0}
+        await redis.set("user:old", json.dumps(record))
+        await redis.zadd(mongo.USAGE_RESETS, {"old": 0})
+        await mongo.reset_due_usage(int(time.time()))
+        return await redis.type("user:old"), await mongo.get_user("old")
+
+    key_type, user = asyncio.run(main())
+    assert key_type == "hash"
+    assert user["usage"] == 0
+    assert user["api_key"] == "key-old"
+
+def test_bulk_change_plan_skips_missing_users(redis):
+    async def main():
+        await mongo.add_user("u1", "key1")
+        await mongo.add_user("u2", "key2")
+        changed = await mongo.bulk_change_plan(["u1", "u2", "u1", "ghost"], "pro")
+        return changed, await mongo.get_user("u1"), await mongo.get_user("ghost")
+
+    changed, user, ghost = asyncio.run(main())
+    assert changed == 2
+    assert user["plan"] == "pro"
+    assert user["max_usage_per_day"] == mongo.get_max_usage_for_plan("pro")
+    assert ghost is None
+
+def test_bulk_ban_and_unban_keep_the_banned_set_in_sync(redis):
+    async def main():
+        for user_id in ("u1", "u2", "u3"):
+            await mongo.add_user(user_id, f"key-{user_id}")
+        await mongo.bulk_ban(["u1", "u2", "u3"])
+        await mongo.bulk_unban(["u2"])
+        return sorted(await mongo.get_all_banned_users()), (await mongo.get_user("u2"))["banned"]
+
+    assert asyncio.run(main()) == (["u1", "u3"], False)
+
+def test_bulk_update_users_refuses_api_key_changes(redis):
+    with pytest.raises(ValueError):
+        asyncio.run(mongo.bulk_update_users(["u1"], {"api_key": "new"}))
+
+def test_iter_users_loads_every_user_in_batches(redis):
+    async def main():
+        for index in range(5):
+            await mongo.add_user(f"u{index}", f"key{index}", plan="pro" if index % 2 else "free")
+        legacy = {"user_id": "old", "api_key": "key-old", "plan": "free", "banned": False, "usage": 1, "max_usage_per_day": 400, "last_reset": 0}
+        await redis.set("user:old", json.dumps(legacy))
+        return [batch async for batch in mongo.iter_users(batch_size=2, fields=("user_id", "plan"))]
+
+    batches = asyncio.run(main())
+    assert all(len(batch) <= 2 for batch in batches)
+    users = {user["user_id"]: user for batch in batches for user in batch}
+    assert sorted(users) == ["old", "u0", "u1", "u2", "u3", "u4"]
+    assert users["u1"] == {"user_id": "u1", "plan": "pro"}
+    assert users["old"] == {"user_id": "old", "plan": "free"}
+
+def test_reset_scheduler_backfills_once_then_resets_due_users(redis, monkeypatch):
+    backfills = []
+    backfill = mongo.backfill_usage_resets
+
+    async def counting_backfill(*args, **kwargs):
+        backfills.append(1)
+        return await backfill(*args, **kwargs)
+
+    monkeypatch.setattr(mongo, "backfill_usage_resets", counting_backfill)
+
+    async def main():
+        now = int(time.time())
+        for user_id in ("due", "fresh"):
+            await mongo.add_user(user_id, f"key-{user_id}")
+            await mongo.add_usage(user_id, 5)
+        # Past the reset bucket the backfill rounds up to.
+        await redis.hset("user:due", "last_reset", now - DAY - 2 * mongo.USAGE_RESET_BUCKET)
+        # Users created before the schedule existed have no entry yet.
+        await redis.delete(mongo.USAGE_RESETS)
+        first = await mongo.UsageResetScheduler().run_once()
+        marked = await redis.exists(mongo.USAGE_RESETS_BACKFILLED)
+        # A restarted worker finds the marker and skips the scan.
+        scheduler = mongo.UsageResetScheduler()
+        second = await scheduler.run_once()
+        return first, second, marked, scheduler._backfilled, await usage("due"), await usage("fresh")
+
+    first, second, marked, backfilled, due, fresh = asyncio.run(main())
+    assert (first, second) == (1, 0)
+    assert marked and backfilled
+    assert len(backfills) == 1
+    assert due["usage"] == 0
+    assert fresh["usage"] == 5
+
+def test_reset_scheduler_skips_the_run_while_another_worker_holds_the_lock(redis):
+    async def main():
+        await mongo.add_user("due", "key-due")
+        await mongo.add_usage("due", 5)
+        await redis.hset("user:due", "last_reset", int(time.time()) - DAY - 5)
+        await redis.zadd(mongo.USAGE_RESETS, {"due": 0})
+        scheduler = mongo.UsageResetScheduler()
+        lock = redis.lock(scheduler.lock_name, timeout=10)
+        await lock.acquire()
+        skipped = await scheduler.run_once()
+        held_usage = (await usage("due"))["usage"]
+        await lock.release()
+        return skipped, held_usage, await scheduler.run_once(), scheduler.reset
+
+    assert asyncio.run(main()) == (0, 5, 1, 1)
@@ -0,0 +1,61 @@
+import asyncio
+from utils.ratelimit import MemoryRateLimiter, RedisRateLimiter
+
+def hits(limiter, count: int, limit: int = 5, window: float = 60, key: str = "key"):
+    async def main():
+        return [await limiter.hit(key, limit, window) for _ in range(count)]
+    return asyncio.run(main())
+
+def test_memory_limiter_allows_a_burst_of_limit_requests():
+    results = hits(MemoryRateLimiter(), 6)
+    assert [result.allowed for result in results] == [True] * 5 + [False]
+    assert [result.remaining for result in results[:5]] == [4, 3, 2, 1, 0]
+    assert results[-1].retry_after > 0
+
+def test_memory_limiter_keys_are_independent():
+    limiter = MemoryRateLimiter()
+    hits(limiter, 5, key="a")
+    assert hits(limiter, 1, key="b")[0].allowed
+
+def test_memory_limiter_evicts_least_recently_used_keys():
+    limiter = MemoryRateLimiter(max_keys=2)
+    for key in ("a", "b", "c"):
+        hits(limiter, 1, key=key)
+    assert list(limiter._buckets) == ["b", "c"]
+
+def test_gcra_allows_a_burst_then_rejects(redis):
+    results = hits(RedisRateLimiter(), 6)
+    assert [result.allowed for result in results] == [True] * 5 + [False]
+    assert [result.remaining for result in results[:5]] == [4, 3, 2, 1, 0]
+    rejected = results[-1]
+    # One request's worth of the window (60s / 5) until the next slot.
+    assert 0 < rejected.retry_after <= 12
+    assert rejected.headers()["X-RateLimit-Remaining"] == "0"
+    assert int(rejected.headers()["Retry-After"]) >= 1
+
+def test_gcra_refills_at_the_emission_rate(redis):
+    async def main():
+        limiter = RedisRateLimiter()
+        for _ in range(2):
+            await limiter.hit("key", 2, 0.2)
+        rejected = await limiter.hit("key", 2, 0.2)
+        await asyncio.sleep(0.12)
+        return rejected.allowed, (await limiter.hit("key", 2, 0.2)).allowed
+
+    assert asyncio.run(main()) == (False, True)
+
+def test_gcra_state_expires_with_the_bucket(redis):
+    async def main():
+        await RedisRateLimiter().hit("key", 5, 60)
+        return await redis.pttl("ratelimit:key")
+
+    assert 0 < asyncio.run(main()) <= 12000
+
+def test_gcra_fails_open_when_redis_errors(redis, monkeypatch):
+    async def broken(*args, **kwargs):
+        raise ConnectionError("redis down")
+
+    limiter = RedisRateLimiter()
+    monkeypatch.setattr(limiter, "_script", broken)
+    result = hits(limiter, 1)[0]
+    assert result.allowed and result.remaining == 5
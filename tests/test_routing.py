@@ -0,0 +1,188 @@
+import asyncio
+import time
+import pytest
+from utils import routing
+from utils import scheduler as scheduler_module
+from utils.routing import CIRCUIT_FAILURES, CIRCUIT_OPEN_SECONDS, ProviderStats, Router
+from utils.scheduler import AdmissionScheduler
+
+class StubProvider:
+    max_concurrency = 4
+
+    def __init__(self, failures: int = 0, first_chunk_delay: float = 0, fail_mid_stream: bool = False):
+        self.failures = failures
+        self.first_chunk_delay = first_chunk_delay
+        self.fail_mid_stream = fail_mid_stream
+        self.calls = 0
+        self.cancelled = 0
+
+    async def create_chat_completion(self, chat_request):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.first_chunk_delay)
+            if self.calls <= self.failures:
+                raise ConnectionError("upstream down")
+            yield {"choices": [{"delta": {"content": "a"}}], "provider": self}
+            if self.fail_mid_stream:
+                raise ConnectionError("connection reset")
+            yield {"choices": [{"delta": {"content": "b"}}], "provider": self}
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+
+class Fast(StubProvider):
+    pass
+
+class Slow(StubProvider):
+    pass
+
+class Flaky(StubProvider):
+    pass
+
+@pytest.fixture(autouse=True)
+def fresh_scheduler(monkeypatch):
+    fresh = AdmissionScheduler()
+    monkeypatch.setattr(scheduler_module, "scheduler", fresh)
+    monkeypatch.setattr(routing, "scheduler", fresh)
+    return fresh
+
+def trip(stats: ProviderStats) -> None:
+    for _ in range(CIRCUIT_FAILURES):
+        stats.record_failure()
+
+def test_circuit_opens_after_consecutive_failures():
+    stats = ProviderStats()
+    for _ in range(CIRCUIT_FAILURES - 1):
+        stats.record_failure()
+    assert not stats.circuit_open
+    stats.record_failure()
+    assert stats.circuit_open
+    assert stats.open_until - time.monotonic() == pytest.approx(CIRCUIT_OPEN_SECONDS, abs=0.5)
+
+def test_half_open_failure_reopens_for_twice_as_long():
+    stats = ProviderStats()
+    trip(stats)
+    stats.open_until = time.monotonic() - 1
+    assert not stats.circuit_open
+    # One failed probe is enough to reopen, with the backoff doubled.
+    stats.record_failure()
+    assert stats.circuit_open
+    assert stats.open_until - time.monotonic() == pytest.approx(2 * CIRCUIT_OPEN_SECONDS, abs=0.5)
+
+def test_half_open_success_closes_and_resets_the_backoff():
+    stats = ProviderStats()
+    trip(stats)
+    stats.open_until = time.monotonic() - 1
+    stats.record_success(0.1)
+    assert stats.consecutive_failures == 0
+    assert stats.open_seconds == CIRCUIT_OPEN_SECONDS
+    stats.record_failure()
+    assert not stats.circuit_open
+
+def test_score_uses_ewma_latency_load_and_errors():
+    stats = ProviderStats()
+    assert stats.score(stream=True) == routing.DEFAULT_LATENCY
+    stats.record_success(1.0)
+    stats.record_success(2.0)
+    assert stats.latency == pytest.approx(1.2)
+    # No TTFT yet, so streams fall back to the full latency.
+    assert stats.score(stream=True) == pytest.approx(1.2)
+    stats.record_ttft(0.5)
+    assert stats.score(stream=True) == pytest.approx(0.5)
+    stats.inflight = 1
+    assert stats.score(stream=False) == pytest.approx(2.4)
+    stats.record_failure()
+    assert stats.score(stream=False) == pytest.approx(2.4 / 0.8)
+
+def test_rank_orders_tiers_by_score_and_moves_tripped_providers_last(monkeypatch):
+    router = Router()
+    fast, slow, flaky, other = Fast(), Slow(), Flaky(), StubProvider()
+    router.stats(fast, "m").record_success(0.1)
+    router.stats(slow, "m").record_success(3.0)
+    router.stats(other, "m").record_success(1.0)
+    trip(router.stats(flaky, "m"))
+    picks = []
+
+    def choices(population, weights):
+        picks.append(weights)
+        return [population[0]]
+
+    monkeypatch.setattr(routing.random, "choices", choices)
+    ranked = router.rank([slow, flaky, fast], [other], "m", stream=False)
+    assert ranked == [fast, slow, other, flaky]
+    # The head is a weighted pick that favours the faster provider.
+    assert picks == [[pytest.approx(10.0), pytest.approx(1 / 3)]]
+
+def test_tripped_providers_are_ordered_by_reopen_time():
+    router = Router()
+    first, second = Fast(), Slow()
+    trip(router.stats(second, "m"))
+    trip(router.stats(first, "m"))
+    router.stats(second, "m").open_until += 5
+    assert router.rank([second, first], [], "m", stream=True) == [first, second]
+
+def test_stream_fails_over_and_releases_every_slot(fresh_scheduler):
+    router = Router()
+    flaky, fast = Flaky(failures=1), Fast()
+
+    async def main():
+        provider, chunks = await router.stream({"model": "m"}, [flaky, fast])
+        received = [chunk async for chunk in chunks]
+        return provider, len(received)
+
+    assert asyncio.run(main()) == (fast, 2)
+    assert router.stats(flaky, "m").consecutive_failures == 1
+    assert router.stats(fast, "m").latency is not None
+    for provider in (flaky, fast):
+        assert router.stats(provider, "m").inflight == 0
+        assert fresh_scheduler.queue(provider).in_use == 0
+
+def test_stream_failure_mid_relay_is_recorded(fresh_scheduler):
+    router = Router()
+    provider = Flaky(fail_mid_stream=True)
+
+    async def main():
+        _, chunks = await router.stream({"model": "m"}, [provider])
+        with pytest.raises(ConnectionError):
+            async for _ in chunks:
+                pass
+
+    asyncio.run(main())
+    stats = router.stats(provider, "m")
+    assert (stats.consecutive_failures, stats.inflight) == (1, 0)
+    assert fresh_scheduler.queue(provider).in_use == 0
+
+def test_complete_hedges_after_p95_and_cancels_the_loser(monkeypatch, fresh_scheduler):
+    monkeypatch.setattr(routing, "HEDGE_MIN_DELAY", 0.05)
+    router = Router()
+    slow, fast = Slow(first_chunk_delay=1), Fast()
+    for _ in range(routing.HEDGE_MIN_SAMPLES):
+        router.stats(slow, "m").record_success(0.05)
+
+    async def main():
+        start = time.monotonic()
+        provider, response = await router.complete({"model": "m"}, [slow, fast], hedge=True)
+        elapsed = time.monotonic() - start
+        # Let the cancelled hedge unwind.
+        await asyncio.sleep(0.05)
+        return provider, response["provider"], elapsed
+
+    provider, responder, elapsed = asyncio.run(main())
+    assert provider is fast and responder is fast
+    assert 0.05 <= elapsed < 0.5
+    assert slow.cancelled == 1
+    for stub in (slow, fast):
+        assert router.stats(stub, "m").inflight == 0
+        assert fresh_scheduler.queue(stub).in_use == 0
+
+def test_complete_does_not_hedge_without_enough_samples(fresh_scheduler):
+    router = Router()
+    slow, fast = Slow(first_chunk_delay=0.2), Fast()
+
+    async def main():
+        return await router.complete({"model": "m"}, [slow, fast], hedge=True)
+
+    provider, _ = asyncio.run(main())
+    assert provider is slow
+    assert fast.calls == 0
+    assert router.stats(slow, "m").inflight == 0
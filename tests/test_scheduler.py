@@ -0,0 +1,163 @@
+import asyncio
+import gc
+import time
+import httpx
+import pytest
+import api
+from routes import chatcompletions
+from utils import mongo
+from utils import scheduler as scheduler_module
+from utils import singleflight as singleflight_module
+from utils.routing import Router
+from utils.scheduler import AdmissionRejected, AdmissionScheduler, ProviderQueue
+
+class SlowProvider:
+    max_concurrency = 1
+
+    async def create_chat_completion(self, chat_request):
+        await asyncio.sleep(1)
+        yield {"choices": []}
+
+class OtherSlowProvider(SlowProvider):
+    pass
+
+class StreamingProvider:
+    max_concurrency = 1
+
+    async def create_chat_completion(self, chat_request):
+        for token in ("a", "b"):
+            yield token
+
+@pytest.fixture
+def fresh_scheduler(monkeypatch):
+    fresh = AdmissionScheduler()
+    monkeypatch.setattr(scheduler_module, "scheduler", fresh)
+    monkeypatch.setattr("utils.routing.scheduler", fresh)
+    return fresh
+
+def test_free_slot_is_admitted_immediately():
+    async def main():
+        queue = ProviderQueue(slots=1)
+        await queue.acquire("free")
+        return queue.in_use
+
+    assert asyncio.run(main()) == 1
+
+def test_queued_waiter_gets_released_slot():
+    async def main():
+        queue = ProviderQueue(slots=1)
+        await queue.acquire("free")
+        waiter = asyncio.create_task(queue.acquire("pro"))
+        await asyncio.sleep(0)
+        assert queue.depth == 1
+        queue.release(0.1)
+        await waiter
+        return queue.in_use, queue.depth
+
+    assert asyncio.run(main()) == (1, 0)
+
+def test_full_backlog_is_rejected():
+    async def main():
+        queue = ProviderQueue(slots=1, max_queue=1)
+        await queue.acquire("free")
+        waiter = asyncio.create_task(queue.acquire("free"))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected, match="backlog"):
+            await queue.acquire("free")
+        waiter.cancel()
+
+    asyncio.run(main())
+
+def test_expired_deadline_is_rejected_without_queueing():
+    async def main():
+        queue = ProviderQueue(slots=1)
+        await queue.acquire("free")
+        with pytest.raises(AdmissionRejected, match="Timed out"):
+            await queue.acquire("free", time.monotonic() - 1)
+        return queue.depth, queue.rejected
+
+    assert asyncio.run(main()) == (0, 1)
+
+def test_slots_are_shared_in_proportion_to_plan_weight():
+    async def main():
+        queue = ProviderQueue(slots=1)
+        await queue.acquire("free")
+        order = []
+
+        async def wait(plan):
+            await queue.acquire(plan)
+            order.append(plan)
+
+        waiters = [asyncio.create_task(wait(plan)) for plan in ["free", "enterprise"] * 10]
+        await asyncio.sleep(0)
+        for _ in range(10):
+            queue.release(0.1)
+            await asyncio.sleep(0)
+        for waiter in waiters:
+            waiter.cancel()
+        return order
+
+    order = asyncio.run(main())
+    assert len(order) == 10
+    assert order.count("enterprise") > order.count("free")
+
+def test_failover_shares_one_admission_deadline(fresh_scheduler):
+    providers = [SlowProvider(), OtherSlowProvider()]
+
+    async def main():
+        # Saturate both providers so every attempt has to queue.
+        for provider in providers:
+            await fresh_scheduler.acquire(provider, "free")
+        start = time.monotonic()
+        with pytest.raises(AdmissionRejected):
+            await Router().stream({"model": "gpt-4o"}, providers, "free", deadline=start + 0.2)
+        return time.monotonic() - start
+
+    assert asyncio.run(main()) < 0.35
+
+@pytest.mark.parametrize("drop", ["aclose", "gc"])
+def test_unstarted_stream_gives_its_slot_back(fresh_scheduler, drop):
+    router = Router()
+    provider = StreamingProvider()
+
+    async def main():
+        _, chunks = await router.stream({"model": "m"}, [provider])
+        in_use = fresh_scheduler.queue(provider).in_use
+        if drop == "aclose":
+            await chunks.aclose()
+        else:
+            del chunks
+            gc.collect()
+        return in_use
+
+    assert asyncio.run(main()) == 1
+    assert fresh_scheduler.queue(provider).in_use == 0
+    assert router.stats(provider, "m").inflight == 0
+
+@pytest.mark.parametrize("coalesce", [False, True])
+def test_stream_route_releases_the_slot_when_charging_fails(redis, monkeypatch, fresh_scheduler, coalesce):
+    provider = StreamingProvider()
+
+    async def add_usage(*args, **kwargs):
+        raise ConnectionError("redis down")
+
+    monkeypatch.setattr(chatcompletions, "rank_providers", lambda chat_request: [provider])
+    monkeypatch.setattr(chatcompletions, "add_usage", add_usage)
+    monkeypatch.setattr(singleflight_module, "COMPLETION_COALESCE", coalesce)
+
+    async def main():
+        await mongo.add_user("u1", "key1")
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            response = await client.post(
+                "/v1/chat/completions",
+                json={"model": "m", "stream": True, "messages": [{"role": "user", "content": "hi"}]},
+                headers={"Authorization": "Bearer key1"},
+            )
+        # A coalesced stream is closed by its pump task once the last reader leaves.
+        await asyncio.sleep(0.01)
+        return response.status_code
+
+    assert asyncio.run(main()) == 469
+    assert fresh_scheduler.queue(provider).in_use == 0
+    assert chatcompletions.provider_router.stats(provider, "m").inflight == 0
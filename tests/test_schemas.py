@@ -0,0 +1,54 @@
+import json
+import pytest
+from utils import schemas
+from utils.schemas import RequestValidationError
+
+pytestmark = pytest.mark.skipif(schemas.msgspec is None, reason="msgspec is not installed")
+
+PARSERS = [schemas._parse_python, schemas._parse_msgspec] if schemas.msgspec is not None else []
+
+def encode(body) -> bytes:
+    return json.dumps(body).encode()
+
+VALID = [
+    {"messages": [{"role": "user", "content": "hi"}]},
+    {"model": "gpt-4o", "stream": True, "temperature": 0.5, "messages": [{"role": "system", "content": "x"}, {"role": "user", "content": "hi"}]},
+    {"model": "gpt-4o", "messages": [{"role": "user", "content": [{"type": "text", "text": "hi"}]}], "unknown": 1},
+    {"model": "gpt-4o", "messages": [{"role": "assistant", "content": None, "tool_calls": [{"id": "a"}]}, {"role": "tool", "content": "1", "tool_call_id": "a"}]},
+    {"model": "gpt-4o", "messages": [{"role": "user", "content": "hi", "extra": True, "name": None}], "seed": 1, "stop": ["x"]},
+]
+
+INVALID = [
+    b"{not json",
+    b"[]",
+    encode({"messages": []}),
+    encode({"model": "gpt-4o"}),
+    encode({"model": "", "messages": [{"role": "user", "content": "hi"}]}),
+    encode({"stream": "yes", "messages": [{"role": "user", "content": "hi"}]}),
+    encode({"messages": [{"role": "robot", "content": "hi"}]}),
+    encode({"messages": ["hi"]}),
+    encode({"messages": [{"role": "user", "content": 5}]}),
+    encode({"messages": [{"role": "user", "content": "hi"}] * (schemas.MAX_MESSAGES + 1)}),
+    encode({"messages": [{"role": "user", "content": "x" * (schemas.MAX_CONTENT_CHARS + 1)}]}),
+    encode({"messages": [{"role": "user", "content": [{"type": "text", "text": "x" * (schemas.MAX_CONTENT_CHARS + 1)}]}]}),
+]
+
+@pytest.mark.parametrize("body", VALID)
+def test_parsers_agree_on_valid_requests(body):
+    results = [parse(encode(body)) for parse in PARSERS]
+    assert results[0] == results[1]
+    assert results[0]["model"] == body.get("model", "gpt-3.5-turbo")
+    assert results[0]["stream"] is body.get("stream", False)
+    assert "unknown" not in results[0]
+
+@pytest.mark.parametrize("body", INVALID)
+def test_parsers_agree_on_invalid_requests(body):
+    for parse in PARSERS:
+        with pytest.raises(RequestValidationError) as error:
+            parse(body)
+        assert error.value.status_code == 400
+
+def test_null_fields_are_dropped():
+    body = encode({"messages": [{"role": "user", "content": "hi"}], "temperature": None, "user": None})
+    for parse in PARSERS:
+        assert parse(body) == {"model": "gpt-3.5-turbo", "stream": False, "messages": [{"role": "user", "content": "hi"}]}
@@ -0,0 +1,112 @@
+import asyncio
+import gc
+from utils import singleflight as singleflight_module
+from utils.singleflight import SingleFlight, can_coalesce
+
+def counting_stream(count: int, delay: float = 0.005):
+    started = []
+    cancelled = []
+
+    async def start():
+        started.append(True)
+
+        async def chunks():
+            try:
+                for index in range(count):
+                    await asyncio.sleep(delay)
+                    yield index
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        return "provider", chunks()
+
+    return start, started, cancelled
+
+def test_only_deterministic_requests_coalesce(monkeypatch):
+    monkeypatch.setattr(singleflight_module, "COMPLETION_COALESCE", True)
+    request = {"model": "gpt-4o", "messages": [{"role": "user", "content": "hi"}]}
+    assert can_coalesce(request, {})
+    assert can_coalesce({**request, "temperature": 0}, {})
+    assert not can_coalesce({**request, "temperature": 0.7}, {})
+    assert not can_coalesce({**request, "n": 2}, {})
+    assert not can_coalesce(request, {"x-cache-bypass": "1"})
+
+def test_coalescing_is_off_by_default():
+    assert not singleflight_module.COMPLETION_COALESCE
+    assert not can_coalesce({"model": "gpt-4o", "messages": []}, {})
+
+def test_subscribers_share_one_upstream_at_their_own_pace():
+    start, started, _ = counting_stream(5)
+
+    async def main():
+        flights = SingleFlight()
+        _, slow = await flights.stream("key", start)
+        _, fast = await flights.stream("key", start)
+
+        async def read_slowly():
+            items = []
+            async for item in slow:
+                items.append(item)
+                await asyncio.sleep(0.02)
+            return items
+
+        return await asyncio.gather(read_slowly(), fast.__anext__()), flights.shared
+
+    (slow_items, first), shared = asyncio.run(main())
+    assert slow_items == [0, 1, 2, 3, 4]
+    assert first == 0
+    assert shared == 1
+    assert len(started) == 1
+
+def test_unstarted_subscription_releases_upstream_when_dropped():
+    start, _, cancelled = counting_stream(100, delay=0.01)
+
+    async def main():
+        flights = SingleFlight()
+        _, chunks = await flights.stream("key", start)
+        del chunks
+        gc.collect()
+        await asyncio.sleep(0.05)
+        return flights._streams
+
+    assert asyncio.run(main()) == {}
+    assert cancelled == [True]
+
+def test_closed_subscriber_does_not_cancel_one_still_waiting():
+    start, _, cancelled = counting_stream(3)
+
+    async def main():
+        flights = SingleFlight()
+        _, first = await flights.stream("key", start)
+        _, second = await flights.stream("key", start)
+        await first.__anext__()
+        await first.aclose()
+        return [item async for item in second]
+
+    assert asyncio.run(main()) == [0, 1, 2]
+    assert cancelled == []
+
+def test_log_drops_chunks_every_subscriber_has_read(monkeypatch):
+    monkeypatch.setattr(singleflight_module, "COALESCE_TRIM_CHUNKS", 4)
+    start, started, _ = counting_stream(20)
+
+    async def main():
+        flights = SingleFlight()
+        _, chunks = await flights.stream("key", start)
+        items = []
+        longest = 0
+        async for item in chunks:
+            items.append(item)
+            broadcast = flights._streams.get("key")
+            if broadcast is not None:
+                longest = max(longest, len(broadcast.chunks))
+                if item == 10:
+                    # Early chunks are gone, so a late request starts its own upstream.
+                    assert not broadcast.joinable
+        return items, longest
+
+    items, longest = asyncio.run(main())
+    assert items == list(range(20))
+    assert longest <= 4
+    assert len(started) == 1
@@ -0,0 +1,52 @@
+import asyncio
+from utils.streaming import ChunkEncoder, NDJSONParser, SSEParser, encode_stream
+
+def feed_all(parser, chunks):
+    events = []
+    for chunk in chunks:
+        events += parser.feed(chunk)
+    return events + parser.flush()
+
+def test_sse_events_split_across_chunks():
+    stream = b'data: {"a":1}\n\ndata: {"b":2}\n\ndata: [DONE]\n\n'
+    expected = [b'{"a":1}', b'{"b":2}', b"[DONE]"]
+    assert feed_all(SSEParser(), [stream]) == expected
+    assert feed_all(SSEParser(), [stream[i:i + 1] for i in range(len(stream))]) == expected
+
+def test_sse_handles_crlf_and_missing_space():
+    assert feed_all(SSEParser(), [b"data:one\r\n\r\ndata: two\r\n\r\n"]) == [b"one", b"two"]
+
+def test_sse_skips_other_fields_and_comments():
+    stream = b": keep-alive\n\nevent: message\nid: 1\nretry: 10\ndata: x\n\n"
+    assert feed_all(SSEParser(), [stream]) == [b"x"]
+
+def test_sse_joins_multiline_data():
+    assert feed_all(SSEParser(), [b"data: a\ndata: b\n\n"]) == [b"a\nb"]
+
+def test_sse_flush_completes_an_unterminated_event():
+    parser = SSEParser()
+    assert parser.feed(b"data: last") == []
+    assert parser.flush() == [b"last"]
+
+def test_ndjson_lines_split_across_chunks():
+    stream = b'{"a":1}\n\n  {"b":2}\r\n{"c":3}'
+    assert feed_all(NDJSONParser(), [stream[i:i + 3] for i in range(0, len(stream), 3)]) == [b'{"a":1}', b'{"b":2}', b'{"c":3}']
+
+def test_bare_content_strings_encode_like_content_deltas():
+    encoder = ChunkEncoder("m")
+    assert encoder.encode("hi") == encoder.encode({"choices": [{"delta": {"content": "hi"}}]})
+
+def test_encode_stream_merges_bare_content_strings():
+    async def chunks():
+        for token in ("a", "b", "c"):
+            yield token
+        yield {"choices": [{"delta": {}, "finish_reason": "stop"}]}
+
+    async def main():
+        encoder = ChunkEncoder("m")
+        frames = [frame async for frame in encode_stream(chunks(), encoder, coalesce_ms=50)]
+        return encoder, frames
+
+    encoder, frames = asyncio.run(main())
+    assert frames[0] == encoder.encode_content("abc")
+    assert b'"finish_reason":"stop"' in frames[1]
@@ -0,0 +1,24 @@
+from utils import timing
+from utils.timing import RequestTimer, span, start_timer, timing_exposed
+
+def test_timings_are_hidden_by_default():
+    assert not timing.SERVER_TIMING
+    assert not timing_exposed({})
+
+def test_profile_token_exposes_timings(monkeypatch):
+    monkeypatch.setattr(timing, "TIMING_PROFILE_TOKEN", "secret")
+    assert timing_exposed({timing.TIMING_PROFILE_HEADER: "secret"})
+    assert not timing_exposed({timing.TIMING_PROFILE_HEADER: "guess"})
+
+def test_repeated_spans_accumulate():
+    timer = start_timer()
+    with span("auth"):
+        pass
+    with span("auth"):
+        pass
+    assert timer.counts == {"auth": 2}
+    assert set(timer.breakdown()) == {"auth", "total"}
+    assert timer.header().startswith("auth;dur=")
+
+def test_stream_event_is_a_named_sse_frame():
+    assert RequestTimer().event().startswith(b"event: timing\ndata: {")
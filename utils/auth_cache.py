@@ -0,0 +1,97 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+AUTH_CACHE_ENABLED = os.getenv("AUTH_CACHE_ENABLED", "1") == "1"
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+# Upper bound on how long a ban or plan change can go unnoticed by a worker
+# that missed the pub/sub invalidation. Usage is not cached (see CREDIT_FIELDS
+# in utils.mongo), so this does not let users overspend.
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "10"))
+INVALIDATION_CHANNEL = "user_invalidate"
+
+class AuthCache:
+    def __init__(self, max_size: int = AUTH_CACHE_SIZE, ttl: float = AUTH_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._keys_by_user: Dict[str, Set[str]] = {}
+
+    def get(self, api_key: str) -> Optional[Dict]:
+        entry = self._entries.get(api_key)
+        if entry is None:
+            return None
+        expires_at, user = entry
+        if expires_at < time.monotonic():
+            self._remove(api_key)
+            return None
+        self._entries.move_to_end(api_key)
+        return dict(user)
+
+    def set(self, api_key: str, user: Dict) -> None:
+        self._remove(api_key)
+        self._entries[api_key] = (time.monotonic() + self.ttl, dict(user))
+        self._keys_by_user.setdefault(user["user_id"], set()).add(api_key)
+        while len(self._entries) > self.max_size:
+            self._remove(next(iter(self._entries)))
+
+    def invalidate(self, user_id: Optional[str] = None, api_keys: Iterable[str] = ()) -> None:
+        for api_key in list(self._keys_by_user.get(user_id, ())) + list(api_keys):
+            self._remove(api_key)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._keys_by_user.clear()
+
+    def _remove(self, api_key: str) -> None:
+        entry = self._entries.pop(api_key, None)
+        if entry is None:
+            return
+        user_id = entry[1]["user_id"]
+        keys = self._keys_by_user.get(user_id)
+        if keys is not None:
+            keys.discard(api_key)
+            if not keys:
+                del self._keys_by_user[user_id]
+
+auth_cache = AuthCache()
+
+def invalidation_message(user_id: str, api_keys: Iterable[str] = ()) -> str:
+    return json.dumps({"user_id": user_id, "api_keys": [key for key in api_keys if key]})
+
+def handle_invalidation(data: str) -> None:
+    try:
+        message = json.loads(data)
+    except (TypeError, ValueError):
+        return
+    user_ids = message.get("user_ids") or [message.get("user_id")]
+    for user_id in user_ids:
+        auth_cache.invalidate(user_id, message.get("api_keys", ()))
+
+async def listen_for_invalidations(client) -> None:
+    while True:
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(INVALIDATION_CHANNEL)
+            # Anything published while we were disconnected is lost, so start clean.
+            auth_cache.clear()
+            async for message in pubsub.listen():
+                if message and message.get("type") == "message":
+                    handle_invalidation(message["data"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Auth cache invalidation listener failed: {e}")
+            auth_cache.clear()
+            await asyncio.sleep(1)
+        finally:
+            try:
+                await pubsub.aclose()
+            except Exception:
+                pass
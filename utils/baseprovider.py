@@ -1,6 +1,27 @@
 from dataclasses import dataclass, field
 import abc
-from typing import AsyncGenerator
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncGenerator, Callable, Dict, Optional
+from urllib.parse import urlsplit
+import aiohttp
+from utils.streaming import NDJSONParser, RawChunk, SSEParser, loads
+
+PROVIDER_THREADS = int(os.getenv("PROVIDER_THREADS", "64"))
+PROVIDER_MAX_CONCURRENCY = int(os.getenv("PROVIDER_MAX_CONCURRENCY", "32"))
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "256"))
+HTTP_KEEPALIVE = float(os.getenv("HTTP_KEEPALIVE", "60"))
+HTTP_DNS_TTL = int(os.getenv("HTTP_DNS_TTL", "300"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "120"))
+
+# Shared by every provider that wraps a blocking client; the per-provider
+# semaphores below keep one slow upstream from taking all of its threads.
+sync_executor = ThreadPoolExecutor(max_workers=PROVIDER_THREADS, thread_name_prefix="provider")
+
+_ITEM, _DONE, _ERROR = 0, 1, 2
 
 @dataclass
 class ChatCompletionArgs:
@@ -10,10 +31,193 @@ class ChatCompletionArgs:
     kwargs: dict = field(default_factory=dict)
 
 class BaseProvider(abc.ABC):
+    max_concurrency: Optional[int] = None
+    stream_buffer: int = 64
+
     @abc.abstractmethod
     def create_chat_completion(self, args: ChatCompletionArgs) -> dict:
         pass
 
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        semaphore = self.__dict__.get("_sync_semaphore")
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_concurrency or PROVIDER_MAX_CONCURRENCY)
+            self._sync_semaphore = semaphore
+        return semaphore
+
+    async def _submit(self, func: Callable) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        semaphore = self._get_semaphore()
+        await semaphore.acquire()
+
+        def release(_) -> None:
+            try:
+                loop.call_soon_threadsafe(semaphore.release)
+            except RuntimeError:
+                pass
+
+        try:
+            future = sync_executor.submit(func)
+        except BaseException:
+            semaphore.release()
+            raise
+        # Released from the executor's future, not the asyncio wrapper: a
+        # cancelled caller must not free the slot while the thread still runs.
+        future.add_done_callback(release)
+        return asyncio.wrap_future(future, loop=loop)
+
+    async def run_sync(self, func: Callable, *args, **kwargs) -> Any:
+        return await (await self._submit(lambda: func(*args, **kwargs)))
+
+    async def iterate_sync(self, func: Callable, *args, **kwargs) -> AsyncGenerator[Any, None]:
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        slots = threading.Semaphore(self.stream_buffer)
+        cancelled = threading.Event()
+
+        def put(kind: int, value: Any) -> bool:
+            while not slots.acquire(timeout=0.1):
+                if cancelled.is_set():
+                    return False
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, (kind, value))
+            except RuntimeError:
+                return False
+            return True
+
+        def produce() -> None:
+            iterator = None
+            try:
+                iterator = iter(func(*args, **kwargs))
+                for item in iterator:
+                    if cancelled.is_set() or not put(_ITEM, item):
+                        return
+                put(_DONE, None)
+            except BaseException as e:
+                put(_ERROR, e)
+            finally:
+                close = getattr(iterator, "close", None)
+                if close is not None:
+                    close()
+
+        await self._submit(produce)
+
+        try:
+            while True:
+                kind, value = await queue.get()
+                slots.release()
+                if kind == _DONE:
+                    break
+                if kind == _ERROR:
+                    raise value
+                yield value
+        finally:
+            # Reached on client disconnect too; the worker stops at its next
+            # chunk and closes the upstream iterator.
+            cancelled.set()
+
+class UpstreamHTTPError(Exception):
+    def __init__(self, status: int, body: str):
+        super().__init__(f"Upstream returned {status}: {body}")
+        self.status = status
+
+# One keep-alive session per upstream origin, shared by every provider that
+# talks to it, so a request normally reuses a warm connection instead of
+# paying for DNS, TCP and TLS before the first token.
+_http_sessions: Dict[str, aiohttp.ClientSession] = {}
+
+def get_http_session(url: str) -> aiohttp.ClientSession:
+    parts = urlsplit(url)
+    origin = f"{parts.scheme}://{parts.netloc}"
+    session = _http_sessions.get(origin)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_POOL_SIZE,
+            keepalive_timeout=HTTP_KEEPALIVE,
+            ttl_dns_cache=HTTP_DNS_TTL,
+        )
+        session = _http_sessions[origin] = aiohttp.ClientSession(connector=connector)
+    return session
+
+async def close_http_sessions() -> None:
+    sessions = list(_http_sessions.values())
+    _http_sessions.clear()
+    await asyncio.gather(*(session.close() for session in sessions), return_exceptions=True)
+
+class BaseHTTPProvider(BaseProvider):
+    # Talks to an OpenAI-compatible HTTP upstream. Subclasses set base_url
+    # and models, and override the hooks below when the upstream differs.
+    base_url: str = ""
+    chat_path: str = "/chat/completions"
+    stream_format: str = "sse"
+    connect_timeout: float = HTTP_CONNECT_TIMEOUT
+    read_timeout: float = HTTP_READ_TIMEOUT
+    aliases: Dict[str, str] = {}
+
+    def headers(self) -> Dict[str, str]:
+        return {}
+
+    def upstream_model(self, model: str) -> str:
+        return self.aliases.get(model, model)
+
+    def build_payload(self, args: dict) -> dict:
+        return {**args, "model": self.upstream_model(args["model"])}
+
+    def transform_chunk(self, chunk: dict, model: str) -> Optional[dict]:
+        # Return None to drop a chunk. By default only the aliased model
+        # name is put back.
+        if "model" in chunk:
+            chunk["model"] = model
+        return chunk
+
+    def transform_response(self, response: dict, model: str) -> dict:
+        if "model" in response:
+            response["model"] = model
+        return response
+
+    def passthrough(self, model: str) -> bool:
+        # Upstream bytes are forwarded untouched only when nothing would
+        # change them: OpenAI-format SSE, the same model name, no transforms.
+        cls = type(self)
+        return (
+            self.stream_format == "sse"
+            and self.upstream_model(model) == model
+            and cls.transform_chunk is BaseHTTPProvider.transform_chunk
+            and cls.transform_response is BaseHTTPProvider.transform_response
+        )
+
+    def timeout(self) -> aiohttp.ClientTimeout:
+        return aiohttp.ClientTimeout(total=None, connect=self.connect_timeout, sock_read=self.read_timeout)
+
+    async def iter_events(self, response: aiohttp.ClientResponse) -> AsyncGenerator[bytes, None]:
+        parser = SSEParser() if self.stream_format == "sse" else NDJSONParser()
+        async for data in response.content.iter_any():
+            for event in parser.feed(data):
+                yield event
+        for event in parser.flush():
+            yield event
+
+    async def create_chat_completion(self, args):
+        model = args.get("model")
+        url = f"{self.base_url}{self.chat_path}"
+        passthrough = self.passthrough(model)
+        async with get_http_session(url).post(url, json=self.build_payload(args), headers=self.headers(), timeout=self.timeout()) as response:
+            if response.status >= 400:
+                raise UpstreamHTTPError(response.status, (await response.text())[:500])
+            if not args.get("stream", False):
+                body = await response.read()
+                yield RawChunk(body) if passthrough else self.transform_response(loads(body), model)
+                return
+            async for data in self.iter_events(response):
+                if data == b"[DONE]":
+                    break
+                if passthrough:
+                    yield RawChunk(data)
+                    continue
+                chunk = self.transform_chunk(loads(data), model)
+                if chunk is not None:
+                    yield chunk
+
 class BaseTTSProvider(abc.ABC):
     @abc.abstractmethod
     def generate_audio(self, text: str, voice: str = "nova") -> str:
@@ -0,0 +1,166 @@
+import asyncio
+import glob
+import gzip
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+TRAFFIC_CAPTURE = os.getenv("TRAFFIC_CAPTURE", "0") == "1"
+# Kept out of the repo root, where requests.jsonl is already taken.
+TRAFFIC_CAPTURE_DIR = os.getenv("TRAFFIC_CAPTURE_DIR", "captures")
+TRAFFIC_CAPTURE_SAMPLE = float(os.getenv("TRAFFIC_CAPTURE_SAMPLE", "1.0"))
+TRAFFIC_CAPTURE_MAX_BYTES = int(os.getenv("TRAFFIC_CAPTURE_MAX_BYTES", str(32 * 1024 * 1024)))
+TRAFFIC_CAPTURE_MAX_FILES = int(os.getenv("TRAFFIC_CAPTURE_MAX_FILES", "20"))
+TRAFFIC_CAPTURE_QUEUE = int(os.getenv("TRAFFIC_CAPTURE_QUEUE", "50000"))
+TRAFFIC_CAPTURE_FLUSH_INTERVAL = float(os.getenv("TRAFFIC_CAPTURE_FLUSH_INTERVAL", "2"))
+# Client ids are hashed with this salt. Without one a random salt is used,
+# so ids only line up within a single process lifetime.
+TRAFFIC_CAPTURE_SALT = os.getenv("TRAFFIC_CAPTURE_SALT", "") or os.urandom(16).hex()
+
+CAPTURE_PREFIX = "requests-"
+CAPTURE_SUFFIX = ".jsonl.gz"
+
+def client_id(user_id: str) -> str:
+    return hashlib.sha256(f"{TRAFFIC_CAPTURE_SALT}:{user_id}".encode()).hexdigest()[:16]
+
+def _content_size(content) -> int:
+    if isinstance(content, str):
+        return len(content)
+    if isinstance(content, list):
+        # Multimodal content: count the text parts only.
+        return sum(len(part.get("text", "")) for part in content if isinstance(part, dict))
+    return 0
+
+def request_shape(request, status: int, start: float, duration: float) -> dict:
+    # Only the shape of the traffic is kept: no keys, user ids, prompts or replies.
+    state = request.state
+    record = {
+        "ts": round(start, 4),
+        "method": request.method,
+        "path": request.url.path,
+        "status": status,
+        "duration": round(duration, 4),
+    }
+    user = getattr(state, "user", None)
+    if user:
+        record["plan"] = user.get("plan")
+        record["client"] = client_id(str(user.get("user_id")))
+    chat_request = getattr(state, "chat_request", None)
+    if isinstance(chat_request, dict):
+        messages = chat_request.get("messages") or []
+        record["model"] = chat_request.get("model")
+        record["stream"] = bool(chat_request.get("stream"))
+        record["roles"] = [m.get("role") for m in messages if isinstance(m, dict)]
+        record["message_chars"] = [_content_size(m.get("content")) for m in messages if isinstance(m, dict)]
+        for option in ("temperature", "max_tokens", "n"):
+            if option in chat_request:
+                record[option] = chat_request[option]
+    provider = getattr(state, "provider", None)
+    if provider:
+        record["provider"] = provider
+    return record
+
+class TrafficCapture:
+    def __init__(
+        self,
+        directory: str = TRAFFIC_CAPTURE_DIR,
+        sample: float = TRAFFIC_CAPTURE_SAMPLE,
+        max_bytes: int = TRAFFIC_CAPTURE_MAX_BYTES,
+        max_files: int = TRAFFIC_CAPTURE_MAX_FILES,
+        queue_size: int = TRAFFIC_CAPTURE_QUEUE,
+        flush_interval: float = TRAFFIC_CAPTURE_FLUSH_INTERVAL,
+    ):
+        self.directory = directory
+        self.sample = sample
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.flush_interval = flush_interval
+        self._buffer: deque = deque(maxlen=queue_size)
+        self._path: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+        self._lock = threading.Lock()
+        self.dropped = 0
+        self.written = 0
+
+    def sampled(self) -> bool:
+        return self.sample >= 1.0 or random.random() < self.sample
+
+    def record(self, entry: dict) -> None:
+        # Never blocks the request: when the writer falls behind, the oldest
+        # entries are dropped.
+        if len(self._buffer) == self._buffer.maxlen:
+            self.dropped += 1
+        self._buffer.append(entry)
+
+    def _rotate(self) -> str:
+        if self._path is None or not os.path.exists(self._path) or os.path.getsize(self._path) >= self.max_bytes:
+            stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime())
+            self._path = os.path.join(self.directory, f"{CAPTURE_PREFIX}{stamp}-{os.getpid()}{CAPTURE_SUFFIX}")
+            files = sorted(glob.glob(os.path.join(self.directory, f"{CAPTURE_PREFIX}*{CAPTURE_SUFFIX}")), key=os.path.getmtime)
+            for old in files[:max(0, len(files) + 1 - self.max_files)]:
+                os.remove(old)
+        return self._path
+
+    def _write(self, lines: List[str]) -> None:
+        # Each flush appends a separate gzip member; gzip readers see one stream.
+        with self._lock, gzip.open(self._rotate(), "at", encoding="utf-8") as f:
+            f.write("".join(lines))
+
+    async def flush(self) -> None:
+        if not self._buffer:
+            return
+        lines = []
+        while self._buffer:
+            lines.append(json.dumps(self._buffer.popleft(), separators=(",", ":")) + "\n")
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, lines)
+            self.written += len(lines)
+        except Exception as e:
+            self.dropped += len(lines)
+            logger.error(f"Failed to write traffic capture: {e}")
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self) -> None:
+        if self._task is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+def read_capture(paths: List[str]):
+    # Accepts files or directories; yields records from every capture file.
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(glob.glob(os.path.join(path, f"{CAPTURE_PREFIX}*{CAPTURE_SUFFIX}")))
+        else:
+            files.append(path)
+    for path in files:
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+traffic_capture = TrafficCapture()
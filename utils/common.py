@@ -2,6 +2,7 @@ import random
 import time
 import string
 from typing import List, Dict, Any
+from utils.proxy_pool import proxy_pool
 def generate_id() -> str:
     return f"chatcmpl-{''.join(random.choices(string.ascii_letters + string.digits, k=16))}"
 
@@ -14,12 +15,10 @@ def generate_chunk(response: str, model: str) -> dict:
         "choices": [{"delta": {"content": response}}]
     }
 
-def get_random_proxy() -> str:
-    with open("utils/proxies.txt", "r") as f:
-        proxies = f.read().splitlines()
-    proxy = random.choice(proxies)
-    host, port, username, password = proxy.split(":")
-    return f"http://{username}:{password}@{host}:{port}"
+def get_random_proxy(session_key: str = None) -> str:
+    # Picks from the managed pool; report outcomes through proxy_pool or use
+    # proxy_pool.request so dead proxies get quarantined.
+    return proxy_pool.acquire(session_key).url
 
 def generate_response(response: str, model: str) -> dict:
     return {
@@ -0,0 +1,114 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from typing import Dict, Optional
+from utils import metrics, mongo
+
+logger = logging.getLogger(__name__)
+
+COMPLETION_CACHE_ENABLED = os.getenv("COMPLETION_CACHE_ENABLED", "1") == "1"
+COMPLETION_CACHE_SIZE = int(os.getenv("COMPLETION_CACHE_SIZE", "2000"))
+COMPLETION_CACHE_MAX_BYTES = int(os.getenv("COMPLETION_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+COMPLETION_CACHE_TTL = int(os.getenv("COMPLETION_CACHE_TTL", "3600"))
+COMPLETION_CACHE_REDIS = os.getenv("COMPLETION_CACHE_REDIS", "1") == "1"
+COMPLETION_CACHE_HIT_MULTIPLIER = float(os.getenv("COMPLETION_CACHE_HIT_MULTIPLIER", "0.1"))
+COMPLETION_CACHE_PREFIX = "completion_cache:"
+
+# Fields that do not change what the model returns.
+IGNORED_FIELDS = ("stream", "user")
+
+def cache_key(chat_request: dict) -> str:
+    canonical = {k: v for k, v in chat_request.items() if k not in IGNORED_FIELDS}
+    encoded = json.dumps(canonical, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+def is_cacheable(chat_request: dict, model_config: Optional[dict]) -> bool:
+    if not COMPLETION_CACHE_ENABLED or chat_request.get("stream"):
+        return False
+    if not model_config or not model_config.get("cache", False):
+        return False
+    return is_deterministic(chat_request)
+
+def is_deterministic(chat_request: dict) -> bool:
+    if chat_request.get("temperature") not in (None, 0):
+        return False
+    # Tool calls can act on or read state outside the request.
+    if chat_request.get("tools") or chat_request.get("functions"):
+        return False
+    return chat_request.get("n") in (None, 1)
+
+def cache_bypassed(headers) -> bool:
+    cache_control = headers.get("cache-control", "").lower()
+    if "no-cache" in cache_control or "no-store" in cache_control:
+        return True
+    return headers.get("x-cache-bypass", "").lower() in ("1", "true", "yes")
+
+def hit_multiplier(model_config: Optional[dict]) -> float:
+    return float((model_config or {}).get("cache_hit_multiplier", COMPLETION_CACHE_HIT_MULTIPLIER))
+
+class CompletionCache:
+    def __init__(self, max_entries: int = COMPLETION_CACHE_SIZE, max_bytes: int = COMPLETION_CACHE_MAX_BYTES, ttl: int = COMPLETION_CACHE_TTL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._bytes = 0
+        self._writes: set = set()
+        self.stats: Dict[str, int] = {"memory_hits": 0, "redis_hits": 0, "misses": 0, "bypassed": 0}
+
+    def _remember(self, key: str, value: bytes) -> None:
+        if len(value) > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= len(old)
+        self._entries[key] = value
+        self._bytes += len(value)
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+            self.stats["memory_hits"] += 1
+            return value
+        if COMPLETION_CACHE_REDIS:
+            try:
+                value = await mongo.get_redis_client().get(f"{COMPLETION_CACHE_PREFIX}{key}")
+            except Exception as e:
+                logger.error(f"Completion cache read failed: {e}")
+                value = None
+            if value is not None:
+                value = value.encode() if isinstance(value, str) else value
+                self._remember(key, value)
+                self.stats["redis_hits"] += 1
+                return value
+        self.stats["misses"] += 1
+        return None
+
+    def set(self, key: str, value: bytes) -> None:
+        self._remember(key, value)
+        if COMPLETION_CACHE_REDIS:
+            # Written in the background so a miss does not pay for the extra round trip.
+            task = asyncio.create_task(self._store(key, value))
+            self._writes.add(task)
+            task.add_done_callback(self._writes.discard)
+
+    async def _store(self, key: str, value: bytes) -> None:
+        try:
+            await mongo.get_redis_client().set(f"{COMPLETION_CACHE_PREFIX}{key}", value, ex=self.ttl)
+        except Exception as e:
+            logger.error(f"Completion cache write failed: {e}")
+
+completion_cache = CompletionCache()
+
+def _collect_metrics() -> None:
+    for result, count in completion_cache.stats.items():
+        metrics.CACHE_EVENTS.set(count, result)
+
+metrics.registry.add_collector(_collect_metrics)
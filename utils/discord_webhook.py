@@ -1,28 +1,192 @@
+import abc
+import asyncio
 import aiohttp
+import logging
 import os
-from typing import Optional
+import time
+from typing import Dict, List, Optional, Tuple
+from utils import metrics
 
-DISCORD_WEBHOOK_URL = "not today buckaroo"
+logger = logging.getLogger(__name__)
+
+DISCORD_WEBHOOK_URL = os.getenv("DISCORD_WEBHOOK_URL", "not today buckaroo")
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "10000"))
+WEBHOOK_FLUSH_INTERVAL = float(os.getenv("WEBHOOK_FLUSH_INTERVAL", "5"))
+WEBHOOK_TIMEOUT = float(os.getenv("WEBHOOK_TIMEOUT", "10"))
+WEBHOOK_MAX_RETRIES = 3
+
+# Discord limits for a single webhook execution.
+MAX_DESCRIPTION = 4000
+MAX_EMBEDS = 10
+MAX_MESSAGE_CHARS = 5800
+
+class WebhookTransport(abc.ABC):
+    @abc.abstractmethod
+    async def send(self, url: str, payload: dict) -> Tuple[int, Dict[str, str], Optional[dict]]:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+class AiohttpTransport(WebhookTransport):
+    def __init__(self, timeout: float = WEBHOOK_TIMEOUT):
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def send(self, url: str, payload: dict) -> Tuple[int, Dict[str, str], Optional[dict]]:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=self.timeout)
+        async with self._session.post(url, json=payload) as response:
+            body = None
+            if response.content_type == "application/json":
+                body = await response.json()
+            return response.status, dict(response.headers), body
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+class WebhookPipeline:
+    def __init__(
+        self,
+        url: str = DISCORD_WEBHOOK_URL,
+        transport: Optional[WebhookTransport] = None,
+        queue_size: int = WEBHOOK_QUEUE_SIZE,
+        flush_interval: float = WEBHOOK_FLUSH_INTERVAL,
+    ):
+        self.url = url
+        self.transport = transport or AiohttpTransport()
+        self.flush_interval = flush_interval
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.sent = 0
+        self.failed = 0
+        self._blocked_until = 0.0
+        self._held: List[tuple] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def submit(self, title: str, message: str, color: int) -> bool:
+        try:
+            self.queue.put_nowait((title, message, color))
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+
+    def _drain(self) -> List[tuple]:
+        events = []
+        while not self.queue.empty():
+            events.append(self.queue.get_nowait())
+        return events
+
+    @staticmethod
+    def build_payloads(events: List[tuple]) -> List[dict]:
+        groups: Dict[Tuple[str, int], List[str]] = {}
+        for title, message, color in events:
+            groups.setdefault((title, color), []).append(message)
+
+        embeds = []
+        for (title, color), messages in groups.items():
+            label = title if len(messages) == 1 else f"{title} (x{len(messages)})"
+            description = ""
+            for message in messages:
+                message = message[:MAX_DESCRIPTION]
+                if description and len(description) + len(message) + 2 > MAX_DESCRIPTION:
+                    embeds.append({"title": label, "description": description, "color": color})
+                    description = ""
+                description = f"{description}\n\n{message}" if description else message
+            embeds.append({"title": label, "description": description, "color": color})
+
+        payloads = []
+        current: List[dict] = []
+        size = 0
+        for embed in embeds:
+            embed_size = len(embed["title"]) + len(embed["description"])
+            if current and (len(current) >= MAX_EMBEDS or size + embed_size > MAX_MESSAGE_CHARS):
+                payloads.append({"embeds": current})
+                current, size = [], 0
+            current.append(embed)
+            size += embed_size
+        if current:
+            payloads.append({"embeds": current})
+        return payloads
+
+    async def _post(self, payload: dict) -> None:
+        for _ in range(WEBHOOK_MAX_RETRIES):
+            delay = self._blocked_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                status, headers, body = await self.transport.send(self.url, payload)
+            except Exception as e:
+                logger.error(f"Failed to send Discord webhook: {e}")
+                self.failed += 1
+                return
+
+            if headers.get("X-RateLimit-Remaining") == "0":
+                reset_after = float(headers.get("X-RateLimit-Reset-After", 1))
+                self._blocked_until = time.monotonic() + reset_after
+            if status == 429:
+                retry_after = (body or {}).get("retry_after") or headers.get("Retry-After", 1)
+                self._blocked_until = time.monotonic() + float(retry_after)
+                continue
+            if status >= 400:
+                logger.error(f"Discord webhook rejected batch with status {status}")
+                self.failed += 1
+            else:
+                self.sent += 1
+            return
+        self.failed += 1
+
+    async def flush(self, events: Optional[List[tuple]] = None) -> None:
+        events = (events or []) + self._drain()
+        if not events or not self.url:
+            return
+        for payload in self.build_payloads(events):
+            await self._post(payload)
+
+    async def _run(self) -> None:
+        while True:
+            self._held = [await self.queue.get()]
+            await asyncio.sleep(self.flush_interval)
+            held, self._held = self._held, []
+            try:
+                await self.flush(held)
+            except Exception as e:
+                logger.error(f"Discord webhook flush failed: {e}")
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        held, self._held = self._held, []
+        await self.flush(held)
+        await self.transport.close()
+
+webhook_pipeline = WebhookPipeline()
+
+def _collect_metrics() -> None:
+    metrics.WEBHOOK_EVENTS.set(webhook_pipeline.sent, "sent")
+    metrics.WEBHOOK_EVENTS.set(webhook_pipeline.failed, "failed")
+    metrics.WEBHOOK_EVENTS.set(webhook_pipeline.dropped, "dropped")
+
+metrics.registry.add_collector(_collect_metrics)
 
 async def send_discord_webhook(title: str, message: str, color: Optional[int] = None):
 
     if not DISCORD_WEBHOOK_URL:
         return
-    
+
     if color is None:
-        color = 0x00ff00  
-    
-    embed = {
-        "title": title,
-        "description": message,
-        "color": color
-    }
-    
-    async with aiohttp.ClientSession() as session:
-        try:
-            await session.post(
-                DISCORD_WEBHOOK_URL,
-                json={"embeds": [embed]}
-            )
-        except Exception as e:
-            print(f"Failed to send Discord webhook: {e}") 
+        color = 0x00ff00
+
+    webhook_pipeline.submit(title, message, color)
@@ -0,0 +1,342 @@
+import asyncio
+import hashlib
+import inspect
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Dict, Optional, Tuple
+from redis.exceptions import ResponseError
+from utils import metrics, mongo
+from utils.baseprovider import sync_executor
+from utils.provider_selector import get_tts_provider, get_upscale_provider
+
+logger = logging.getLogger(__name__)
+
+JOBS_WORKER = os.getenv("JOBS_WORKER", "1") == "1"
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "32"))
+JOB_PROVIDER_CONCURRENCY = int(os.getenv("JOB_PROVIDER_CONCURRENCY", "4"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_TTL = int(os.getenv("JOB_TTL", "86400"))
+JOB_BLOB_TTL = int(os.getenv("JOB_BLOB_TTL", str(7 * 86400)))
+JOB_MAX_TTS_CHARS = int(os.getenv("JOB_MAX_TTS_CHARS", "4096"))
+# Upscale parameters are stored on the job hash and replayed to providers.
+JOB_MAX_UPSCALE_BYTES = int(os.getenv("JOB_MAX_UPSCALE_BYTES", str(4 * 1024 * 1024)))
+UPSCALE_FIELDS = ("model", "image", "scale", "prompt", "response_format")
+JOB_STREAM_MAXLEN = 100000
+# Kept under the Redis socket timeout so a blocking read never trips it.
+JOB_BLOCK_MS = 1000
+
+JOB_PREFIX = "job:"
+JOB_STREAM_PREFIX = "jobs:"
+JOB_GROUP = "workers"
+BLOB_PREFIX = "blob:"
+JOB_TYPES = ("tts", "upscale")
+
+class JobError(Exception):
+    pass
+
+def _job_key(job_id: str) -> str:
+    return f"{JOB_PREFIX}{job_id}"
+
+def _stream_key(job_type: str) -> str:
+    return f"{JOB_STREAM_PREFIX}{job_type}"
+
+def validate_job(body: dict) -> Tuple[str, dict]:
+    job_type = body.get("type")
+    if job_type not in JOB_TYPES:
+        raise JobError(f"type must be one of {list(JOB_TYPES)}")
+    if job_type == "tts":
+        text = body.get("input")
+        if not isinstance(text, str) or not text:
+            raise JobError("input is required for tts jobs")
+        if len(text) > JOB_MAX_TTS_CHARS:
+            raise JobError(f"input is limited to {JOB_MAX_TTS_CHARS} characters")
+        return job_type, {"model": body.get("model", "tts-1"), "voice": body.get("voice", "nova"), "input": text}
+    unknown = sorted(set(body) - set(UPSCALE_FIELDS) - {"type"})
+    if unknown:
+        raise JobError(f"Unsupported upscale parameters: {unknown}")
+    params = {k: body[k] for k in UPSCALE_FIELDS if body.get(k) is not None}
+    if not isinstance(params.get("image"), str) or not params["image"]:
+        raise JobError("image is required for upscale jobs")
+    for field in ("model", "prompt", "response_format"):
+        if field in params and not isinstance(params[field], str):
+            raise JobError(f"{field} must be a string")
+    scale = params.get("scale")
+    if scale is not None and (isinstance(scale, bool) or not isinstance(scale, (int, float)) or not 1 <= scale <= 8):
+        raise JobError("scale must be a number between 1 and 8")
+    if len(json.dumps(params)) > JOB_MAX_UPSCALE_BYTES:
+        raise JobError(f"upscale parameters are limited to {JOB_MAX_UPSCALE_BYTES} bytes")
+    return job_type, params
+
+def content_key(job_type: str, params: dict) -> str:
+    # The result depends only on what is generated, not on who asked or which
+    # provider runs it, so identical requests share one stored result.
+    canonical = json.dumps([job_type, params], sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+def _decode_job(data: Dict[str, str]) -> Optional[dict]:
+    if not data:
+        return None
+    job = dict(data)
+    job["params"] = json.loads(job.get("params", "{}"))
+    for field in ("created_at", "started_at", "finished_at"):
+        if job.get(field):
+            job[field] = float(job[field])
+    job["attempts"] = int(job.get("attempts", 0))
+    if job.get("progress"):
+        job["progress"] = json.loads(job["progress"])
+    return job
+
+async def get_job(job_id: str) -> Optional[dict]:
+    return _decode_job(await mongo.get_redis_client().hgetall(_job_key(job_id)))
+
+async def get_blob(key: str):
+    value = await mongo.get_redis_client().get(f"{BLOB_PREFIX}{key}")
+    return None if value is None else json.loads(value)
+
+async def charge_job(job: dict) -> None:
+    # Jobs are billed once, when they succeed; HSETNX keeps a job that is
+    # finished twice (lease takeover, cached result) from being billed again.
+    client = mongo.get_redis_client()
+    if await client.hsetnx(_job_key(job["id"]), "charged", 1):
+        await mongo.add_usage(job["user_id"], float(job.get("cost") or 0))
+
+async def submit_job(user_id: str, job_type: str, params: dict, cost: float = 1.0) -> dict:
+    client = mongo.get_redis_client()
+    job_id = f"job_{uuid.uuid4().hex}"
+    blob = content_key(job_type, params)
+    now = time.time()
+    job = {
+        "id": job_id,
+        "type": job_type,
+        "user_id": user_id,
+        "status": "queued",
+        "params": json.dumps(params),
+        "result_key": blob,
+        "attempts": 0,
+        "cost": cost,
+        "created_at": now,
+    }
+    if await client.exists(f"{BLOB_PREFIX}{blob}"):
+        # Already generated once; answer from the blob cache without queueing.
+        job.update(status="succeeded", cached="1", finished_at=now)
+        async with client.pipeline(transaction=False) as pipe:
+            pipe.hset(_job_key(job_id), mapping=job)
+            pipe.expire(_job_key(job_id), JOB_TTL)
+            pipe.expire(f"{BLOB_PREFIX}{blob}", JOB_BLOB_TTL)
+            await pipe.execute()
+        await charge_job(job)
+        return _decode_job({k: str(v) for k, v in job.items()})
+
+    async with client.pipeline(transaction=True) as pipe:
+        pipe.hset(_job_key(job_id), mapping=job)
+        pipe.expire(_job_key(job_id), JOB_TTL)
+        pipe.xadd(_stream_key(job_type), {"id": job_id}, maxlen=JOB_STREAM_MAXLEN, approximate=True)
+        await pipe.execute()
+    return _decode_job({k: str(v) for k, v in job.items()})
+
+def provider_label(provider) -> str:
+    return provider.__class__.__name__
+
+def pick_provider(job_type: str, params: dict):
+    if job_type == "tts":
+        return get_tts_provider({"model": params["model"], "voice": params["voice"]})
+    return get_upscale_provider(params)
+
+class JobWorker:
+    # One dispatcher per job type reads from a Redis stream consumer group;
+    # the group hands every job to exactly one worker across all processes.
+    # Jobs a dead worker had claimed are taken over once their lease lapses.
+    def __init__(self, concurrency: int = JOB_CONCURRENCY, provider_concurrency: int = JOB_PROVIDER_CONCURRENCY):
+        self.concurrency = concurrency
+        self.provider_concurrency = provider_concurrency
+        self.consumer = f"{socket.gethostname()}-{os.getpid()}"
+        self._slots = asyncio.Semaphore(concurrency)
+        self._provider_slots: Dict[str, asyncio.Semaphore] = {}
+        self._running: Dict[str, Tuple[str, asyncio.Task]] = {}
+        # Read from a stream but still waiting here for a slot.
+        self._waiting: Dict[str, str] = {}
+        self._tasks = []
+        self.completed = 0
+        self.failed = 0
+
+    def _provider_semaphore(self, provider) -> asyncio.Semaphore:
+        name = provider_label(provider)
+        semaphore = self._provider_slots.get(name)
+        if semaphore is None:
+            limit = getattr(provider, "max_concurrency", None) or self.provider_concurrency
+            semaphore = self._provider_slots[name] = asyncio.Semaphore(limit)
+        return semaphore
+
+    async def _ensure_group(self, job_type: str) -> None:
+        try:
+            await mongo.get_redis_client().xgroup_create(_stream_key(job_type), JOB_GROUP, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def _dispatch(self, job_type: str) -> None:
+        stream = _stream_key(job_type)
+        await self._ensure_group(job_type)
+        last_claim = 0.0
+        while True:
+            # Hold one slot before reading so a full worker leaves new jobs
+            # in the stream for other processes instead of hoarding them.
+            await self._slots.acquire()
+            try:
+                free = max(1, self.concurrency - len(self._running))
+                client = mongo.get_redis_client()
+                messages = []
+                if time.monotonic() - last_claim > JOB_LEASE_SECONDS / 2:
+                    last_claim = time.monotonic()
+                    claimed = await client.xautoclaim(
+                        stream, JOB_GROUP, self.consumer, min_idle_time=int(JOB_LEASE_SECONDS * 1000), start_id="0-0", count=free
+                    )
+                    messages += claimed[1]
+                if not messages:
+                    response = await client.xreadgroup(JOB_GROUP, self.consumer, {stream: ">"}, count=free, block=JOB_BLOCK_MS)
+                    for _, entries in response or []:
+                        messages += entries
+            except asyncio.CancelledError:
+                self._slots.release()
+                raise
+            except Exception as e:
+                self._slots.release()
+                if "NOGROUP" in str(e):
+                    await self._ensure_group(job_type)
+                    continue
+                logger.error(f"Job dispatcher for {job_type} failed: {e}")
+                await asyncio.sleep(1)
+                continue
+
+            if not messages:
+                self._slots.release()
+                continue
+            # Heartbeated from the moment they are read, so no other worker
+            # claims them while they wait for a slot here.
+            for message_id, _ in messages:
+                self._waiting[message_id] = stream
+            try:
+                for index, (message_id, fields) in enumerate(messages):
+                    if index:
+                        await self._slots.acquire()
+                    del self._waiting[message_id]
+                    task = asyncio.create_task(self._execute(job_type, message_id, (fields or {}).get("id")))
+                    self._running[message_id] = (stream, task)
+                    task.add_done_callback(lambda _, m=message_id: self._finished(m))
+            finally:
+                for message_id, _ in messages:
+                    self._waiting.pop(message_id, None)
+
+    def _finished(self, message_id: str) -> None:
+        self._running.pop(message_id, None)
+        self._slots.release()
+
+    async def _heartbeat(self) -> None:
+        # Re-claiming our own pending entries resets their idle time, so a
+        # long job is not mistaken for one abandoned by a dead worker.
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            by_stream: Dict[str, list] = {}
+            for message_id, stream in list(self._waiting.items()):
+                by_stream.setdefault(stream, []).append(message_id)
+            for message_id, (stream, _) in list(self._running.items()):
+                by_stream.setdefault(stream, []).append(message_id)
+            for stream, ids in by_stream.items():
+                try:
+                    await mongo.get_redis_client().xclaim(stream, JOB_GROUP, self.consumer, min_idle_time=0, message_ids=ids, justid=True)
+                except Exception as e:
+                    logger.error(f"Job heartbeat failed: {e}")
+
+    async def _ack(self, job_type: str, message_id: str) -> None:
+        async with mongo.get_redis_client().pipeline(transaction=False) as pipe:
+            pipe.xack(_stream_key(job_type), JOB_GROUP, message_id)
+            pipe.xdel(_stream_key(job_type), message_id)
+            await pipe.execute()
+
+    async def _execute(self, job_type: str, message_id: str, job_id: Optional[str]) -> None:
+        client = mongo.get_redis_client()
+        key = _job_key(job_id or "")
+        job = await get_job(job_id) if job_id else None
+        if job is None or job["status"] in ("succeeded", "failed"):
+            await self._ack(job_type, message_id)
+            return
+
+        attempts = await client.hincrby(key, "attempts", 1)
+        if attempts > JOB_MAX_ATTEMPTS:
+            await client.hset(key, mapping={"status": "failed", "error": "Too many attempts", "finished_at": time.time()})
+            await self._ack(job_type, message_id)
+            self.failed += 1
+            return
+
+        params = job["params"]
+        start = time.monotonic()
+        provider_name = "unknown"
+        try:
+            # Another job may have produced the same content meanwhile.
+            result = await get_blob(job["result_key"])
+            if result is None:
+                provider = pick_provider(job_type, params)
+                provider_name = provider_label(provider)
+                await client.hset(key, mapping={"status": "running", "provider": provider_name, "started_at": time.time()})
+                async with self._provider_semaphore(provider):
+                    result = await self._run_provider(job_type, provider, params, key)
+                await client.set(f"{BLOB_PREFIX}{job['result_key']}", json.dumps(result), ex=JOB_BLOB_TTL)
+            await client.hset(key, mapping={"status": "succeeded", "finished_at": time.time()})
+            await charge_job(job)
+            self.completed += 1
+            metrics.JOB_DURATION.observe(time.monotonic() - start, job_type, provider_name)
+        except asyncio.CancelledError:
+            # Shutting down: leave the entry pending so the lease hands it on.
+            await client.hset(key, "status", "queued")
+            raise
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {e}")
+            if attempts < JOB_MAX_ATTEMPTS:
+                # Left pending; retried once the lease lapses.
+                await client.hset(key, mapping={"status": "queued", "error": str(e)[:500]})
+                return
+            await client.hset(key, mapping={"status": "failed", "error": str(e)[:500], "finished_at": time.time()})
+            self.failed += 1
+        await self._ack(job_type, message_id)
+
+    async def _run_provider(self, job_type: str, provider, params: dict, key: str):
+        if job_type == "tts":
+            generate = provider.generate_audio
+            if inspect.iscoroutinefunction(generate):
+                return await generate(params["input"], params["voice"])
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(sync_executor, generate, params["input"], params["voice"])
+
+        result = None
+        async for update in provider.create_upscaling_task(params):
+            result = update
+            await mongo.get_redis_client().hset(key, "progress", json.dumps(update))
+        if result is None:
+            raise ValueError(f"{provider_label(provider)} returned no result")
+        return result
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._dispatch(job_type)) for job_type in JOB_TYPES]
+            self._tasks.append(asyncio.create_task(self._heartbeat()))
+
+    async def stop(self) -> None:
+        tasks = self._tasks + [task for _, task in self._running.values()]
+        self._tasks = []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+job_worker = JobWorker()
+
+def _collect_metrics() -> None:
+    metrics.JOBS_RUNNING.set(len(job_worker._running))
+    metrics.JOB_RESULTS.set(job_worker.completed, "succeeded")
+    metrics.JOB_RESULTS.set(job_worker.failed, "failed")
+
+metrics.registry.add_collector(_collect_metrics)
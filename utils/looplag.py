@@ -0,0 +1,60 @@
+import asyncio
+import time
+from collections import deque
+from itertools import islice
+from typing import Optional
+
+LOOP_LAG_INTERVAL = 0.05
+
+class LoopLagMonitor:
+    # Sleeps for a fixed interval and records how late each wake-up was. Any
+    # callback that blocks the event loop shows up directly as lag.
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, max_samples: int = 20000):
+        self.interval = interval
+        self.samples: deque = deque(maxlen=max_samples)
+        self.max_lag = 0.0
+        # Samples ever taken; lets callers find the readings since a mark.
+        self.taken = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - start - self.interval)
+            self.samples.append(lag)
+            self.taken += 1
+            self.max_lag = max(self.max_lag, lag)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def reset(self) -> None:
+        self.samples.clear()
+        self.max_lag = 0.0
+
+    def since(self, mark: int) -> list:
+        count = min(self.taken - mark, len(self.samples))
+        return list(islice(reversed(self.samples), count))[::-1] if count > 0 else []
+
+    def stats(self) -> dict:
+        if not self.samples:
+            return {"samples": 0, "mean": 0.0, "p50": 0.0, "p99": 0.0, "max": 0.0}
+        ordered = sorted(self.samples)
+        return {
+            "samples": len(ordered),
+            "mean": sum(ordered) / len(ordered),
+            "p50": ordered[int(0.50 * (len(ordered) - 1))],
+            "p99": ordered[int(0.99 * (len(ordered) - 1))],
+            "max": self.max_lag,
+        }
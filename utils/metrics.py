@@ -0,0 +1,273 @@
+import asyncio
+import functools
+import glob
+import json
+import logging
+import os
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# When set, every uvicorn worker periodically writes its samples here and
+# /metrics merges the files, so any worker can answer for the whole server.
+METRICS_DIR = os.getenv("METRICS_DIR", "")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+# Bearer token for /metrics and the admin status endpoints. /metrics stays
+# open when unset; the status endpoints are disabled instead.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+REDIS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+
+class Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[Tuple[str, ...], object] = {}
+        registry.register(self)
+
+    def _key(self, labels: Sequence) -> Tuple[str, ...]:
+        return tuple(str(label) for label in labels)
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def set(self, value: float, *labels) -> None:
+        # For collectors mirroring a counter kept elsewhere.
+        self.values[self._key(labels)] = value
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, *labels, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value: float, *labels) -> None:
+        self.values[self._key(labels)] = value
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, help, labelnames)
+
+    def observe(self, value: float, *labels) -> None:
+        key = self._key(labels)
+        state = self.values.get(key)
+        if state is None:
+            # [per-bucket counts (+Inf last), sum, count]
+            state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        state[0][bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+        self.collectors: List[Callable[[], None]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, metric: Metric) -> None:
+        self.metrics[metric.name] = metric
+
+    def add_collector(self, collector: Callable[[], None]) -> None:
+        self.collectors.append(collector)
+
+    def collect(self) -> None:
+        for collector in self.collectors:
+            try:
+                collector()
+            except Exception as e:
+                logger.error(f"Metrics collector failed: {e}")
+
+    def snapshot(self) -> dict:
+        self.collect()
+        return {
+            name: {
+                "type": metric.type,
+                "values": [
+                    [list(key), [list(value[0]), value[1], value[2]] if metric.type == "histogram" else value]
+                    for key, value in metric.values.items()
+                ],
+            }
+            for name, metric in self.metrics.items()
+        }
+
+    def _snapshot_path(self) -> str:
+        return os.path.join(METRICS_DIR, f"metrics-{os.getpid()}.json")
+
+    def write_snapshot(self, snapshot: Optional[dict] = None) -> None:
+        path = self._snapshot_path()
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"pid": os.getpid(), "time": time.time(), "metrics": snapshot or self.snapshot()}, f)
+        os.replace(tmp, path)
+
+    @staticmethod
+    def _pid_alive(pid: int) -> bool:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    def _merged(self, snapshot: Optional[dict] = None) -> Dict[str, Dict[Tuple[str, ...], object]]:
+        if not METRICS_DIR:
+            self.collect()
+            return {name: metric.values for name, metric in self.metrics.items()}
+
+        self.write_snapshot(snapshot)
+        merged: Dict[str, Dict[Tuple[str, ...], object]] = {name: {} for name in self.metrics}
+        for path in glob.glob(os.path.join(METRICS_DIR, "metrics-*.json")):
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            # Counters and histograms of exited workers still count towards the
+            # totals; their gauges describe a process that no longer exists.
+            alive = self._pid_alive(int(data.get("pid", 0)))
+            for name, metric in data["metrics"].items():
+                if name not in merged or (metric["type"] == "gauge" and not alive):
+                    continue
+                target = merged[name]
+                for key, value in metric["values"]:
+                    key = tuple(key)
+                    if metric["type"] == "histogram":
+                        current = target.get(key)
+                        if current is None:
+                            target[key] = [list(value[0]), value[1], value[2]]
+                        else:
+                            current[0] = [a + b for a, b in zip(current[0], value[0])]
+                            current[1] += value[1]
+                            current[2] += value[2]
+                    else:
+                        target[key] = target.get(key, 0) + value
+        return merged
+
+    def render(self, snapshot: Optional[dict] = None) -> str:
+        merged = self._merged(snapshot)
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.type}")
+            for key, value in merged.get(name, {}).items():
+                labels = ",".join(f'{label}="{_escape(v)}"' for label, v in zip(metric.labelnames, key))
+                if metric.type != "histogram":
+                    lines.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+                    continue
+                counts, total, count = value
+                prefix = f"{labels}," if labels else ""
+                cumulative = 0
+                for bound, bucket_count in zip(metric.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {count}')
+                lines.append(f"{name}_sum{{{labels}}} {total}" if labels else f"{name}_sum {total}")
+                lines.append(f"{name}_count{{{labels}}} {count}" if labels else f"{name}_count {count}")
+        return "\n".join(lines) + "\n"
+
+    async def render_async(self) -> str:
+        if not METRICS_DIR:
+            return self.render()
+        # Merging reads a file per worker; only the snapshot of this process's
+        # metrics is taken on the loop thread.
+        return await asyncio.get_running_loop().run_in_executor(None, self.render, self.snapshot())
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(METRICS_FLUSH_INTERVAL)
+            try:
+                # Snapshot on the loop thread, where the metrics are mutated;
+                # only the file write goes to a thread.
+                await loop.run_in_executor(None, self.write_snapshot, self.snapshot())
+            except Exception as e:
+                logger.error(f"Failed to write metrics snapshot: {e}")
+
+    def start(self) -> None:
+        if METRICS_DIR and self._task is None:
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self.write_snapshot()
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+registry = MetricsRegistry()
+
+HTTP_REQUESTS = Counter("astra_http_requests_total", "HTTP requests by route, method and status.", ("route", "method", "status"))
+HTTP_IN_FLIGHT = Gauge("astra_http_requests_in_flight", "HTTP requests currently being handled.")
+HTTP_DURATION = Histogram("astra_http_request_duration_seconds", "Time until response headers, by route.", ("route",))
+COMPLETION_DURATION = Histogram("astra_completion_duration_seconds", "End-to-end upstream completion latency.", ("provider", "model", "stream"))
+COMPLETION_TTFT = Histogram("astra_completion_ttft_seconds", "Time to first upstream chunk.", ("provider", "model"))
+PROVIDER_ERRORS = Counter("astra_provider_errors_total", "Failed upstream attempts.", ("provider", "model"))
+PROVIDER_IN_FLIGHT = Gauge("astra_provider_requests_in_flight", "Upstream calls in progress.", ("provider",))
+STREAMS_IN_FLIGHT = Gauge("astra_streams_in_flight", "SSE responses currently streaming.", ("model",))
+STREAM_CHUNKS = Counter("astra_stream_chunks_total", "SSE frames written to clients.", ("provider", "model"))
+STREAM_BYTES = Counter("astra_stream_bytes_total", "SSE bytes written to clients.", ("provider", "model"))
+REDIS_DURATION = Histogram("astra_redis_call_duration_seconds", "User store call latency.", ("op",), buckets=REDIS_BUCKETS)
+ADMISSION_QUEUED = Gauge("astra_admission_queued", "Requests waiting for a provider slot.", ("provider", "plan"))
+ADMISSION_IN_USE = Gauge("astra_admission_slots_in_use", "Provider slots in use.", ("provider",))
+ADMISSION_WAIT = Gauge("astra_admission_wait_seconds", "Moving average of admission queue wait.", ("provider",))
+ADMISSION_REJECTED = Counter("astra_admission_rejections_total", "Requests rejected by admission control.", ("provider",))
+CACHE_EVENTS = Counter("astra_completion_cache_events_total", "Completion cache lookups by result.", ("result",))
+COALESCED = Counter("astra_coalesced_requests_total", "Requests that joined an in-flight identical request.")
+WEBHOOK_EVENTS = Counter("astra_webhook_events_total", "Discord webhook batches and dropped events.", ("result",))
+RATE_LIMITED = Counter("astra_rate_limit_rejections_total", "Requests rejected by the rate limiter.", ("plan",))
+JOBS_RUNNING = Gauge("astra_jobs_running", "Media jobs currently executing in this worker.")
+JOB_RESULTS = Counter("astra_jobs_finished_total", "Media jobs finished by this worker, by outcome.", ("result",))
+JOB_DURATION = Histogram("astra_job_duration_seconds", "Media job run time, by type and provider.", ("type", "provider"))
+
+class observe_duration:
+    # `with observe_duration(REDIS_DURATION, "op"):` for when only part of a
+    # function should be timed; `timed` covers whole functions.
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram: Histogram, *labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+def timed(histogram: Histogram, *labels) -> Callable:
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, *labels)
+        return wrapper
+    return decorator
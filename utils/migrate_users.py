@@ -0,0 +1,58 @@
+import argparse
+import asyncio
+import logging
+import time
+from utils import mongo
+
+logger = logging.getLogger(__name__)
+
+async def migrate_users(batch_size: int = 500, pause: float = 0.0, dry_run: bool = False) -> dict:
+    stats = {"scanned": 0, "migrated": 0, "failed": 0}
+    client = mongo.get_redis_client()
+
+    async def run_batch(keys: list) -> None:
+        stats["scanned"] += len(keys)
+        if dry_run:
+            stats["migrated"] += len(keys)
+            return
+        async with client.pipeline(transaction=False) as pipe:
+            for key in keys:
+                await mongo._migrate_user_script(keys=[key], client=pipe)
+            results = await pipe.execute(raise_on_error=False)
+        for key, result in zip(keys, results):
+            if result == 1:
+                stats["migrated"] += 1
+            elif isinstance(result, Exception) or result == -1:
+                stats["failed"] += 1
+                logger.error(f"Could not migrate {key}: {result}")
+        if pause:
+            await asyncio.sleep(pause)
+
+    # Only legacy string records are visited; each key is converted atomically
+    # by the Lua script, so live traffic can keep reading and charging users.
+    keys = []
+    async for key in client.scan_iter(f"{mongo.USER_PREFIX}*", count=batch_size, _type="string"):
+        keys.append(key)
+        if len(keys) >= batch_size:
+            await run_batch(keys)
+            keys = []
+    if keys:
+        await run_batch(keys)
+    return stats
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Convert user:* JSON records to Redis hashes.")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--pause", type=float, default=0.0, help="seconds to sleep between batches")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    start = time.time()
+    try:
+        stats = await migrate_users(args.batch_size, args.pause, args.dry_run)
+    finally:
+        await mongo.close_redis_client()
+    logger.info(f"Migration finished in {time.time() - start:.1f}s: {stats}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,133 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Mapping, Optional
+from utils.ratelimit import RATE_LIMITS
+
+logger = logging.getLogger(__name__)
+
+MODEL_CONFIG_PATH = os.getenv("MODEL_CONFIG_PATH", "model_multipliers.json")
+MODEL_CONFIG_POLL_INTERVAL = float(os.getenv("MODEL_CONFIG_POLL_INTERVAL", "2"))
+
+# One bit per plan; a model's `access` has the bits of the plans allowed to use it.
+PLAN_BITS = {plan: 1 << index for index, plan in enumerate(RATE_LIMITS)}
+ALL_PLANS = sum(PLAN_BITS.values())
+
+@dataclass(frozen=True)
+class ModelEntry:
+    name: str
+    multiplier: float
+    access: int
+    raw: Mapping
+
+    def allows(self, plan: str) -> bool:
+        return bool(self.access & PLAN_BITS.get(plan, 0))
+
+    @property
+    def restrictions(self) -> dict:
+        return {plan: bool(self.access & bit) for plan, bit in PLAN_BITS.items()}
+
+@dataclass(frozen=True)
+class ModelConfig:
+    version: int
+    mtime: Optional[float]
+    models: Mapping[str, ModelEntry]
+
+    def get(self, model: str) -> Optional[ModelEntry]:
+        return self.models.get(model)
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+def parse_model_config(data: dict, version: int = 0, mtime: Optional[float] = None) -> ModelConfig:
+    models = {}
+    for name, options in data.items():
+        restrictions = options.get("restrictions")
+        if restrictions is None:
+            access = ALL_PLANS
+        else:
+            unknown = set(restrictions) - set(PLAN_BITS)
+            if unknown:
+                logger.warning(f"Model {name} has restrictions for unknown plans: {sorted(unknown)}")
+            access = sum(bit for plan, bit in PLAN_BITS.items() if restrictions.get(plan, False))
+        models[name] = ModelEntry(
+            name=name,
+            multiplier=options.get("multiplier", 1),
+            access=access,
+            raw=_freeze(options),
+        )
+    return ModelConfig(version=version, mtime=mtime, models=MappingProxyType(models))
+
+class ModelConfigService:
+    # Readers take `current` once per request and use that snapshot
+    # throughout; reloads build a new snapshot and swap the reference, so a
+    # request never sees a half-applied change.
+    def __init__(self, path: str = MODEL_CONFIG_PATH, poll_interval: float = MODEL_CONFIG_POLL_INTERVAL):
+        self.path = path
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._failed_mtime: Optional[float] = None
+        self.current = ModelConfig(version=0, mtime=None, models=MappingProxyType({}))
+        self.reload()
+
+    def _mtime(self) -> Optional[float]:
+        try:
+            return os.stat(self.path).st_mtime
+        except OSError:
+            return None
+
+    def reload(self) -> bool:
+        with self._lock:
+            mtime = self._mtime()
+            try:
+                with open(self.path, "r") as f:
+                    data = json.load(f)
+                config = parse_model_config(data, self.current.version + 1, mtime)
+            except Exception as e:
+                # A bad edit keeps the last good config instead of taking routes down.
+                if not self.current.version:
+                    raise
+                self._failed_mtime = mtime
+                logger.error(f"Failed to reload {self.path}, keeping version {self.current.version}: {e}")
+                return False
+            self.current = config
+        logger.info(f"Loaded model config version {config.version} with {len(config.models)} models")
+        return True
+
+    def reload_if_changed(self) -> bool:
+        mtime = self._mtime()
+        if mtime is None or mtime in (self.current.mtime, self._failed_mtime):
+            return False
+        return self.reload()
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                self.reload_if_changed()
+            except Exception as e:
+                logger.error(f"Model config watcher failed: {e}")
+
+    def start(self) -> None:
+        if self._task is None and self.poll_interval > 0:
+            self._task = asyncio.create_task(self._watch())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+model_config = ModelConfigService()
@@ -1,8 +1,12 @@
 import importlib
 import os
 import random
-from typing import List, Type
-from utils.baseprovider import BaseProvider, BaseTTSProvider
+import sys
+import threading
+from collections import defaultdict
+from typing import Dict, List, Tuple, Type
+from utils.baseprovider import BaseProvider, BaseTTSProvider, BaseUpscaleProvider
+from utils.routing import router
 from pystyle import Colorate, Colors
 
 def load_providers() -> List[Type[BaseProvider]]:
@@ -14,9 +18,11 @@ def load_providers() -> List[Type[BaseProvider]]:
             module = importlib.import_module(f'{providers_dir}.{module_name}')
             for attr in dir(module):
                 cls = getattr(module, attr)
-                if isinstance(cls, type) and (
+                # Only classes defined in the module, so imported bases such
+                # as BaseHTTPProvider are not instantiated as providers.
+                if isinstance(cls, type) and cls.__module__ == module.__name__ and (
                     issubclass(cls, BaseProvider) or issubclass(cls, BaseTTSProvider)
-                ) and cls not in (BaseProvider, BaseTTSProvider):
+                ):
                     providers.append(cls())
     return providers
 
@@ -34,36 +40,151 @@ def load_tts_providers() -> List[Type[BaseTTSProvider]]:
                 module = importlib.import_module(module_path)
                 for attr in dir(module):
                     cls = getattr(module, attr)
-                    if isinstance(cls, type) and issubclass(cls, BaseTTSProvider) and cls is not BaseTTSProvider:
+                    if isinstance(cls, type) and cls.__module__ == module.__name__ and issubclass(cls, BaseTTSProvider):
                         providers.append(cls())
     return providers
 
-def select_provider(chat_request, type: str = "chat"):
-    providers = load_providers()
-    
-    
-    suitable_providers = [
-        provider for provider in providers
-        if (type == "tts" and chat_request["model"] in provider.models and chat_request["voice"] in provider.voices) or
-           (type != "tts" and (not chat_request.get("stream") or provider.supports_streaming) and chat_request["model"] in provider.models)
-    ]
-    
-    if not suitable_providers:
+def load_upscale_providers() -> List[Type[BaseUpscaleProvider]]:
+    providers = []
+    directories = ['providers', os.path.join('providers', 'upscale')]
+
+    for providers_dir in directories:
+        if not os.path.exists(providers_dir):
+            continue
+        for filename in os.listdir(providers_dir):
+            if filename.endswith('.py') and filename != '__init__.py':
+                module_name = filename[:-3]
+                module_path = f'{providers_dir.replace(os.sep, ".")}.{module_name}'
+                module = importlib.import_module(module_path)
+                for attr in dir(module):
+                    cls = getattr(module, attr)
+                    if isinstance(cls, type) and cls.__module__ == module.__name__ and issubclass(cls, BaseUpscaleProvider):
+                        providers.append(cls())
+    return providers
+
+class ProviderRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version = 0
+        self.providers: List = []
+        self.tts_providers: List = []
+        self.upscale_providers: List = []
+        self.models: List[str] = []
+        self._chat_index: Dict[Tuple[str, bool], Tuple[tuple, tuple]] = {}
+        self._tts_index: Dict[Tuple[str, str], Tuple[tuple, tuple]] = {}
+        self._extra: List = []
+
+    def reload(self, reimport: bool = False) -> None:
+        with self._lock:
+            if reimport:
+                self._reimport_modules()
+            providers = load_providers() + self._extra
+            tts_providers = load_tts_providers()
+            self.upscale_providers = load_upscale_providers()
+            self._build(providers, tts_providers)
+
+    def register(self, provider) -> None:
+        with self._lock:
+            self._extra.append(provider)
+            self._build(self.providers + [provider], self.tts_providers)
+
+    def _reimport_modules(self) -> None:
+        importlib.invalidate_caches()
+        for name, module in list(sys.modules.items()):
+            if name.startswith('providers.') and module is not None:
+                importlib.reload(module)
+
+    def _build(self, providers: List, tts_providers: List) -> None:
+        chat = defaultdict(lambda: ([], []))
+        for provider in providers:
+            bucket = 0 if getattr(provider, 'priority', False) else 1
+            for model in getattr(provider, 'models', []):
+                chat[(model, False)][bucket].append(provider)
+                if getattr(provider, 'supports_streaming', False):
+                    chat[(model, True)][bucket].append(provider)
+
+        tts = defaultdict(lambda: ([], []))
+        for provider in tts_providers:
+            bucket = 0 if getattr(provider, 'priority', False) else 1
+            for model in getattr(provider, 'models', []):
+                for voice in getattr(provider, 'voices', []):
+                    tts[(model, voice)][bucket].append(provider)
+
+        models = []
+        seen = set()
+        for provider in providers:
+            for model in getattr(provider, 'models', []):
+                if model not in seen:
+                    seen.add(model)
+                    models.append(model)
+
+        # Swap whole references so readers never see a half-built index.
+        self._chat_index = {key: (tuple(p), tuple(o)) for key, (p, o) in chat.items()}
+        self._tts_index = {key: (tuple(p), tuple(o)) for key, (p, o) in tts.items()}
+        self.providers = providers
+        self.tts_providers = tts_providers
+        self.models = models
+        self.version += 1
+
+    def ensure_loaded(self) -> None:
+        if not self.version:
+            self.reload()
+
+    def candidates(self, model: str, stream: bool = False) -> Tuple[tuple, tuple]:
+        self.ensure_loaded()
+        return self._chat_index.get((model, bool(stream)), ((), ()))
+
+    def tts_candidates(self, model: str, voice: str) -> Tuple[tuple, tuple]:
+        self.ensure_loaded()
+        return self._tts_index.get((model, voice), ((), ()))
+
+registry = ProviderRegistry()
+
+def get_registry() -> ProviderRegistry:
+    registry.ensure_loaded()
+    return registry
+
+def reload_providers(reimport: bool = False) -> int:
+    registry.reload(reimport=reimport)
+    print(Colorate.Vertical(Colors.blue_to_purple, f"Loaded {len(registry.providers)} providers serving {len(registry.models)} models"))
+    return registry.version
+
+def rank_providers(chat_request) -> List:
+    priority_providers, other_providers = registry.candidates(chat_request["model"], chat_request.get("stream"))
+    if not priority_providers and not other_providers:
         raise ValueError("No suitable provider found for the given request")
+    return router.rank(priority_providers, other_providers, chat_request["model"], bool(chat_request.get("stream")))
+
+def select_provider(chat_request, type: str = "chat"):
+    if type == "tts":
+        priority_providers, other_providers = registry.tts_candidates(chat_request["model"], chat_request["voice"])
+        if not priority_providers and not other_providers:
+            raise ValueError("No suitable provider found for the given request")
+        chosen_provider = random.choice(priority_providers) if priority_providers else random.choice(other_providers)
+    else:
+        priority_providers, _ = registry.candidates(chat_request["model"], chat_request.get("stream"))
+        chosen_provider = rank_providers(chat_request)[0]
 
-    priority_providers = [provider for provider in suitable_providers if provider.priority]
-    chosen_provider = random.choice(priority_providers) if priority_providers else random.choice(suitable_providers)
-    
     provider_type = "priority provider" if priority_providers else "provider"
     print(Colorate.Vertical(Colors.blue_to_purple, f"Using {provider_type}: {chosen_provider.__class__.__name__}"))
-    
+
     return chosen_provider
 
 def get_tts_provider(args: dict):
     return select_provider(args, type="tts")
 
+def get_upscale_provider(args: dict):
+    model = args.get("model")
+    candidates = [
+        provider for provider in get_registry().upscale_providers
+        if model is None or model in getattr(provider, 'models', [model])
+    ]
+    if not candidates:
+        raise ValueError("No suitable upscale provider found for the given request")
+    return random.choice(candidates)
+
 def get_all_tts_models():
-    providers = load_tts_providers()
+    providers = get_registry().tts_providers
     return [provider.models for provider in providers], [provider.voices for provider in providers]
 
 async def handle_request(args: dict):
@@ -72,5 +193,5 @@ async def handle_request(args: dict):
         yield response
 
 async def get_all_models():
-    providers = load_providers()
+    providers = get_registry().providers
     return [provider.models for provider in providers]
@@ -0,0 +1,272 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+from urllib.parse import quote, urlsplit
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+PROXY_FILE = os.getenv("PROXY_FILE", "utils/proxies.txt")
+PROXY_FILE_CHECK_INTERVAL = float(os.getenv("PROXY_FILE_CHECK_INTERVAL", "5"))
+PROXY_FAILURE_THRESHOLD = int(os.getenv("PROXY_FAILURE_THRESHOLD", "3"))
+PROXY_QUARANTINE_SECONDS = float(os.getenv("PROXY_QUARANTINE_SECONDS", "30"))
+PROXY_MAX_QUARANTINE_SECONDS = float(os.getenv("PROXY_MAX_QUARANTINE_SECONDS", "900"))
+PROXY_HEALTH_URL = os.getenv("PROXY_HEALTH_URL", "http://www.gstatic.com/generate_204")
+PROXY_HEALTH_INTERVAL = float(os.getenv("PROXY_HEALTH_INTERVAL", "15"))
+PROXY_HEALTH_TIMEOUT = float(os.getenv("PROXY_HEALTH_TIMEOUT", "10"))
+PROXY_CONNECTIONS = int(os.getenv("PROXY_CONNECTIONS", "32"))
+PROXY_STICKY_SESSIONS = int(os.getenv("PROXY_STICKY_SESSIONS", "10000"))
+
+EWMA_ALPHA = 0.2
+DEFAULT_LATENCY = 1.0
+
+def parse_proxy(line: str) -> Optional[str]:
+    # Accepts host:port, host:port:user:password (the historical format) or a URL.
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+    if "://" in line:
+        return line
+    parts = line.split(":")
+    if len(parts) == 2:
+        return f"http://{parts[0]}:{parts[1]}"
+    if len(parts) == 4:
+        host, port, username, password = parts
+        return f"http://{quote(username, safe='')}:{quote(password, safe='')}@{host}:{port}"
+    logger.warning(f"Ignoring malformed proxy line: {line!r}")
+    return None
+
+def is_proxy_error(response: aiohttp.ClientResponse) -> bool:
+    # Upstream 5xx responses came through a working proxy. Only a proxy auth
+    # failure, or a bad gateway the proxy marks as its own (RFC 9209
+    # Proxy-Status), is the proxy's fault; failed CONNECTs raise instead.
+    if response.status == 407:
+        return True
+    return response.status == 502 and "Proxy-Status" in response.headers
+
+class Proxy:
+    def __init__(self, url: str):
+        self.url = url
+        self.latency: Optional[float] = None
+        self.success_rate = 1.0
+        self.consecutive_failures = 0
+        self.quarantined_until = 0.0
+        self.quarantine_seconds = PROXY_QUARANTINE_SECONDS
+        self.requests = 0
+        self.failures = 0
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def label(self) -> str:
+        # host:port only, so stats can be logged without credentials.
+        parts = urlsplit(self.url)
+        return f"{parts.hostname}:{parts.port}"
+
+    @property
+    def quarantined(self) -> bool:
+        return self.quarantined_until > time.monotonic()
+
+    def score(self) -> float:
+        latency = self.latency if self.latency is not None else DEFAULT_LATENCY
+        return latency / max(self.success_rate, 0.05)
+
+    def record_success(self, latency: float) -> None:
+        self.requests += 1
+        self.latency = latency if self.latency is None else self.latency + EWMA_ALPHA * (latency - self.latency)
+        self.success_rate += EWMA_ALPHA * (1.0 - self.success_rate)
+        self.consecutive_failures = 0
+        self.quarantined_until = 0.0
+        self.quarantine_seconds = PROXY_QUARANTINE_SECONDS
+
+    def record_failure(self) -> None:
+        self.requests += 1
+        self.failures += 1
+        self.success_rate += EWMA_ALPHA * (0.0 - self.success_rate)
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= PROXY_FAILURE_THRESHOLD:
+            self.quarantine()
+
+    def quarantine(self) -> None:
+        self.quarantined_until = time.monotonic() + self.quarantine_seconds
+        self.quarantine_seconds = min(self.quarantine_seconds * 2, PROXY_MAX_QUARANTINE_SECONDS)
+
+    def session(self) -> aiohttp.ClientSession:
+        # One keep-alive pool per proxy, so connections to a proxy are reused
+        # and a slow proxy cannot hold connections meant for the others.
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=PROXY_CONNECTIONS, keepalive_timeout=60),
+                proxy=self.url,
+            )
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def snapshot(self) -> dict:
+        return {
+            "latency": self.latency,
+            "success_rate": round(self.success_rate, 4),
+            "requests": self.requests,
+            "failures": self.failures,
+            "quarantined_for": max(0.0, round(self.quarantined_until - time.monotonic(), 1)),
+        }
+
+class ProxyPool:
+    def __init__(self, path: str = PROXY_FILE, check_interval: float = PROXY_FILE_CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self.proxies: Dict[str, Proxy] = {}
+        self._mtime: Optional[float] = None
+        self._checked = 0.0
+        self._sticky: "OrderedDict[str, str]" = OrderedDict()
+        self._closing: set = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def load(self, urls: List[str]) -> None:
+        # Proxies that stay in the list keep their stats and connections.
+        proxies = {url: self.proxies.get(url) or Proxy(url) for url in urls}
+        for url, proxy in self.proxies.items():
+            if url not in proxies:
+                self._close_later(proxy)
+        self.proxies = proxies
+        for key in [k for k, url in self._sticky.items() if url not in proxies]:
+            del self._sticky[key]
+
+    def _close_later(self, proxy: Proxy) -> None:
+        if proxy._session is None:
+            return
+        try:
+            task = asyncio.get_running_loop().create_task(proxy.close())
+        except RuntimeError:
+            return
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    def reload_if_changed(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now - self._checked < self.check_interval:
+            return
+        self._checked = now
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            mtime = None
+        if mtime == self._mtime and not force:
+            return
+        self._mtime = mtime
+        urls = []
+        if mtime is not None:
+            with open(self.path, "r") as f:
+                urls = list(dict.fromkeys(url for url in map(parse_proxy, f) if url))
+        self.load(urls)
+        logger.info(f"Loaded {len(urls)} proxies from {self.path}")
+
+    def acquire(self, session_key: Optional[str] = None) -> Proxy:
+        self.reload_if_changed()
+        if not self.proxies:
+            raise ValueError(f"No proxies configured in {self.path}")
+        if session_key is not None:
+            url = self._sticky.get(session_key)
+            proxy = self.proxies.get(url) if url else None
+            if proxy is not None and self._available(proxy):
+                self._sticky.move_to_end(session_key)
+                return proxy
+        proxy = self._choose()
+        if session_key is not None:
+            self._sticky[session_key] = proxy.url
+            self._sticky.move_to_end(session_key)
+            while len(self._sticky) > PROXY_STICKY_SESSIONS:
+                self._sticky.popitem(last=False)
+        return proxy
+
+    def _available(self, proxy: Proxy) -> bool:
+        if not proxy.quarantined_until:
+            return True
+        # With health checks running, a proxy whose backoff has run out waits
+        # for a successful probe before it is handed out again.
+        return self._task is None and not proxy.quarantined
+
+    def _choose(self) -> Proxy:
+        healthy = [p for p in self.proxies.values() if self._available(p)]
+        if not healthy:
+            # Everything is quarantined: use whichever comes back first
+            # rather than failing outright.
+            return min(self.proxies.values(), key=lambda p: p.quarantined_until)
+        if len(healthy) == 1:
+            return healthy[0]
+        # Power of two choices: spreads load while still favouring fast,
+        # reliable proxies.
+        first, second = random.sample(healthy, 2)
+        return first if first.score() <= second.score() else second
+
+    def release(self, session_key: str) -> None:
+        self._sticky.pop(session_key, None)
+
+    @asynccontextmanager
+    async def request(self, method: str, url: str, session_key: Optional[str] = None, **kwargs):
+        # Sends a request through a pooled proxy and records the outcome.
+        # Transport errors and proxy-generated 407/502 responses count
+        # against the proxy; other statuses are the upstream's.
+        proxy = self.acquire(session_key)
+        start = time.monotonic()
+        try:
+            async with proxy.session().request(method, url, **kwargs) as response:
+                if is_proxy_error(response):
+                    proxy.record_failure()
+                else:
+                    proxy.record_success(time.monotonic() - start)
+                yield response
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            proxy.record_failure()
+            raise
+
+    async def check(self, proxy: Proxy, url: str = PROXY_HEALTH_URL) -> bool:
+        start = time.monotonic()
+        try:
+            timeout = aiohttp.ClientTimeout(total=PROXY_HEALTH_TIMEOUT)
+            async with proxy.session().get(url, timeout=timeout) as response:
+                ok = response.status < 400
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            ok = False
+        if ok:
+            proxy.record_success(time.monotonic() - start)
+        else:
+            proxy.quarantine()
+        return ok
+
+    async def _health_loop(self) -> None:
+        while True:
+            await asyncio.sleep(PROXY_HEALTH_INTERVAL)
+            self.reload_if_changed()
+            # Only quarantined proxies whose backoff has run out are probed;
+            # healthy ones are measured by real traffic.
+            due = [p for p in self.proxies.values() if p.quarantined_until and not p.quarantined]
+            if due:
+                await asyncio.gather(*(self.check(p) for p in due), return_exceptions=True)
+
+    def start(self) -> None:
+        if self._task is None and PROXY_HEALTH_URL:
+            self._task = asyncio.create_task(self._health_loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.gather(*(p.close() for p in self.proxies.values()), *self._closing, return_exceptions=True)
+
+    def snapshot(self) -> Dict[str, dict]:
+        return {proxy.label: proxy.snapshot() for proxy in self.proxies.values()}
+
+proxy_pool = ProxyPool()
@@ -0,0 +1,122 @@
+import abc
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict
+from utils import mongo
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMITS = {
+    "free": 8,
+    "premium": 30,
+    "enterprise": 60
+}
+
+RATE_LIMIT_WINDOW = 60
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+RATE_LIMIT_PREFIX = "ratelimit:"
+
+@dataclass
+class RateLimitResult:
+    allowed: bool
+    limit: int
+    remaining: int
+    reset_after: float
+    retry_after: float = 0.0
+
+    def headers(self) -> Dict[str, str]:
+        headers = {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(max(self.remaining, 0)),
+            "X-RateLimit-Reset": str(math.ceil(self.reset_after)),
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(max(math.ceil(self.retry_after), 1))
+        return headers
+
+class RateLimiter(abc.ABC):
+    @abc.abstractmethod
+    async def hit(self, key: str, limit: int, window: float = RATE_LIMIT_WINDOW) -> RateLimitResult:
+        pass
+
+class MemoryRateLimiter(RateLimiter):
+    # Token bucket per key refilling at limit/window tokens per second. Buckets
+    # live in an LRU so memory is bounded by max_keys; an evicted bucket is
+    # indistinguishable from a full one once it has been idle for a window.
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+
+    async def hit(self, key: str, limit: int, window: float = RATE_LIMIT_WINDOW) -> RateLimitResult:
+        now = time.monotonic()
+        rate = limit / window
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = [float(limit), now]
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(float(limit), bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+
+        if bucket[0] < 1:
+            retry_after = (1 - bucket[0]) / rate
+            return RateLimitResult(False, limit, 0, (limit - bucket[0]) / rate, retry_after)
+
+        bucket[0] -= 1
+        return RateLimitResult(True, limit, int(bucket[0]), (limit - bucket[0]) / rate)
+
+# GCRA: one key per API key holding the theoretical arrival time (ms). Uses the
+# Redis clock so every worker and node shares the same view.
+GCRA_LUA = """
+if redis.replicate_commands then
+    pcall(redis.replicate_commands)
+end
+local limit = tonumber(ARGV[1])
+local emission = tonumber(ARGV[2])
+local server_time = redis.call('TIME')
+local now = tonumber(server_time[1]) * 1000 + math.floor(tonumber(server_time[2]) / 1000)
+local tat = tonumber(redis.call('GET', KEYS[1])) or now
+if tat < now then
+    tat = now
+end
+local new_tat = tat + emission
+local allow_at = new_tat - emission * limit
+if now < allow_at then
+    return {0, 0, tat - now, allow_at - now}
+end
+redis.call('SET', KEYS[1], new_tat, 'PX', math.max(math.ceil(new_tat - now), 1))
+return {1, math.floor((now - allow_at) / emission), new_tat - now, 0}
+"""
+
+class RedisRateLimiter(RateLimiter):
+    def __init__(self, prefix: str = RATE_LIMIT_PREFIX):
+        self.prefix = prefix
+        self._script = mongo.get_redis_client().register_script(GCRA_LUA)
+
+    async def hit(self, key: str, limit: int, window: float = RATE_LIMIT_WINDOW) -> RateLimitResult:
+        emission = window * 1000 / limit
+        try:
+            allowed, remaining, reset_ms, retry_ms = await self._script(
+                keys=[f"{self.prefix}{key}"],
+                args=[limit, emission],
+                client=mongo.get_redis_client(),
+            )
+        except Exception as e:
+            logger.error(f"Rate limiter unavailable, allowing request: {e}")
+            return RateLimitResult(True, limit, limit, 0)
+        return RateLimitResult(bool(allowed), limit, int(remaining), int(reset_ms) / 1000, int(retry_ms) / 1000)
+
+def create_rate_limiter(backend: str = RATE_LIMIT_BACKEND) -> RateLimiter:
+    if backend == "redis":
+        return RedisRateLimiter()
+    return MemoryRateLimiter()
+
+rate_limiter = create_rate_limiter()
@@ -0,0 +1,96 @@
+import gzip
+import hashlib
+import os
+import time
+from typing import Callable, Dict, Hashable, Optional, Tuple
+from fastapi import Request
+from fastapi.responses import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# How often a file's mtime is re-checked; between checks the cached stamp is used.
+FILE_CHECK_INTERVAL = float(os.getenv("RESPONSE_CACHE_FILE_CHECK_INTERVAL", "1"))
+# Bodies smaller than this are not worth a compressed variant.
+MIN_COMPRESS_SIZE = 256
+
+_mtimes: Dict[str, Tuple[float, Optional[float]]] = {}
+
+def file_stamp(path: str) -> Optional[float]:
+    now = time.monotonic()
+    checked = _mtimes.get(path)
+    if checked is not None and now - checked[0] < FILE_CHECK_INTERVAL:
+        return checked[1]
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        mtime = None
+    _mtimes[path] = (now, mtime)
+    return mtime
+
+class CachedResponse:
+    def __init__(self, body: bytes, media_type: str, cache_control: str):
+        self.media_type = media_type
+        self.cache_control = cache_control
+        self.etag = f'W/"{hashlib.sha256(body).hexdigest()[:32]}"'
+        self.variants: Dict[str, bytes] = {"identity": body}
+        if len(body) >= MIN_COMPRESS_SIZE:
+            self.variants["gzip"] = gzip.compress(body, compresslevel=9, mtime=0)
+            if brotli is not None:
+                self.variants["br"] = brotli.compress(body)
+
+    def _encoding(self, accept_encoding: str) -> str:
+        accepted = set()
+        for item in accept_encoding.split(","):
+            name, *params = item.split(";")
+            quality = 1.0
+            for param in params:
+                key, _, value = param.strip().partition("=")
+                if key == "q":
+                    try:
+                        quality = float(value)
+                    except ValueError:
+                        quality = 0.0
+            if quality > 0:
+                accepted.add(name.strip().lower())
+        for encoding in ("br", "gzip"):
+            if encoding in self.variants and (encoding in accepted or "*" in accepted):
+                return encoding
+        return "identity"
+
+    def _not_modified(self, if_none_match: str) -> bool:
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        # Weak comparison, as If-None-Match requires.
+        tag = self.etag[2:]
+        return any(candidate.strip().removeprefix("W/") == tag for candidate in if_none_match.split(","))
+
+    def respond(self, request: Request) -> Response:
+        headers = {"ETag": self.etag, "Cache-Control": self.cache_control, "Vary": "Accept-Encoding"}
+        if self._not_modified(request.headers.get("if-none-match", "")):
+            return Response(status_code=304, headers=headers)
+        encoding = self._encoding(request.headers.get("accept-encoding", ""))
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(content=self.variants[encoding], media_type=self.media_type, headers=headers)
+
+class ResponseCache:
+    # Keeps one prebuilt response per name and rebuilds it only when the
+    # caller's stamp (registry version, file mtime, ...) changes.
+    def __init__(self):
+        self._entries: Dict[str, Tuple[Hashable, CachedResponse]] = {}
+
+    def get(self, name: str, stamp: Hashable, build: Callable[[], CachedResponse]) -> CachedResponse:
+        entry = self._entries.get(name)
+        if entry is None or entry[0] != stamp:
+            entry = self._entries[name] = (stamp, build())
+        return entry[1]
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+response_cache = ResponseCache()
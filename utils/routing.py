@@ -0,0 +1,293 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import deque
+from typing import AsyncGenerator, Dict, List, Optional, Sequence, Tuple
+from pystyle import Colorate, Colors
+from utils.scheduler import AdmissionRejected, admission_deadline, scheduler
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+EWMA_ALPHA = 0.2
+DEFAULT_LATENCY = 2.0
+CIRCUIT_FAILURES = int(os.getenv("CIRCUIT_FAILURES", "5"))
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", "10"))
+CIRCUIT_MAX_OPEN_SECONDS = float(os.getenv("CIRCUIT_MAX_OPEN_SECONDS", "300"))
+HEDGE_ENABLED = os.getenv("ROUTING_HEDGE", "0") == "1"
+HEDGE_MIN_DELAY = float(os.getenv("ROUTING_HEDGE_MIN_DELAY", "0.5"))
+HEDGE_MIN_SAMPLES = 20
+
+class ProviderStats:
+    def __init__(self):
+        self.ttft: Optional[float] = None
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.inflight = 0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.open_seconds = CIRCUIT_OPEN_SECONDS
+        self.samples: deque = deque(maxlen=200)
+
+    @staticmethod
+    def _ewma(current: Optional[float], value: float) -> float:
+        return value if current is None else current + EWMA_ALPHA * (value - current)
+
+    def record_ttft(self, seconds: float) -> None:
+        self.ttft = self._ewma(self.ttft, seconds)
+
+    def record_success(self, seconds: float) -> None:
+        self.latency = self._ewma(self.latency, seconds)
+        self.samples.append(seconds)
+        self.error_rate = self._ewma(self.error_rate, 0.0)
+        self.consecutive_failures = 0
+        self.open_seconds = CIRCUIT_OPEN_SECONDS
+
+    def record_failure(self) -> None:
+        self.error_rate = self._ewma(self.error_rate, 1.0)
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= CIRCUIT_FAILURES:
+            # Half-open after the timeout: one more failure reopens for twice as long.
+            self.open_until = time.monotonic() + self.open_seconds
+            self.open_seconds = min(self.open_seconds * 2, CIRCUIT_MAX_OPEN_SECONDS)
+            self.consecutive_failures = CIRCUIT_FAILURES - 1
+
+    @property
+    def circuit_open(self) -> bool:
+        return self.open_until > time.monotonic()
+
+    def score(self, stream: bool) -> float:
+        latency = self.ttft if stream else self.latency
+        if latency is None:
+            latency = self.latency if self.latency is not None else DEFAULT_LATENCY
+        return latency * (1 + self.inflight) / max(1.0 - self.error_rate, 0.05)
+
+    def p95(self) -> Optional[float]:
+        if len(self.samples) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+def provider_name(provider) -> str:
+    return provider.__class__.__name__
+
+class RelayStream:
+    # What Router.stream hands back: the upstream stream from its first chunk
+    # on. It owns the provider's admission slot and inflight count and gives
+    # them back once, on exhaustion, error, aclose() or garbage collection,
+    # including when the caller fails before it starts iterating.
+    def __init__(self, provider, model: str, stats: ProviderStats, chunks: AsyncGenerator, first, start: float, release):
+        self.provider = provider
+        self.model = model
+        self.stats = stats
+        self.chunks = chunks
+        self.start = start
+        self.closed = False
+        self._release = release
+        self._relay = self._run(first)
+
+    def __aiter__(self) -> "RelayStream":
+        return self
+
+    async def __anext__(self):
+        return await self._relay.__anext__()
+
+    async def _run(self, first) -> AsyncGenerator:
+        completed = False
+        try:
+            yield first
+            async for chunk in self.chunks:
+                yield chunk
+            completed = True
+        except (asyncio.CancelledError, GeneratorExit):
+            raise
+        except Exception:
+            self.stats.record_failure()
+            metrics.PROVIDER_ERRORS.inc(provider_name(self.provider), self.model)
+            raise
+        finally:
+            self._finish(completed)
+            await self.chunks.aclose()
+
+    def _finish(self, completed: bool = False) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self.stats.inflight -= 1
+        self._release()
+        if completed:
+            elapsed = time.monotonic() - self.start
+            self.stats.record_success(elapsed)
+            metrics.COMPLETION_DURATION.observe(elapsed, provider_name(self.provider), self.model, "true")
+
+    async def aclose(self) -> None:
+        # An async generator that never started skips its finally on aclose(),
+        # so the slot is given back here as well.
+        await self._relay.aclose()
+        self._finish()
+        await self.chunks.aclose()
+
+    def __del__(self) -> None:
+        self._finish()
+
+class Router:
+    def __init__(self):
+        self._stats: Dict[Tuple[str, str], ProviderStats] = {}
+
+    def stats(self, provider, model: str) -> ProviderStats:
+        key = (provider_name(provider), model)
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = ProviderStats()
+        return stats
+
+    def snapshot(self) -> Dict[Tuple[str, str], ProviderStats]:
+        return dict(self._stats)
+
+    def _order_tier(self, providers: Sequence, model: str, stream: bool) -> List:
+        if len(providers) < 2:
+            return list(providers)
+        scored = sorted(providers, key=lambda p: self.stats(p, model).score(stream))
+        # Weighted pick for the head so slower providers still see enough
+        # traffic to notice when they recover.
+        weights = [1.0 / self.stats(p, model).score(stream) for p in scored]
+        head = random.choices(scored, weights=weights)[0]
+        return [head] + [p for p in scored if p is not head]
+
+    def rank(self, priority: Sequence, others: Sequence, model: str, stream: bool) -> List:
+        closed_priority = [p for p in priority if not self.stats(p, model).circuit_open]
+        closed_others = [p for p in others if not self.stats(p, model).circuit_open]
+        tripped = [p for p in list(priority) + list(others) if self.stats(p, model).circuit_open]
+        tripped.sort(key=lambda p: self.stats(p, model).open_until)
+        return (
+            self._order_tier(closed_priority, model, stream)
+            + self._order_tier(closed_others, model, stream)
+            + tripped
+        )
+
+    async def stream(self, chat_request: dict, providers: Sequence, plan: str = "free", deadline: Optional[float] = None) -> Tuple[object, RelayStream]:
+        model = chat_request["model"]
+        last_error: Optional[BaseException] = None
+        # One queueing budget for the whole request, not one per provider tried.
+        deadline = deadline if deadline is not None else admission_deadline()
+        for provider in providers:
+            try:
+                release = await scheduler.acquire(provider, plan, deadline)
+            except AdmissionRejected as e:
+                # A saturated provider is not a failing one; try the next without
+                # touching its health stats.
+                last_error = e
+                continue
+            stats = self.stats(provider, model)
+            stats.inflight += 1
+            start = time.monotonic()
+            chunks = provider.create_chat_completion(chat_request)
+            try:
+                first = await chunks.__anext__()
+            except BaseException as e:
+                stats.inflight -= 1
+                release()
+                await chunks.aclose()
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                stats.record_failure()
+                metrics.PROVIDER_ERRORS.inc(provider_name(provider), model)
+                last_error = e if not isinstance(e, StopAsyncIteration) else ValueError(f"{provider_name(provider)} returned an empty stream")
+                logger.error(f"Provider {provider_name(provider)} failed before first chunk: {last_error}")
+                continue
+            ttft = time.monotonic() - start
+            stats.record_ttft(ttft)
+            metrics.COMPLETION_TTFT.observe(ttft, provider_name(provider), model)
+            print(Colorate.Vertical(Colors.blue_to_purple, f"Using provider: {provider_name(provider)}"))
+            return provider, RelayStream(provider, model, stats, chunks, first, start, release)
+        raise last_error or ValueError("No suitable provider found for the given request")
+
+    async def _call(self, provider, chat_request: dict, plan: str, deadline: float):
+        release = await scheduler.acquire(provider, plan, deadline)
+        try:
+            return await self._call_admitted(provider, chat_request)
+        finally:
+            release()
+
+    async def _call_admitted(self, provider, chat_request: dict):
+        model = chat_request["model"]
+        stats = self.stats(provider, model)
+        stats.inflight += 1
+        start = time.monotonic()
+        try:
+            response = None
+            async for response in provider.create_chat_completion(chat_request):
+                pass
+            if response is None:
+                raise ValueError(f"{provider_name(provider)} returned no response")
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            stats.record_failure()
+            metrics.PROVIDER_ERRORS.inc(provider_name(provider), model)
+            raise
+        else:
+            elapsed = time.monotonic() - start
+            stats.record_ttft(elapsed)
+            stats.record_success(elapsed)
+            metrics.COMPLETION_DURATION.observe(elapsed, provider_name(provider), model, "false")
+            return response
+        finally:
+            stats.inflight -= 1
+
+    def _hedge_delay(self, provider, model: str) -> Optional[float]:
+        p95 = self.stats(provider, model).p95()
+        return None if p95 is None else max(p95, HEDGE_MIN_DELAY)
+
+    async def complete(self, chat_request: dict, providers: Sequence, plan: str = "free", hedge: bool = HEDGE_ENABLED, deadline: Optional[float] = None) -> Tuple[object, dict]:
+        model = chat_request["model"]
+        queue = list(providers)
+        if not queue:
+            raise ValueError("No suitable provider found for the given request")
+        deadline = deadline if deadline is not None else admission_deadline()
+        pending: Dict[asyncio.Task, object] = {}
+        last_error: Optional[BaseException] = None
+        hedged = False
+
+        def launch() -> None:
+            provider = queue.pop(0)
+            pending[asyncio.create_task(self._call(provider, chat_request, plan, deadline))] = provider
+
+        launch()
+        try:
+            while pending:
+                timeout = None
+                if hedge and not hedged and queue and len(pending) == 1:
+                    timeout = self._hedge_delay(next(iter(pending.values())), model)
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    launch()
+                    continue
+                for task in done:
+                    provider = pending.pop(task)
+                    if task.exception() is None:
+                        print(Colorate.Vertical(Colors.blue_to_purple, f"Using provider: {provider_name(provider)}"))
+                        return provider, task.result()
+                    last_error = task.exception()
+                    if not isinstance(last_error, AdmissionRejected):
+                        logger.error(f"Provider {provider_name(provider)} failed: {last_error}")
+                if not pending and queue:
+                    launch()
+        finally:
+            for task in pending:
+                task.cancel()
+        raise last_error
+
+router = Router()
+
+def _collect_metrics() -> None:
+    inflight: Dict[str, int] = {}
+    for (name, _), stats in router._stats.items():
+        inflight[name] = inflight.get(name, 0) + stats.inflight
+    for name, count in inflight.items():
+        metrics.PROVIDER_IN_FLIGHT.set(count, name)
+
+metrics.registry.add_collector(_collect_metrics)
@@ -0,0 +1,176 @@
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from typing import Callable, Dict, Optional
+from utils.ratelimit import RATE_LIMITS
+from utils import metrics
+
+ADMISSION_SLOTS = int(os.getenv("ADMISSION_SLOTS", "32"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "256"))
+# Total time one request may spend queueing, across every provider it tries.
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10"))
+
+# Queues are served in proportion to the plan's rate limit, so enterprise
+# traffic gets ~7x the share of free traffic when a provider is saturated.
+PLAN_WEIGHTS = dict(RATE_LIMITS)
+
+def admission_deadline() -> float:
+    return time.monotonic() + ADMISSION_QUEUE_TIMEOUT
+
+class AdmissionRejected(Exception):
+    def __init__(self, message: str, retry_after: int = 1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class ProviderQueue:
+    def __init__(self, slots: int, max_queue: int = ADMISSION_MAX_QUEUE):
+        self.slots = slots
+        self.max_queue = max_queue
+        self.in_use = 0
+        self.depth = 0
+        self.queues: Dict[str, deque] = {plan: deque() for plan in PLAN_WEIGHTS}
+        self.queued: Dict[str, int] = {plan: 0 for plan in PLAN_WEIGHTS}
+        self.passes: Dict[str, float] = {plan: 0.0 for plan in PLAN_WEIGHTS}
+        self.virtual_time = 0.0
+        self.wait_ewma = 0.0
+        self.service_ewma = 1.0
+        self.admitted = 0
+        self.rejected = 0
+
+    def _plan(self, plan: str) -> str:
+        return plan if plan in PLAN_WEIGHTS else "free"
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.service_ewma * (self.depth + 1) / self.slots))
+
+    def _record_wait(self, seconds: float) -> None:
+        self.wait_ewma += 0.2 * (seconds - self.wait_ewma)
+        self.admitted += 1
+
+    def _next_waiter(self) -> Optional[asyncio.Future]:
+        while self.depth:
+            plan = min(
+                (p for p, q in self.queues.items() if q),
+                key=lambda p: self.passes[p],
+                default=None,
+            )
+            if plan is None:
+                return None
+            waiter = self.queues[plan].popleft()
+            if waiter.done():
+                continue
+            self.depth -= 1
+            self.queued[plan] -= 1
+            self.virtual_time = self.passes[plan]
+            self.passes[plan] += 1.0 / PLAN_WEIGHTS[plan]
+            return waiter
+        return None
+
+    async def acquire(self, plan: str, deadline: Optional[float] = None) -> None:
+        plan = self._plan(plan)
+        if self.in_use < self.slots and not self.depth:
+            self.in_use += 1
+            self._record_wait(0.0)
+            return
+        if self.depth >= self.max_queue:
+            self.rejected += 1
+            raise AdmissionRejected("Provider backlog is full", self.retry_after())
+        timeout = (deadline if deadline is not None else admission_deadline()) - time.monotonic()
+        if timeout <= 0:
+            self.rejected += 1
+            raise AdmissionRejected("Timed out waiting for a provider slot", self.retry_after())
+
+        if not self.queues[plan]:
+            # A plan returning from idle starts at the current virtual time
+            # instead of cashing in credit accumulated while it was away.
+            self.passes[plan] = max(self.passes[plan], self.virtual_time)
+        waiter = asyncio.get_running_loop().create_future()
+        self.queues[plan].append(waiter)
+        self.queued[plan] += 1
+        self.depth += 1
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            self._abandon(plan, waiter)
+            self.rejected += 1
+            raise AdmissionRejected("Timed out waiting for a provider slot", self.retry_after())
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release(time.monotonic() - start)
+            else:
+                self._abandon(plan, waiter)
+            raise
+        self._record_wait(time.monotonic() - start)
+
+    def _abandon(self, plan: str, waiter: asyncio.Future) -> None:
+        if not waiter.done():
+            waiter.cancel()
+        if waiter in self.queues[plan]:
+            self.depth -= 1
+            self.queued[plan] -= 1
+            self.queues[plan].remove(waiter)
+
+    def release(self, service_time: Optional[float] = None) -> None:
+        if service_time is not None:
+            self.service_ewma += 0.2 * (service_time - self.service_ewma)
+        waiter = self._next_waiter()
+        if waiter is not None:
+            # Hand the slot straight to the next waiter.
+            waiter.set_result(True)
+        else:
+            self.in_use -= 1
+
+class AdmissionScheduler:
+    def __init__(self, default_slots: int = ADMISSION_SLOTS):
+        self.default_slots = default_slots
+        self._queues: Dict[str, ProviderQueue] = {}
+
+    def queue(self, provider) -> ProviderQueue:
+        name = provider.__class__.__name__
+        queue = self._queues.get(name)
+        if queue is None:
+            slots = getattr(provider, "max_concurrency", None) or self.default_slots
+            queue = self._queues[name] = ProviderQueue(slots)
+        return queue
+
+    async def acquire(self, provider, plan: str, deadline: Optional[float] = None) -> Callable[[], None]:
+        queue = self.queue(provider)
+        await queue.acquire(plan, deadline)
+        start = time.monotonic()
+        released = False
+
+        def release() -> None:
+            nonlocal released
+            if not released:
+                released = True
+                queue.release(time.monotonic() - start)
+
+        return release
+
+    def snapshot(self) -> Dict[str, dict]:
+        return {
+            name: {
+                "slots": queue.slots,
+                "in_use": queue.in_use,
+                "queued": dict(queue.queued),
+                "avg_wait_seconds": round(queue.wait_ewma, 4),
+                "admitted": queue.admitted,
+                "rejected": queue.rejected,
+            }
+            for name, queue in self._queues.items()
+        }
+
+scheduler = AdmissionScheduler()
+
+def _collect_metrics() -> None:
+    for name, queue in scheduler._queues.items():
+        for plan, depth in queue.queued.items():
+            metrics.ADMISSION_QUEUED.set(depth, name, plan)
+        metrics.ADMISSION_IN_USE.set(queue.in_use, name)
+        metrics.ADMISSION_WAIT.set(queue.wait_ewma, name)
+        metrics.ADMISSION_REJECTED.set(queue.rejected, name)
+
+metrics.registry.add_collector(_collect_metrics)
@@ -0,0 +1,148 @@
+import os
+from typing import Any, Dict, List, Optional, Union
+from utils.streaming import loads
+
+REQUEST_PARSER = os.getenv("REQUEST_PARSER", "auto")
+MAX_BODY_BYTES = int(os.getenv("MAX_BODY_BYTES", str(8 * 1024 * 1024)))
+MAX_MESSAGES = int(os.getenv("MAX_MESSAGES", "512"))
+# Per message; multimodal content counts its text parts.
+MAX_CONTENT_CHARS = int(os.getenv("MAX_CONTENT_CHARS", "1000000"))
+MAX_MODEL_CHARS = 128
+
+ROLES = ("system", "developer", "user", "assistant", "tool", "function")
+
+# Top-level fields passed on to providers; anything else is dropped by both parsers.
+REQUEST_FIELDS = (
+    "model", "messages", "stream", "temperature", "top_p", "n", "max_tokens",
+    "max_completion_tokens", "stop", "presence_penalty", "frequency_penalty",
+    "logit_bias", "logprobs", "top_logprobs", "user", "seed", "tools", "tool_choice",
+    "parallel_tool_calls", "functions", "function_call", "response_format", "stream_options",
+)
+MESSAGE_FIELDS = ("role", "content", "name", "tool_calls", "tool_call_id", "function_call")
+_MESSAGE_FIELD_SET = frozenset(MESSAGE_FIELDS)
+
+class RequestValidationError(Exception):
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+if msgspec is not None:
+    from typing import Annotated, Literal
+
+    Text = Annotated[str, msgspec.Meta(max_length=MAX_CONTENT_CHARS)]
+
+    class MessageSchema(msgspec.Struct, omit_defaults=True):
+        role: Literal[ROLES]
+        content: Union[Text, List[Dict[str, Any]], None] = None
+        name: Optional[str] = None
+        tool_calls: Optional[List[Dict[str, Any]]] = None
+        tool_call_id: Optional[str] = None
+        function_call: Optional[Dict[str, Any]] = None
+
+    class ChatCompletionsRequestSchema(msgspec.Struct, omit_defaults=True):
+        messages: Annotated[List[MessageSchema], msgspec.Meta(min_length=1, max_length=MAX_MESSAGES)]
+        model: Annotated[str, msgspec.Meta(min_length=1, max_length=MAX_MODEL_CHARS)] = "gpt-3.5-turbo"
+        stream: bool = False
+        temperature: Optional[float] = None
+        top_p: Optional[float] = None
+        n: Optional[int] = None
+        max_tokens: Optional[int] = None
+        max_completion_tokens: Optional[int] = None
+        stop: Union[str, List[str], None] = None
+        presence_penalty: Optional[float] = None
+        frequency_penalty: Optional[float] = None
+        logit_bias: Optional[Dict[str, float]] = None
+        logprobs: Optional[bool] = None
+        top_logprobs: Optional[int] = None
+        user: Optional[str] = None
+        seed: Optional[int] = None
+        tools: Optional[List[Dict[str, Any]]] = None
+        tool_choice: Union[str, Dict[str, Any], None] = None
+        parallel_tool_calls: Optional[bool] = None
+        functions: Optional[List[Dict[str, Any]]] = None
+        function_call: Union[str, Dict[str, Any], None] = None
+        response_format: Optional[Dict[str, Any]] = None
+        stream_options: Optional[Dict[str, Any]] = None
+
+    _decoder = msgspec.json.Decoder(ChatCompletionsRequestSchema)
+else:
+    ChatCompletionsRequestSchema = None
+
+def _content_chars(content) -> int:
+    if isinstance(content, str):
+        return len(content)
+    return sum(len(part.get("text") or "") for part in content if isinstance(part, dict))
+
+def _check_parts(content, where: str) -> None:
+    if isinstance(content, list) and _content_chars(content) > MAX_CONTENT_CHARS:
+        raise RequestValidationError(f"{where}.content is longer than {MAX_CONTENT_CHARS} characters")
+
+def _parse_msgspec(body: bytes) -> dict:
+    try:
+        request = _decoder.decode(body)
+    except msgspec.ValidationError as e:
+        raise RequestValidationError(str(e))
+    except msgspec.DecodeError as e:
+        raise RequestValidationError(f"Invalid JSON body: {e}")
+    # Strings are bounded by the schema; text inside multimodal parts is not.
+    for index, message in enumerate(request.messages):
+        if isinstance(message.content, list):
+            _check_parts(message.content, f"$.messages[{index}]")
+    chat_request = msgspec.to_builtins(request)
+    chat_request.update(model=request.model, stream=request.stream)
+    return chat_request
+
+def _expect(condition: bool, message: str) -> None:
+    if not condition:
+        raise RequestValidationError(message)
+
+def _parse_python(body: bytes) -> dict:
+    try:
+        data = loads(body)
+    except ValueError as e:
+        raise RequestValidationError(f"Invalid JSON body: {e}")
+    _expect(isinstance(data, dict), "Expected `object`, got a different JSON type - at `$`")
+
+    model = data.get("model", "gpt-3.5-turbo")
+    _expect(isinstance(model, str) and 0 < len(model) <= MAX_MODEL_CHARS, "Invalid `model` - at `$.model`")
+    stream = data.get("stream", False)
+    _expect(isinstance(stream, bool), "Expected `bool` - at `$.stream`")
+    messages = data.get("messages")
+    _expect(isinstance(messages, list) and messages, "Expected a non-empty `array` - at `$.messages`")
+    _expect(len(messages) <= MAX_MESSAGES, f"Expected `array` of length <= {MAX_MESSAGES} - at `$.messages`")
+
+    cleaned = []
+    for index, message in enumerate(messages):
+        # Error messages are only formatted on failure; this loop is per message.
+        if not isinstance(message, dict):
+            raise RequestValidationError(f"Expected `object` - at `$.messages[{index}]`")
+        if message.get("role") not in ROLES:
+            raise RequestValidationError(f"Invalid enum value {message.get('role')!r} - at `$.messages[{index}].role`")
+        content = message.get("content")
+        if isinstance(content, str):
+            if len(content) > MAX_CONTENT_CHARS:
+                raise RequestValidationError(f"Expected `str` of length <= {MAX_CONTENT_CHARS} - at `$.messages[{index}].content`")
+        elif isinstance(content, list):
+            _check_parts(content, f"$.messages[{index}]")
+        elif content is not None:
+            raise RequestValidationError(f"Expected `str | array | null` - at `$.messages[{index}].content`")
+        if message.keys() <= _MESSAGE_FIELD_SET and None not in message.values():
+            cleaned.append(message)
+        else:
+            cleaned.append({field: message[field] for field in MESSAGE_FIELDS if message.get(field) is not None})
+
+    chat_request = {field: data[field] for field in REQUEST_FIELDS if data.get(field) is not None}
+    chat_request.update(model=model, stream=stream, messages=cleaned)
+    return chat_request
+
+if REQUEST_PARSER == "python" or (REQUEST_PARSER == "auto" and msgspec is None):
+    parse_chat_request = _parse_python
+elif msgspec is None:
+    raise ImportError("REQUEST_PARSER=msgspec requires the msgspec package")
+else:
+    parse_chat_request = _parse_msgspec
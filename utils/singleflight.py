@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import os
+import weakref
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, List, Optional, Tuple
+from utils.completion_cache import cache_bypassed, cache_key, is_deterministic
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+COMPLETION_COALESCE = os.getenv("COMPLETION_COALESCE", "0") == "1"
+# Chunks every subscriber has read are dropped once the log reaches this size.
+COALESCE_TRIM_CHUNKS = int(os.getenv("COALESCE_TRIM_CHUNKS", "256"))
+
+def flight_key(chat_request: dict) -> str:
+    return f"{'stream' if chat_request.get('stream') else 'complete'}:{cache_key(chat_request)}"
+
+def can_coalesce(chat_request: dict, headers) -> bool:
+    # Sharing a sampled response would hand every caller the same "random"
+    # answer, so only requests the completion cache would also accept qualify.
+    return COMPLETION_COALESCE and is_deterministic(chat_request) and not cache_bypassed(headers)
+
+class Subscription:
+    # A reader's cursor into a StreamBroadcast. Counted from creation, before
+    # iteration starts, so a subscriber that leaves early cannot cancel the
+    # upstream under one whose response has not begun; released on exhaustion,
+    # error, aclose() or garbage collection, whichever comes first.
+    def __init__(self, broadcast: "StreamBroadcast"):
+        self.broadcast = broadcast
+        self.cursor = 0
+        self.closed = False
+        broadcast.subscribe(self)
+
+    def __aiter__(self) -> "Subscription":
+        return self
+
+    async def __anext__(self) -> Any:
+        if self.closed:
+            raise StopAsyncIteration
+        try:
+            chunk = await self.broadcast.read(self.cursor)
+        except BaseException:
+            self.close()
+            raise
+        self.cursor += 1
+        return chunk
+
+    def close(self) -> None:
+        if not self.closed:
+            self.closed = True
+            self.broadcast.unsubscribe()
+
+    async def aclose(self) -> None:
+        self.close()
+
+    def __del__(self) -> None:
+        self.close()
+
+class StreamBroadcast:
+    # One upstream stream fanned out to any number of subscribers. Chunks are
+    # kept in a shared log and every subscriber reads it at its own cursor, so a
+    # slow reader only falls behind and never holds up the upstream or others.
+    def __init__(self):
+        self.chunks: List[Any] = []
+        # Position in the stream of chunks[0]; non-zero once the log is trimmed.
+        self.offset = 0
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.started: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._readers: "weakref.WeakSet[Subscription]" = weakref.WeakSet()
+        self._changed = asyncio.Event()
+
+    @property
+    def joinable(self) -> bool:
+        # A new subscriber starts at the first chunk, which must still be here.
+        return not self.done and self.offset == 0
+
+    def _notify(self) -> None:
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def publish(self, chunk: Any) -> None:
+        self.chunks.append(chunk)
+        if len(self.chunks) >= COALESCE_TRIM_CHUNKS:
+            self._trim()
+        self._notify()
+
+    def _trim(self) -> None:
+        read = min((reader.cursor for reader in self._readers if not reader.closed), default=self.offset + len(self.chunks))
+        if read > self.offset:
+            del self.chunks[:read - self.offset]
+            self.offset = read
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        self.done = True
+        self.error = error
+        self._notify()
+
+    def subscribe(self, reader: Subscription) -> None:
+        self.subscribers += 1
+        self._readers.add(reader)
+
+    def unsubscribe(self) -> None:
+        self.subscribers -= 1
+        if self.subscribers == 0 and not self.done and self.task is not None:
+            self.task.cancel()
+
+    async def read(self, cursor: int) -> Any:
+        while True:
+            if cursor - self.offset < len(self.chunks):
+                return self.chunks[cursor - self.offset]
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                raise StopAsyncIteration
+            await self._changed.wait()
+
+class SingleFlight:
+    def __init__(self):
+        self._streams: Dict[str, StreamBroadcast] = {}
+        self._calls: Dict[str, asyncio.Future] = {}
+        self.shared = 0
+
+    async def call(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(fn())
+            self._calls[key] = future
+            future.add_done_callback(lambda f: self._forget(self._calls, key, f))
+        else:
+            self.shared += 1
+        # Shielded so one caller disconnecting does not cancel the shared call.
+        return await asyncio.shield(future)
+
+    async def stream(self, key: str, start: Callable[[], Awaitable[Tuple[Any, AsyncGenerator]]]) -> Tuple[Any, Subscription]:
+        broadcast = self._streams.get(key)
+        if broadcast is None or not broadcast.joinable:
+            broadcast = StreamBroadcast()
+            self._streams[key] = broadcast
+            broadcast.task = asyncio.create_task(self._pump(key, broadcast, start))
+        else:
+            self.shared += 1
+        provider = await asyncio.shield(broadcast.started)
+        return provider, Subscription(broadcast)
+
+    async def _pump(self, key: str, broadcast: StreamBroadcast, start: Callable) -> None:
+        chunks = None
+        try:
+            provider, chunks = await start()
+            broadcast.started.set_result(provider)
+            async for chunk in chunks:
+                broadcast.publish(chunk)
+            broadcast.finish()
+        except BaseException as e:
+            if not broadcast.started.done():
+                if isinstance(e, asyncio.CancelledError):
+                    broadcast.started.cancel()
+                else:
+                    broadcast.started.set_exception(e)
+                    # Mark as retrieved; every waiter still gets the exception.
+                    broadcast.started.exception()
+            if isinstance(e, asyncio.CancelledError):
+                broadcast.finish(RuntimeError("Shared upstream stream was cancelled"))
+                raise
+            broadcast.finish(e)
+        finally:
+            self._forget(self._streams, key, broadcast)
+            if chunks is not None:
+                await chunks.aclose()
+
+    @staticmethod
+    def _forget(flights: dict, key: str, flight) -> None:
+        if flights.get(key) is flight:
+            del flights[key]
+
+singleflight = SingleFlight()
+
+def _collect_metrics() -> None:
+    metrics.COALESCED.set(singleflight.shared)
+
+metrics.registry.add_collector(_collect_metrics)
@@ -0,0 +1,209 @@
+import asyncio
+import json
+import os
+import time
+from typing import AsyncGenerator, AsyncIterator, List, Optional
+from utils.common import generate_id
+
+JSON_BACKEND = os.getenv("JSON_BACKEND", "auto")
+STREAM_COALESCE_MS = float(os.getenv("STREAM_COALESCE_MS", "0"))
+STREAM_COALESCE_BYTES = int(os.getenv("STREAM_COALESCE_BYTES", "1024"))
+
+_json_encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+def _stdlib_dumps(obj) -> bytes:
+    return _json_encoder.encode(obj).encode()
+
+dumps = _stdlib_dumps
+loads = json.loads
+if JSON_BACKEND in ("auto", "orjson"):
+    try:
+        import orjson
+        dumps = orjson.dumps
+        loads = orjson.loads
+    except ImportError:
+        if JSON_BACKEND == "orjson":
+            raise
+
+DONE_FRAME = b"data: [DONE]\n\n"
+
+class RawChunk(bytes):
+    # An upstream chunk or response body that is already in OpenAI format.
+    # It is written to the client as is, without a decode/encode round trip.
+    pass
+
+class SSEParser:
+    # Incremental server-sent events parser. Feed it bytes as they arrive and
+    # it returns the data of every event completed so far. Only `data:`
+    # fields are kept; `event:`, `id:`, `retry:` and comments are skipped.
+    def __init__(self):
+        self._buffer = bytearray()
+        self._data: List[bytes] = []
+
+    def _event(self) -> Optional[bytes]:
+        if not self._data:
+            return None
+        data = self._data[0] if len(self._data) == 1 else b"\n".join(self._data)
+        self._data = []
+        return data
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        buffer = self._buffer
+        buffer += chunk
+        events = []
+        start = 0
+        while True:
+            end = buffer.find(b"\n", start)
+            if end == -1:
+                break
+            line_end = end - 1 if end > start and buffer[end - 1] == 13 else end
+            if line_end == start:
+                event = self._event()
+                if event is not None:
+                    events.append(event)
+            elif buffer.startswith(b"data:", start):
+                value = start + 5
+                if value < line_end and buffer[value] == 32:
+                    value += 1
+                # The only copy: the field value out of the shared buffer.
+                self._data.append(bytes(buffer[value:line_end]))
+            start = end + 1
+        if start:
+            del buffer[:start]
+        return events
+
+    def flush(self) -> List[bytes]:
+        # A stream that ends without the final blank line still completes its last event.
+        if self._buffer:
+            self.feed(b"\n")
+        event = self._event()
+        return [event] if event is not None else []
+
+class NDJSONParser:
+    # Incremental newline-delimited JSON parser; returns complete lines.
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        buffer = self._buffer
+        buffer += chunk
+        lines = []
+        start = 0
+        while True:
+            end = buffer.find(b"\n", start)
+            if end == -1:
+                break
+            line = bytes(buffer[start:end]).strip()
+            if line:
+                lines.append(line)
+            start = end + 1
+        if start:
+            del buffer[:start]
+        return lines
+
+    def flush(self) -> List[bytes]:
+        line = bytes(self._buffer).strip()
+        self._buffer.clear()
+        return [line] if line else []
+
+def extract_content(chunk) -> Optional[str]:
+    # Only plain content deltas can use the template or be merged; anything
+    # with a role, tool call or finish_reason goes through the generic path.
+    # Providers may yield a bare content string to skip building a dict per token.
+    if isinstance(chunk, str):
+        return chunk
+    try:
+        choices = chunk["choices"]
+        if len(choices) != 1:
+            return None
+        choice = choices[0]
+        if len(choice) > 2 or (len(choice) == 2 and "index" not in choice):
+            return None
+        delta = choice["delta"]
+        if len(delta) != 1:
+            return None
+        content = delta["content"]
+    except (KeyError, TypeError, IndexError):
+        return None
+    return content if isinstance(content, str) else None
+
+class ChunkEncoder:
+    def __init__(self, model: str, completion_id: Optional[str] = None, created: Optional[int] = None):
+        self.id = completion_id or generate_id()
+        self.created = created or int(time.time())
+        self.model = model
+        head = dumps({"id": self.id, "object": "chat.completion.chunk", "created": self.created, "model": model})
+        self._prefix = b"data: " + head[:-1] + b',"choices":[{"index":0,"delta":{"content":'
+        self._suffix = b"}}]}\n\n"
+
+    def encode_content(self, content: str) -> bytes:
+        return self._prefix + dumps(content) + self._suffix
+
+    def encode(self, chunk) -> bytes:
+        if isinstance(chunk, RawChunk):
+            return b"data: " + chunk + b"\n\n"
+        content = extract_content(chunk)
+        if content is not None:
+            return self.encode_content(content)
+        if isinstance(chunk, dict):
+            chunk = {"object": "chat.completion.chunk", "model": self.model, **chunk, "id": self.id, "created": self.created}
+        return b"data: " + dumps(chunk) + b"\n\n"
+
+async def encode_stream(
+    chunks: AsyncIterator,
+    encoder: ChunkEncoder,
+    coalesce_ms: float = STREAM_COALESCE_MS,
+    coalesce_bytes: int = STREAM_COALESCE_BYTES,
+) -> AsyncGenerator[bytes, None]:
+    if coalesce_ms <= 0:
+        async for chunk in chunks:
+            yield encoder.encode(chunk)
+        return
+
+    # Merge consecutive content deltas until the window elapses or the buffer
+    # reaches coalesce_bytes, without delaying past the window when the
+    # upstream goes quiet.
+    window = coalesce_ms / 1000
+    iterator = chunks.__aiter__()
+    pending: List[str] = []
+    pending_size = 0
+    deadline = 0.0
+    next_chunk: Optional[asyncio.Future] = None
+    try:
+        while True:
+            if next_chunk is None:
+                next_chunk = asyncio.ensure_future(iterator.__anext__())
+            timeout = max(deadline - time.monotonic(), 0) if pending else None
+            done, _ = await asyncio.wait({next_chunk}, timeout=timeout)
+            if not done:
+                yield encoder.encode_content("".join(pending))
+                pending, pending_size = [], 0
+                continue
+
+            future, next_chunk = next_chunk, None
+            try:
+                chunk = future.result()
+            except StopAsyncIteration:
+                break
+
+            content = extract_content(chunk)
+            if content is None:
+                if pending:
+                    yield encoder.encode_content("".join(pending))
+                    pending, pending_size = [], 0
+                yield encoder.encode(chunk)
+                continue
+
+            if not pending:
+                deadline = time.monotonic() + window
+            pending.append(content)
+            pending_size += len(content)
+            if pending_size >= coalesce_bytes:
+                yield encoder.encode_content("".join(pending))
+                pending, pending_size = [], 0
+
+        if pending:
+            yield encoder.encode_content("".join(pending))
+    finally:
+        if next_chunk is not None and not next_chunk.done():
+            next_chunk.cancel()
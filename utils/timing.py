@@ -0,0 +1,173 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+from utils.looplag import LoopLagMonitor
+
+logger = logging.getLogger(__name__)
+
+# Sends the stage breakdown to every client (Server-Timing header, and an
+# `event: timing` frame after [DONE] on streams). Off by default: it exposes
+# internal timings, and strict SSE clients may choke on the extra event.
+# Requests carrying the profile token always get it.
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") == "1"
+TIMING_PROFILE_SAMPLE = float(os.getenv("TIMING_PROFILE_SAMPLE", "0"))
+# Requests carrying this value in the profile header are always profiled.
+TIMING_PROFILE_TOKEN = os.getenv("TIMING_PROFILE_TOKEN", "")
+TIMING_PROFILE_HEADER = "x-astra-profile"
+TIMING_PROFILE_FILE = os.getenv("TIMING_PROFILE_FILE", "profiles/timing.jsonl")
+TIMING_PROFILE_QUEUE = int(os.getenv("TIMING_PROFILE_QUEUE", "10000"))
+TIMING_PROFILE_FLUSH_INTERVAL = float(os.getenv("TIMING_PROFILE_FLUSH_INTERVAL", "2"))
+
+class RequestTimer:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+
+    def add(self, name: str, duration: float) -> None:
+        # Repeated stages (two user lookups, several usage writes) accumulate.
+        self.spans[name] = self.spans.get(name, 0.0) + duration
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def breakdown(self) -> Dict[str, float]:
+        stages = {name: round(duration * 1000, 3) for name, duration in self.spans.items()}
+        stages["total"] = round(self.elapsed() * 1000, 3)
+        return stages
+
+    def header(self) -> str:
+        return ", ".join(f"{name};dur={ms:.1f}" for name, ms in self.breakdown().items())
+
+    def event(self) -> bytes:
+        return b"event: timing\ndata: " + json.dumps(self.breakdown(), separators=(",", ":")).encode() + b"\n\n"
+
+def timing_exposed(headers) -> bool:
+    return SERVER_TIMING or bool(TIMING_PROFILE_TOKEN and headers.get(TIMING_PROFILE_HEADER) == TIMING_PROFILE_TOKEN)
+
+_timer: ContextVar[Optional[RequestTimer]] = ContextVar("request_timer", default=None)
+
+def start_timer() -> RequestTimer:
+    timer = RequestTimer()
+    _timer.set(timer)
+    return timer
+
+def current_timer() -> Optional[RequestTimer]:
+    return _timer.get()
+
+class span:
+    # `with span("auth"):` adds the block's duration to the current request's
+    # timer; outside a request it does nothing.
+    __slots__ = ("name", "timer", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.timer = _timer.get()
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self.timer is not None:
+            self.timer.add(self.name, time.perf_counter() - self.start)
+
+class TimingProfiler:
+    # Writes one JSON line per profiled request with its stage breakdown and
+    # the event loop lag seen while it ran. Off unless a sample rate or an
+    # admin token is configured.
+    def __init__(
+        self,
+        path: str = TIMING_PROFILE_FILE,
+        sample: float = TIMING_PROFILE_SAMPLE,
+        token: str = TIMING_PROFILE_TOKEN,
+        queue_size: int = TIMING_PROFILE_QUEUE,
+        flush_interval: float = TIMING_PROFILE_FLUSH_INTERVAL,
+    ):
+        self.path = path
+        self.sample = sample
+        self.token = token
+        self.flush_interval = flush_interval
+        self.loop_lag = LoopLagMonitor()
+        self._buffer: deque = deque(maxlen=queue_size)
+        self._task: Optional[asyncio.Task] = None
+        self.dropped = 0
+        self.written = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample > 0 or bool(self.token)
+
+    def sampled(self, headers) -> bool:
+        if self.token and headers.get(TIMING_PROFILE_HEADER) == self.token:
+            return True
+        return self.sample > 0 and random.random() < self.sample
+
+    def mark(self) -> int:
+        return self.loop_lag.taken
+
+    def record(self, timer: RequestTimer, mark: int, **fields) -> None:
+        lags = self.loop_lag.since(mark)
+        entry = {
+            "ts": round(time.time(), 4),
+            **fields,
+            "stages": timer.breakdown(),
+            "loop_lag_ms": {
+                "samples": len(lags),
+                "max": round(max(lags, default=0.0) * 1000, 3),
+                "mean": round(sum(lags) / len(lags) * 1000, 3) if lags else 0.0,
+            },
+        }
+        if len(self._buffer) == self._buffer.maxlen:
+            self.dropped += 1
+        self._buffer.append(entry)
+
+    def _write(self, lines: List[str]) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(lines))
+
+    async def flush(self) -> None:
+        if not self._buffer:
+            return
+        lines = []
+        while self._buffer:
+            lines.append(json.dumps(self._buffer.popleft(), separators=(",", ":")) + "\n")
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, lines)
+            self.written += len(lines)
+        except Exception as e:
+            self.dropped += len(lines)
+            logger.error(f"Failed to write timing profile: {e}")
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self) -> None:
+        if self._task is None and self.enabled:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.loop_lag.start()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            await self.loop_lag.stop()
+        await self.flush()
+
+timing_profiler = TimingProfiler()